@@ -2,17 +2,37 @@
 Analyze original race results and give back canned reports
 author: Jose Vicente Nunez <kodegeek.com@protonmail.com>
 """
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+from collections import Counter, OrderedDict
 from datetime import timedelta
 from enum import Enum
-from typing import Any
+from pathlib import Path
+from typing import Any, NamedTuple
 
 import numpy as np
 import pandas as pd
 from pandas import Categorical, DataFrame, Series
 
-from empirestaterunup.data import RaceFields
+from empirestaterunup.cache import CACHE_DIR
+from empirestaterunup.data import TIME_FIELDS, RaceFields, as_duration
 
 SUMMARY_METRICS = (RaceFields.AGE, RaceFields.TIME)
+FIVE_NUMBER_FIELDS = ('count', 'mean', 'std', 'min', 'max', '25%', '50%', '75%')
+SNAPSHOT_DIR = CACHE_DIR.joinpath('snapshots')
+SNAPSHOT_VERSION = 1
+MAX_SNAPSHOTS = 16
+COUNT_BY_AGE = 'count_by_age'
+COUNT_BY_GENDER = 'count_by_gender'
+AGE_BUCKETS = 'age_buckets'
+TIME_BUCKETS = 'time_buckets'
+COUNTRY_COUNTS = 'country_counts'
+FASTEST_CATEGORY = "category"
+FASTEST_RANK = "rank"
 
 
 class FastestFilters(Enum):
@@ -28,6 +48,8 @@ def get_5_number(criteria: str, data: DataFrame) -> DataFrame:
     """
     Get the 5 number stats using Pandas
     """
+    if criteria in TIME_FIELDS:
+        return as_duration(data[criteria]).describe()
     return data[criteria].describe()
 
 
@@ -44,6 +66,7 @@ def count_by_gender(data: DataFrame) -> tuple[DataFrame, tuple[str, str]]:
     Counts by gender
     """
     counts = data[RaceFields.GENDER.value].value_counts().sort_index()
+    counts = counts[counts > 0]  # Categorical columns (compact layout) count every category
     return counts.rename_axis(RaceFields.GENDER.value).reset_index(name='Count'), ('Gender', 'Count')
 
 
@@ -54,6 +77,41 @@ def dt_to_sorted_dict(df: DataFrame | Series) -> dict[str, Any]:
     return dict(sorted(df.to_dict().items(), key=lambda item: item[1], reverse=True))
 
 
+class OutlierMethod(Enum):
+    """
+    Supported outlier detection methods
+    """
+    ZSCORE = 'zscore'  # Distance to the mean, in standard deviations
+    IQR = 'iqr'  # Tukey fences, distance outside the interquartile range, in IQRs
+    MAD = 'mad'  # Robust (modified) z-score, distance to the median in median absolute deviations
+
+
+class OutlierGroups(Enum):
+    """
+    Runner groups for outlier detection, each group gets its own statistics
+    """
+    GENDER = 'gender'
+    AGE = 'age'
+
+
+DEFAULT_OUTLIER_THRESHOLDS = {
+    OutlierMethod.ZSCORE: 3.0,
+    OutlierMethod.IQR: 1.5,
+    OutlierMethod.MAD: 3.5
+}
+MAD_SCALE = 0.6745
+MEAN_AD_SCALE = 1.253314
+
+
+def _as_numbers(series: Series) -> Series:
+    """
+    Race times as seconds, everything else as floats, so all the methods can work on the same values
+    """
+    if series.name in TIME_FIELDS:
+        return as_duration(series).dt.total_seconds()
+    return series.astype(float)
+
+
 def get_zscore(df: DataFrame, column: str):
     """
     Get Z-score for given column
@@ -64,12 +122,159 @@ def get_zscore(df: DataFrame, column: str):
     return (filtered - mean) / std
 
 
-def get_outliers(df: DataFrame, column: str, std_threshold: int = 3) -> Series:
+def outlier_groups(df: DataFrame, group_by: OutlierGroups | Series = None) -> Series | None:
+    """
+    Group of each runner for outlier detection, None if runners are not grouped
+    """
+    if group_by == OutlierGroups.AGE:
+        return age_bins(df)[0]
+    if group_by == OutlierGroups.GENDER:
+        return df[RaceFields.GENDER.value]
+    return group_by
+
+
+def get_outliers(
+        df: DataFrame,
+        column: str,
+        std_threshold: float = None,
+        method: OutlierMethod = OutlierMethod.ZSCORE,
+        group_by: OutlierGroups | Series = None
+) -> Series:
     """
-    Use the z-score, anything further away than 3 standard deviations is considered an outlier.
+    Find the outliers of a column, by default anything further away than 3 standard deviations from the mean.
+    Args:
+        df: DataFrame to analyze
+        column: Column to check
+        std_threshold: Distance from the center that makes a value an outlier, defaults to DEFAULT_OUTLIER_THRESHOLDS
+        method: Outlier detection method
+        group_by: Group runners (by gender, age bucket or any aligned Series) and find the outliers inside each group
+    Returns:
+        Original values of the outliers
     """
-    z_scores = get_zscore(df=df, column=column)
-    return df[column][np.abs(z_scores) > std_threshold]
+    threshold = DEFAULT_OUTLIER_THRESHOLDS[method] if std_threshold is None else std_threshold
+    values = _as_numbers(df[column])
+    groups = outlier_groups(df, group_by)
+    keys = np.zeros(values.shape[0], dtype=int) if groups is None else pd.factorize(groups)[0]
+    grouped = values.groupby(keys)
+    if method == OutlierMethod.ZSCORE:
+        std = grouped.transform('std', ddof=0)
+        is_outlier = ((values - grouped.transform('mean')).abs() / std) > threshold
+    elif method == OutlierMethod.IQR:
+        q1 = grouped.transform('quantile', 0.25)
+        q3 = grouped.transform('quantile', 0.75)
+        iqr = q3 - q1
+        is_outlier = (values < q1 - threshold * iqr) | (values > q3 + threshold * iqr)
+    else:
+        median = grouped.transform('median')
+        deviation = (values - median).abs()
+        spread = deviation.groupby(keys).transform('median') / MAD_SCALE
+        # More than half of the group shares the median, use the mean absolute deviation instead
+        spread = spread.where(spread > 0, deviation.groupby(keys).transform('mean') * MEAN_AD_SCALE)
+        is_outlier = (deviation / spread) > threshold
+    # Runners without a group are never outliers
+    return df[column][(is_outlier & (keys >= 0)).to_numpy()]
+
+
+class StreamingOutlierDetector:
+    """
+    One pass outlier detection, for results that arrive one runner at a time.
+    Keeps running moments (Welford's algorithm) per group, each new value is compared against the values
+    seen so far, then added to them.
+    """
+
+    def __init__(self, std_threshold: float = DEFAULT_OUTLIER_THRESHOLDS[OutlierMethod.ZSCORE], min_samples: int = 30):
+        """
+        Args:
+            std_threshold: Distance to the running mean, in standard deviations, that makes a value an outlier
+            min_samples: Values seen on a group before it can flag outliers
+        """
+        self.std_threshold = std_threshold
+        self.min_samples = min_samples
+        self.moments: dict[Any, tuple[int, float, float]] = {}
+
+    def mean(self, group: Any = None) -> float:
+        """
+        Running mean of a group
+        """
+        return self.moments.get(group, (0, np.nan, 0.0))[1]
+
+    def std(self, group: Any = None) -> float:
+        """
+        Running (population) standard deviation of a group
+        """
+        count, _, m2 = self.moments.get(group, (0, np.nan, 0.0))
+        return np.sqrt(m2 / count) if count else np.nan
+
+    def update(self, value: Any, group: Any = None) -> bool:
+        """
+        Add a value to its group
+        Args:
+            value: New value, race times can be timedelta
+            group: Group of the runner, like the gender
+        Returns:
+            True if the value is an outlier, compared with the values seen before on the group
+        """
+        if isinstance(value, timedelta):
+            value = value.total_seconds()
+        if pd.isna(value):
+            return False
+        value = float(value)
+        count, mean, m2 = self.moments.get(group, (0, 0.0, 0.0))
+        is_outlier = False
+        if count >= self.min_samples and m2 > 0:
+            is_outlier = abs(value - mean) / np.sqrt(m2 / count) > self.std_threshold
+        count += 1
+        delta = value - mean
+        mean += delta / count
+        m2 += delta * (value - mean)
+        self.moments[group] = (count, mean, m2)
+        return is_outlier
+
+    def remove(self, value: Any, group: Any = None) -> None:
+        """
+        Take back a value added before, like the previous time of a runner whose result was corrected
+        Args:
+            value: Value given to update
+            group: Group it was added to
+        """
+        if isinstance(value, timedelta):
+            value = value.total_seconds()
+        if pd.isna(value) or group not in self.moments:
+            return
+        value = float(value)
+        count, mean, m2 = self.moments[group]
+        if count <= 1:
+            del self.moments[group]
+            return
+        previous_mean = (count * mean - value) / (count - 1)
+        m2 = max(m2 - (value - mean) * (value - previous_mean), 0.0)
+        self.moments[group] = (count - 1, previous_mean, m2)
+
+    def remove_frame(self, df: DataFrame, column: str, group_by: str | OutlierGroups | Series = None) -> None:
+        """
+        Take back the runners of a DataFrame added before, see remove
+        """
+        values = _as_numbers(df[column]).tolist()
+        groups = df[group_by] if isinstance(group_by, str) else outlier_groups(df, group_by)
+        groups = [None] * len(values) if groups is None else groups.tolist()
+        for value, group in zip(values, groups, strict=True):
+            self.remove(value, group)
+
+    def update_frame(self, df: DataFrame, column: str, group_by: str | OutlierGroups | Series = None) -> Series:
+        """
+        Add the runners of a DataFrame, in order, like new results on a live race
+        Args:
+            df: New runners
+            column: Column to check
+            group_by: Column name, runner groups (see outlier_groups) or a Series with the group of each runner
+        Returns:
+            Original values of the runners flagged as outliers when they arrived
+        """
+        values = _as_numbers(df[column]).tolist()
+        groups = df[group_by] if isinstance(group_by, str) else outlier_groups(df, group_by)
+        groups = [None] * len(values) if groups is None else groups.tolist()
+        flags = [self.update(value, group) for value, group in zip(values, groups, strict=True)]
+        return df[column][np.array(flags, dtype=bool)]
 
 
 def age_bins(df: DataFrame) -> tuple[Categorical, tuple[str, str]]:
@@ -84,7 +289,7 @@ def time_bins(df: DataFrame) -> tuple[Categorical, tuple[str, str]]:
     """
     Group finish times into time buckets
     """
-    bins = pd.cut(df[RaceFields.TIME.value], [timedelta(minutes=i * 10) for i in range(13)], right=False)
+    bins = pd.cut(as_duration(df[RaceFields.TIME.value]), [timedelta(minutes=i * 10) for i in range(13)], right=False)
     return bins.rename('Time Bucket'), ('Time', 'Count')
 
 
@@ -98,12 +303,38 @@ def get_country_counts(df: DataFrame, min_participants: int = 5, max_participant
     """
     countries = df[RaceFields.COUNTRY.value]
     counts = countries.value_counts()
+    counts = counts[counts > 0]  # Categorical columns (compact layout) count every category
     min_count_filter = counts[counts > min_participants]
     max_count_filter = counts[counts < max_participants]
     others = pd.Series({'Others': counts.sum()})
     return counts, pd.concat([min_count_filter, others]), max_count_filter
 
 
+def fastest_by(df: DataFrame, group: str | Series, top_n: int = 1, keep_ties: bool = False) -> DataFrame:
+    """
+    Fastest runners per category, in a single grouped pass over the finish times.
+    Args:
+        df: DataFrame to analyze
+        group: Column name, or a Series aligned with df (like the age buckets), with the category of each runner
+        top_n: Number of runners to keep per category
+        keep_ties: Keep every runner tied with the last place, so a category may return more than top_n runners
+    Returns:
+        The selected runners, with the category (named after group, or FASTEST_CATEGORY if unnamed) and
+        the rank inside the category (FASTEST_RANK).
+        Categories come in order of first appearance, runners are sorted by rank inside each category.
+    """
+    keys = df[group] if isinstance(group, str) else group
+    codes, _ = pd.factorize(keys, sort=False)
+    times = as_duration(df[RaceFields.TIME.value])
+    ranks = times.groupby(codes).rank(method='min' if keep_ties else 'first').to_numpy()
+    selected = np.flatnonzero((codes >= 0) & (ranks <= top_n))
+    selected = selected[np.lexsort((ranks[selected], codes[selected]))]
+    return df.iloc[selected].assign(**{
+        FASTEST_CATEGORY if keys.name is None else keys.name: keys.to_numpy()[selected],
+        FASTEST_RANK: ranks[selected].astype(int)
+    })
+
+
 def find_fastest(df: DataFrame, criteria: FastestFilters) -> dict[str, Any]:
     """
     Find the fastest runners, per category
@@ -111,34 +342,259 @@ def find_fastest(df: DataFrame, criteria: FastestFilters) -> dict[str, Any]:
     :param criteria Filtering rules
     :return Dictionary with the fastest runners, includes criteria and value
     """
-    results = {}
     if criteria == FastestFilters.AGE:
-        bins = pd.cut(df[RaceFields.AGE.value], range(10, 110, 10), right=False)
-        for bucket in bins.unique():
-            runners_by_bucket = df[bins == bucket]
-            fastest_time = runners_by_bucket[RaceFields.TIME.value].min()
-            fastest_runner = runners_by_bucket[runners_by_bucket[RaceFields.TIME.value] == fastest_time]
-            results[str(bucket)] = {
-                "name": fastest_runner.iloc[0][RaceFields.NAME.value],
-                "age": int(fastest_runner.iloc[0][RaceFields.AGE.value]),
-                "time": fastest_time
-            }
+        group = pd.cut(df[RaceFields.AGE.value], range(10, 110, 10), right=False).rename('Age Bucket')
     elif criteria == FastestFilters.GENDER:
-        for gender in df[RaceFields.GENDER.value].unique():
-            runners_by_gender = df[df[RaceFields.GENDER.value] == gender]
-            fastest_time = runners_by_gender[RaceFields.TIME.value].min()
-            fastest_runner = runners_by_gender[runners_by_gender[RaceFields.TIME.value] == fastest_time]
-            results[gender] = {
-                "name": fastest_runner.iloc[0][RaceFields.NAME.value],
-                "time": fastest_time
-            }
+        group = df[RaceFields.GENDER.value]
     elif criteria == FastestFilters.COUNTRY:
-        for country in df[RaceFields.COUNTRY.value].unique():
-            runners_by_country = df[df[RaceFields.COUNTRY.value] == country]
-            fastest_time = runners_by_country[RaceFields.TIME.value].min()
-            fastest_runner = runners_by_country[runners_by_country[RaceFields.TIME.value] == fastest_time]
-            results[country] = {
-                "name": fastest_runner.iloc[0][RaceFields.NAME.value],
-                "time": fastest_time
+        group = df[RaceFields.COUNTRY.value]
+    else:
+        return {}
+    fastest = fastest_by(df, group)
+    names = fastest[RaceFields.NAME.value].tolist()
+    times = as_duration(fastest[RaceFields.TIME.value]).tolist()
+    categories = fastest[group.name].tolist()
+    if criteria == FastestFilters.AGE:
+        ages = fastest[RaceFields.AGE.value].tolist()
+        return {
+            str(bucket): {"name": name, "age": int(age), "time": time}
+            for bucket, name, age, time in zip(categories, names, ages, times, strict=True)
+        }
+    return {
+        category: {"name": name, "time": time}
+        for category, name, time in zip(categories, names, times, strict=True)
+    }
+
+
+def dataset_fingerprint(df: DataFrame) -> str:
+    """
+    Digest of the DataFrame contents (values and index), identical data gives the same fingerprint
+    """
+    digest = hashlib.sha256(str(tuple(df.columns)).encode('utf-8'))
+    digest.update(pd.util.hash_pandas_object(df, index=True).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+def summarize(df: DataFrame) -> dict[str, dict[str, float]]:
+    """
+    Five number summary of each SUMMARY_METRICS column, race times are in minutes.
+    Statistics that cannot be computed (like the standard deviation of a single runner) are NaN.
+    """
+    summary = {}
+    for metric in SUMMARY_METRICS:
+        description = get_5_number(criteria=metric.value, data=df)
+        summary[metric.value] = {
+            field: float('nan') if pd.isna(value) else (
+                value.total_seconds() / 60.0 if isinstance(value, timedelta) else float(value)
+            )
+            for field, value in description[list(FIVE_NUMBER_FIELDS)].items()
+        }
+    return summary
+
+
+def count_categories(df: DataFrame) -> dict[str, Series]:
+    """
+    Runner counts by age, gender, age bucket, time bucket and country, keyed by the AnalysisSnapshot field names.
+    Buckets are labeled with their string representation.
+    """
+    age_counts, _ = count_by_age(df)
+    gender_counts, _ = count_by_gender(df)
+    age_categories, _ = age_bins(df)
+    time_categories, _ = time_bins(df)
+    countries_counts, _, _ = get_country_counts(df)
+    age_bucket_counts = age_categories.value_counts(sort=False)
+    time_bucket_counts = time_categories.value_counts(sort=False)
+    return {
+        COUNT_BY_AGE: age_counts.set_index(RaceFields.AGE.value)['Count'],
+        COUNT_BY_GENDER: gender_counts.set_index(RaceFields.GENDER.value)['Count'],
+        AGE_BUCKETS: Series(age_bucket_counts.to_numpy(), index=age_bucket_counts.index.astype(str)),
+        TIME_BUCKETS: Series(time_bucket_counts.to_numpy(), index=time_bucket_counts.index.astype(str)),
+        COUNTRY_COUNTS: countries_counts
+    }
+
+
+class AnalysisSnapshot(NamedTuple):
+    """
+    All the summary statistics of a dataset, ready to be displayed. Race times on the summary are in minutes.
+    Counters are (category, count) rows, sorted by count.
+    """
+    fingerprint: str
+    runners: int
+    summary: dict[str, dict[str, float]]
+    count_by_age: list[tuple[int, int]]
+    count_by_gender: list[tuple[str, int]]
+    age_buckets: list[tuple[str, int]]
+    time_buckets: list[tuple[str, int]]
+    country_counts: list[tuple[str, int]]
+
+    @staticmethod
+    def compute(df: DataFrame, fingerprint: str = None) -> 'AnalysisSnapshot':
+        """
+        Calculate all the statistics in one go, sharing the intermediate results
+        Args:
+            df: DataFrame to analyze
+            fingerprint: Fingerprint of df, calculated if missing
+        """
+        counters = count_categories(df)
+        return AnalysisSnapshot(
+            fingerprint=dataset_fingerprint(df) if fingerprint is None else fingerprint,
+            runners=df.shape[0],
+            summary=summarize(df),
+            **{
+                name: [(key, int(count)) for key, count in dt_to_sorted_dict(counts).items()]
+                for name, counts in counters.items()
             }
-    return results
+        )
+
+    def save(self, snapshot_file: Path) -> None:
+        """
+        Write the snapshot as JSON, the write is atomic
+        """
+        snapshot_file.parent.mkdir(parents=True, exist_ok=True)
+        fd, work_file = tempfile.mkstemp(prefix=f".{snapshot_file.name}-", dir=snapshot_file.parent)
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump({'snapshot_version': SNAPSHOT_VERSION, **self._asdict()}, f)
+            os.replace(work_file, snapshot_file)
+        except BaseException:
+            Path(work_file).unlink(missing_ok=True)
+            raise
+
+    @staticmethod
+    def load(snapshot_file: Path) -> 'AnalysisSnapshot | None':
+        """
+        Read a snapshot saved with save, None if the file is missing or unreadable
+        """
+        try:
+            with open(snapshot_file, encoding='utf-8') as f:
+                data = json.load(f)
+            if data.pop('snapshot_version', None) != SNAPSHOT_VERSION:
+                return None
+            return AnalysisSnapshot(**{
+                field: [tuple(row) for row in value] if isinstance(value, list) else value
+                for field, value in data.items()
+            })
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, TypeError) as err:
+            logging.warning(f"Ignoring unreadable snapshot {snapshot_file}: {err}")
+            return None
+
+
+class LiveChanges(NamedTuple):
+    """
+    Keys touched by a LiveAggregates update, per counter name and per fastest runner criteria
+    """
+    counters: dict[str, set]
+    fastest: dict[FastestFilters, set]
+
+
+class LiveAggregates:
+    """
+    Runner counters and fastest runners of a growing dataset, like live race results.
+    Each batch of new results updates them, without going over the previous results again.
+    """
+
+    def __init__(self, df: DataFrame = None):
+        """
+        Args:
+            df: Results known so far, if any
+        """
+        self.counters: dict[str, Counter] = {
+            name: Counter() for name in (COUNT_BY_AGE, COUNT_BY_GENDER, AGE_BUCKETS, TIME_BUCKETS, COUNTRY_COUNTS)
+        }
+        self.fastest: dict[FastestFilters, dict[Any, dict[str, Any]]] = {criteria: {} for criteria in FastestFilters}
+        if df is not None and not df.empty:
+            self.update(df=df, batch=df)
+
+    def update(self, df: DataFrame, batch: DataFrame, replaced: DataFrame = None) -> LiveChanges:
+        """
+        Add a batch of results
+        Args:
+            df: All the results, batch included (see merge_results)
+            batch: New results
+            replaced: Previous records of the runners updated by the batch
+        Returns:
+            What changed
+        """
+        changes = LiveChanges(counters={name: set() for name in self.counters}, fastest={})
+        for name, counts in count_categories(batch).items():
+            self.counters[name].update(counts.to_dict())
+            changes.counters[name].update(counts.index[counts > 0])
+        if replaced is not None and not replaced.empty:
+            for name, counts in count_categories(replaced).items():
+                self.counters[name].subtract(counts.to_dict())
+                changes.counters[name].update(counts.index[counts > 0])
+            # A corrected result can take away a record, the fastest runners are searched again
+            for criteria in FastestFilters:
+                previous = self.fastest[criteria]
+                self.fastest[criteria] = find_fastest(df, criteria)
+                changes.fastest[criteria] = {
+                    key for key, runner in self.fastest[criteria].items() if previous.get(key) != runner
+                }
+            return changes
+        for criteria in FastestFilters:
+            changes.fastest[criteria] = set()
+            for key, runner in find_fastest(batch, criteria).items():
+                current = self.fastest[criteria].get(key)
+                if current is None or runner['time'] < current['time']:
+                    self.fastest[criteria][key] = runner
+                    changes.fastest[criteria].add(key)
+        return changes
+
+
+def summary_changed(batch: DataFrame, replaced: DataFrame) -> bool:
+    """
+    Whether a batch of live results (see merge_results) changes the summarize output: new runners always do,
+    runners reported again only if one of their SUMMARY_METRICS values changed
+    """
+    latest = batch[~batch.index.duplicated(keep='last')]
+    if replaced.shape[0] < latest.shape[0]:
+        return True
+    for metric in SUMMARY_METRICS:
+        previous = _as_numbers(replaced[metric.value]).to_numpy()
+        current = _as_numbers(latest.loc[replaced.index, metric.value]).to_numpy()
+        if not np.array_equal(previous, current, equal_nan=True):
+            return True
+    return False
+
+
+_SNAPSHOTS: OrderedDict[str, AnalysisSnapshot] = OrderedDict()
+"""
+Snapshots are requested from worker threads (TUI workers, API requests), the lock is not held while computing
+"""
+_SNAPSHOTS_LOCK = threading.Lock()
+
+
+def get_snapshot(df: DataFrame, snapshot_dir: Path = None, use_disk: bool = True) -> AnalysisSnapshot:
+    """
+    Statistics snapshot for a dataset, memoized in memory and on disk per dataset fingerprint,
+    so identical data is only analyzed once, even across processes. Only the MAX_SNAPSHOTS most recently
+    used snapshots are kept in memory, live results get a new fingerprint on every batch.
+    Args:
+        df: DataFrame to analyze
+        snapshot_dir: Directory with the saved snapshots, defaults to SNAPSHOT_DIR
+        use_disk: Read and write snapshots on disk, besides the in memory copy
+    """
+    fingerprint = dataset_fingerprint(df)
+    with _SNAPSHOTS_LOCK:
+        snapshot = _SNAPSHOTS.get(fingerprint)
+        if snapshot is not None:
+            _SNAPSHOTS.move_to_end(fingerprint)
+            return snapshot
+    snapshot_file = (SNAPSHOT_DIR if snapshot_dir is None else snapshot_dir).joinpath(f"{fingerprint}.json")
+    if use_disk:
+        snapshot = AnalysisSnapshot.load(snapshot_file)
+    if snapshot is None:
+        snapshot = AnalysisSnapshot.compute(df, fingerprint=fingerprint)
+        if use_disk:
+            try:
+                snapshot.save(snapshot_file)
+            except OSError as err:
+                logging.warning(f"Could not save snapshot {snapshot_file}: {err}")
+    with _SNAPSHOTS_LOCK:
+        _SNAPSHOTS[fingerprint] = snapshot
+        _SNAPSHOTS.move_to_end(fingerprint)
+        while len(_SNAPSHOTS) > MAX_SNAPSHOTS:
+            _SNAPSHOTS.popitem(last=False)
+    return snapshot
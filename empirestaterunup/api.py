@@ -0,0 +1,317 @@
+"""
+Read only JSON API with the same statistics as the applications, for dashboards and other programs that poll them.
+Responses are cached, and tagged (ETag) with the fingerprint of the race year they come from, so clients sending
+If-None-Match get a 304 without any work until the data changes.
+Race times are in seconds, except on the five number summary that keeps minutes, like esru_numbers.
+author: Jose Vicente Nunez <kodegeek.com@protonmail.com>
+"""
+import asyncio
+import datetime
+import hashlib
+import json
+import logging
+import math
+from argparse import ArgumentParser
+from collections import OrderedDict
+from collections.abc import Callable
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+import pandas
+from aiohttp import web
+
+from empirestaterunup.analyze import (
+    SUMMARY_METRICS,
+    FastestFilters,
+    OutlierGroups,
+    OutlierMethod,
+    dataset_fingerprint,
+    find_fastest,
+    get_outliers,
+    get_snapshot,
+)
+from empirestaterunup.data import (
+    DEFAULT_YEAR,
+    FIELD_NAMES,
+    TIME_FIELDS,
+    RaceFields,
+    RaceStore,
+    as_duration,
+)
+
+API_PORT = 8001
+MAX_CACHED_RESPONSES = 512
+JSON_CONTENT_TYPE = "application/json"
+
+
+def to_json_value(value: Any) -> Any:
+    """
+    JSON friendly version of the values found on the results, race times become seconds
+    """
+    if isinstance(value, datetime.timedelta):
+        return value.total_seconds()
+    if isinstance(value, np.generic):
+        value = value.item()
+    if pandas.api.types.is_scalar(value) and pandas.isna(value):
+        return None
+    return value
+
+
+def without_nan(data: Any) -> Any:
+    """
+    Same data with the missing floats (NaN, like the standard deviation of a single runner) as None,
+    JSON has no NaN
+    """
+    if isinstance(data, float) and not math.isfinite(data):
+        return None
+    if isinstance(data, dict):
+        return {key: without_nan(value) for key, value in data.items()}
+    if isinstance(data, list | tuple):
+        return [without_nan(value) for value in data]
+    return data
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """
+    Whether an If-None-Match header matches an (unquoted) entity tag, with the weak comparison:
+    the header can be '*' or a list of tags, weak (W/) or not.
+    """
+    for tag in if_none_match.split(','):
+        tag = tag.strip()
+        if tag == '*':
+            return True
+        if tag.removeprefix('W/').strip('"') == etag:
+            return True
+    return False
+
+
+def _time_seconds(series: pandas.Series) -> pandas.Series:
+    return as_duration(series).dt.total_seconds()
+
+
+class ResultsApi:
+    """
+    Request handlers, with the response cache. One instance serves all the years of a RaceStore.
+    """
+
+    def __init__(self, store: RaceStore, snapshot_dir: Path = None, max_cached: int = MAX_CACHED_RESPONSES):
+        """
+        Args:
+            store: Race results to serve, they do not change while the API runs
+            snapshot_dir: Directory with the saved statistic snapshots, see get_snapshot
+            max_cached: Maximum number of responses kept in memory, least recently used are dropped first
+        """
+        self.store = store
+        self.snapshot_dir = snapshot_dir
+        self.max_cached = max_cached
+        self.fingerprints = {year: dataset_fingerprint(store.year(year)) for year in store.years}
+        self.responses: OrderedDict[str, tuple[str, bytes]] = OrderedDict()
+
+    def routes(self) -> list[web.RouteDef]:
+        return [
+            web.get('/api/years', self.get_years),
+            web.get('/api/{year}/summary', self.get_summary),
+            web.get('/api/{year}/buckets', self.get_buckets),
+            web.get('/api/{year}/countries', self.get_countries),
+            web.get('/api/{year}/outliers', self.get_outliers),
+            web.get('/api/{year}/fastest', self.get_fastest),
+            web.get('/api/{year}/runners/{bib}', self.get_runner),
+        ]
+
+    def _year(self, request: web.Request) -> int:
+        try:
+            year = int(request.match_info['year'])
+        except ValueError as err:
+            raise web.HTTPBadRequest(text=f"Invalid year: {request.match_info['year']}") from err
+        if year not in self.store:
+            raise web.HTTPNotFound(text=f"Year {year} is not available, available: {self.store.years}")
+        return year
+
+    async def _respond(self, request: web.Request, year: int, build: Callable[[], Any]) -> web.Response:
+        """
+        Cached JSON response. The ETag depends only on the dataset and the request, so a matching
+        If-None-Match is answered before building (or even looking up) the body.
+        """
+        key = f"{request.path}?{sorted(request.query.items())}"
+        request_digest = hashlib.sha256(key.encode('utf-8')).hexdigest()[:16]
+        etag = f"{self.fingerprints[year][:16]}-{request_digest}"
+        if etag_matches(request.headers.get('If-None-Match', ''), etag):
+            return web.Response(status=304, headers={'ETag': f'"{etag}"'})
+        cached = self.responses.get(key)
+        if cached is not None and cached[0] == etag:
+            self.responses.move_to_end(key)
+            body = cached[1]
+        else:
+            data = await asyncio.to_thread(build)
+            body = json.dumps(without_nan(data), default=to_json_value, allow_nan=False).encode('utf-8')
+            self.responses[key] = (etag, body)
+            while len(self.responses) > self.max_cached:
+                self.responses.popitem(last=False)
+        return web.Response(body=body, content_type=JSON_CONTENT_TYPE, headers={'ETag': f'"{etag}"'})
+
+    async def get_years(self, request: web.Request) -> web.Response:
+        """
+        Race years and the fingerprint (version) of their data
+        """
+        return web.json_response({'default': DEFAULT_YEAR, 'years': self.fingerprints})
+
+    async def get_summary(self, request: web.Request) -> web.Response:
+        """
+        Five number summaries of the age and the race time (in minutes), plus the runners by age and gender
+        """
+        year = self._year(request)
+
+        def build() -> dict[str, Any]:
+            snapshot = get_snapshot(self.store.year(year), snapshot_dir=self.snapshot_dir)
+            return {
+                'year': year,
+                'runners': snapshot.runners,
+                'summary': snapshot.summary,
+                'count_by_age': snapshot.count_by_age,
+                'count_by_gender': snapshot.count_by_gender
+            }
+        return await self._respond(request, year, build)
+
+    async def get_buckets(self, request: web.Request) -> web.Response:
+        """
+        Runners per age and race time bucket
+        """
+        year = self._year(request)
+
+        def build() -> dict[str, Any]:
+            snapshot = get_snapshot(self.store.year(year), snapshot_dir=self.snapshot_dir)
+            return {'year': year, 'age': snapshot.age_buckets, 'time': snapshot.time_buckets}
+        return await self._respond(request, year, build)
+
+    async def get_countries(self, request: web.Request) -> web.Response:
+        """
+        Runners per country
+        """
+        year = self._year(request)
+
+        def build() -> dict[str, Any]:
+            snapshot = get_snapshot(self.store.year(year), snapshot_dir=self.snapshot_dir)
+            return {'year': year, 'countries': snapshot.country_counts}
+        return await self._respond(request, year, build)
+
+    async def get_outliers(self, request: web.Request) -> web.Response:
+        """
+        Outliers of the age and the race time, same query options as esru_outlier:
+        method (zscore, iqr, mad), group_by (gender, age) and threshold.
+        """
+        year = self._year(request)
+        try:
+            method = OutlierMethod(request.query.get('method', OutlierMethod.ZSCORE.value))
+            group_by = OutlierGroups(request.query['group_by']) if 'group_by' in request.query else None
+            threshold = float(request.query['threshold']) if 'threshold' in request.query else None
+        except ValueError as err:
+            raise web.HTTPBadRequest(text=str(err)) from err
+
+        def build() -> dict[str, Any]:
+            df = self.store.year(year)
+            outliers = {}
+            for metric in SUMMARY_METRICS:
+                values = get_outliers(
+                    df=df, column=metric.value, std_threshold=threshold, method=method, group_by=group_by
+                )
+                if metric.value in TIME_FIELDS:
+                    values = _time_seconds(values)
+                names = df.loc[values.index, RaceFields.NAME.value]
+                outliers[metric.value] = [
+                    {'bib': bib, 'name': name, 'value': value}
+                    for bib, name, value in zip(values.index, names, values, strict=True)
+                ]
+            return {
+                'year': year,
+                'method': method.value,
+                'group_by': None if group_by is None else group_by.value,
+                'outliers': outliers
+            }
+        return await self._respond(request, year, build)
+
+    async def get_fastest(self, request: web.Request) -> web.Response:
+        """
+        Fastest runner per gender, age bucket and country. The category query option picks only one of them.
+        """
+        year = self._year(request)
+        try:
+            categories = [FastestFilters[request.query['category'].upper()]] if 'category' in request.query \
+                else list(FastestFilters)
+        except KeyError as err:
+            valid = [criteria.name.lower() for criteria in FastestFilters]
+            raise web.HTTPBadRequest(text=f"Invalid category, valid: {valid}") from err
+
+        def build() -> dict[str, Any]:
+            df = self.store.year(year)
+            return {
+                'year': year,
+                **{criteria.name.lower(): find_fastest(df, criteria) for criteria in categories}
+            }
+        return await self._respond(request, year, build)
+
+    async def get_runner(self, request: web.Request) -> web.Response:
+        """
+        Results of a single runner, by BIB
+        """
+        year = self._year(request)
+        try:
+            bib = int(request.match_info['bib'])
+        except ValueError as err:
+            raise web.HTTPBadRequest(text=f"Invalid BIB: {request.match_info['bib']}") from err
+        df = self.store.year(year)
+        positions = df.index.get_indexer_for([bib])
+        if positions[0] < 0:
+            raise web.HTTPNotFound(text=f"BIB {bib} did not run in {year}")
+        if len(positions) > 1:
+            raise web.HTTPConflict(text=f"BIB {bib} has {len(positions)} results in {year}")
+
+        def build() -> dict[str, Any]:
+            row = df.iloc[positions[0]]
+            runner = {RaceFields.BIB.value: bib, 'year': year}
+            for field in FIELD_NAMES:
+                if field == RaceFields.BIB.value:
+                    continue
+                value = row[field]
+                if field in TIME_FIELDS and not pandas.isna(value):
+                    value = as_duration(pandas.Series([value])).iloc[0]
+                runner[field] = to_json_value(value)
+            return runner
+        return await self._respond(request, year, build)
+
+
+def create_app(store: RaceStore = None, snapshot_dir: Path = None, **store_options: Any) -> web.Application:
+    """
+    aiohttp application with the API routes
+    Args:
+        store: Race results to serve, defaults to a RaceStore built with store_options
+        snapshot_dir: Directory with the saved statistic snapshots, see get_snapshot
+    """
+    def_store = RaceStore(**store_options) if store is None else store
+    app = web.Application()
+    app.add_routes(ResultsApi(store=def_store, snapshot_dir=snapshot_dir).routes())
+    return app
+
+
+def main():
+    """
+    Entry point for CLI application, runs only the API (see esru_server --api-port to run it next to the TUI)
+    """
+    parser = ArgumentParser(description="JSON API with the race statistics")
+    parser.add_argument(
+        "--port",
+        action="store",
+        type=int,
+        default=API_PORT,
+        help=f"Default port ({API_PORT})"
+    )
+    parser.add_argument(
+        "--cache-dir",
+        action="store",
+        type=Path,
+        default=None,
+        help="Results cache directory."
+    )
+    options = parser.parse_args()
+    logging.info(f"Serving the results API on port {options.port}")
+    web.run_app(create_app(cache_dir=options.cache_dir, compact=True), port=options.port)
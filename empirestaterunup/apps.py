@@ -3,41 +3,65 @@ Collection of applications to display race findings
 author: Jose Vicente Nunez <kodegeek.com@protonmail.com>
 """
 from enum import Enum
+from itertools import islice
 from pathlib import Path
+from typing import Any
 
 import matplotlib.pyplot as plt
-from pandas import DataFrame, Timedelta
+from matplotlib.figure import Figure
+from pandas import DataFrame, Series
 from rich.text import Text
 from textual import on, work
 from textual.app import App, ComposeResult, CSSPathType
 from textual.containers import Vertical
+from textual.coordinate import Coordinate
 from textual.driver import Driver
+from textual.timer import Timer
 from textual.widgets import DataTable, Footer, Header, Label
-from textual.worker import get_current_worker
+from textual.worker import Worker, get_current_worker
 
 from empirestaterunup.analyze import (
+    AGE_BUCKETS,
+    COUNT_BY_AGE,
+    COUNT_BY_GENDER,
+    COUNTRY_COUNTS,
+    FIVE_NUMBER_FIELDS,
     SUMMARY_METRICS,
+    TIME_BUCKETS,
+    AnalysisSnapshot,
     FastestFilters,
-    age_bins,
-    count_by_age,
-    count_by_gender,
-    dt_to_sorted_dict,
+    LiveAggregates,
+    LiveChanges,
+    OutlierGroups,
+    OutlierMethod,
+    StreamingOutlierDetector,
     find_fastest,
-    get_5_number,
-    get_country_counts,
     get_outliers,
-    time_bins,
+    get_snapshot,
+    summarize,
+    summary_changed,
 )
 from empirestaterunup.data import (
+    DEFAULT_YEAR,
+    FIELD_NAMES,
+    FIELD_NAMES_AND_POS,
+    TIME_FIELDS,
+    CountryIndex,
     RaceFields,
+    RaceStore,
+    ResultsTail,
+    as_duration,
     beautify_race_times,
     df_to_list_of_tuples,
-    load_country_details,
+    format_duration,
+    iter_rows,
+    load_country_index,
     load_json_data,
-    series_to_list_of_tuples,
+    merge_results,
 )
-from empirestaterunup.providers import BrowserAppCommand
+from empirestaterunup.providers import BrowserAppCommand, RunnerSearchIndex
 from empirestaterunup.screens import OutlierDetailScreen, RunnerDetailScreen
+from empirestaterunup.widgets import FrameTable, RunnerTable
 
 
 class FiveNumberApp(App):
@@ -45,8 +69,13 @@ class FiveNumberApp(App):
     Application to display 5 numbers
     """
     DF: DataFrame = None
-    BINDINGS = [("q", "quit_app", "Quit")]
-    FIVE_NUMBER_FIELDS = ('count', 'mean', 'std', 'min', 'max', '25%', '50%', '75%')
+    STORE: RaceStore = None
+    YEAR: int = DEFAULT_YEAR
+    SNAPSHOT_DIR: Path = None
+    TAIL: ResultsTail = None
+    FOLLOW_INTERVAL = 2.0
+    BINDINGS = [("q", "quit_app", "Quit"), ("y", "next_year", "Next year")]
+    FIVE_NUMBER_FIELDS = FIVE_NUMBER_FIELDS
     CSS_PATH = "five_numbers.tcss"
 
     class NumbersTables(Enum):
@@ -60,8 +89,18 @@ class FiveNumberApp(App):
         TIME_BUCKET = 'Time Bucket'
         COUNTRY_COUNTS = 'Country Counts'
 
+    COUNTER_TABLES = {
+        NumbersTables.COUNT_BY_AGE: (COUNT_BY_AGE, ('Age', 'Count')),
+        NumbersTables.GENDER_BUCKET: (COUNT_BY_GENDER, ('Gender', 'Count')),
+        NumbersTables.AGE_BUCKET: (AGE_BUCKETS, ('Age', 'Count')),
+        NumbersTables.TIME_BUCKET: (TIME_BUCKETS, ('Time', 'Count')),
+        NumbersTables.COUNTRY_COUNTS: (COUNTRY_COUNTS, ('Country', 'Count'))
+    }
     ENABLE_COMMAND_PALETTE = False
     current_sorts: set = set()
+    aggregates: LiveAggregates = None
+    follow_timer: Timer = None
+    follow_worker: Worker = None
 
     def action_quit_app(self):
         """
@@ -85,146 +124,136 @@ class FiveNumberApp(App):
             )
         yield Footer()
 
-    @work(exclusive=False, thread=True)
-    def update_summary(self, summary_table: DataTable) -> None:
-        columns = [x.title() for x in FiveNumberApp.FIVE_NUMBER_FIELDS]
-        columns.insert(0, 'Summary (Minutes)')
+    @work(exclusive=True, thread=True)
+    def update_tables(self) -> None:
+        """
+        Get the statistics snapshot of the current DataFrame and fill all the tables with it.
+        Live results change all the time, their snapshots are not saved.
+        """
+        snapshot = get_snapshot(
+            FiveNumberApp.DF,
+            snapshot_dir=FiveNumberApp.SNAPSHOT_DIR,
+            use_disk=FiveNumberApp.TAIL is None
+        )
         worker = get_current_worker()
         if not worker.is_cancelled:
-            self.call_from_thread(
-                summary_table.add_columns,
-                *columns
-            )
-            for metric in SUMMARY_METRICS:
-                ndf = get_5_number(criteria=metric.value, data=FiveNumberApp.DF)
-                rows = [ndf[field] for field in FiveNumberApp.FIVE_NUMBER_FIELDS]
-                rows.insert(0, metric.value.title())
-                rows[1] = int(rows[1])
-                for idx in range(2, len(rows)):  # Pretty print running times
-                    if isinstance(rows[idx], Timedelta):
-                        rows[idx] = f"{rows[idx].total_seconds() / 60.0:.2f}"
-                self.call_from_thread(
-                    summary_table.add_row,
-                    *rows
-                )
+            self.call_from_thread(self.fill_tables, snapshot)
 
-    @work(exclusive=False, thread=True)
-    def update_age_table(self, age_table: DataTable) -> None:
-        adf, age_header = count_by_age(FiveNumberApp.DF)
-        worker = get_current_worker()
-        if not worker.is_cancelled:
-            for column in age_header:
-                self.call_from_thread(
-                    age_table.add_column,
-                    column,
-                    key=column
-                )
-            self.call_from_thread(
-                age_table.add_rows,
-                dt_to_sorted_dict(adf).items()
-            )
+    def fill_tables(self, snapshot: AnalysisSnapshot) -> None:
+        """
+        Display the contents of a statistics snapshot
+        """
+        summary_table = self.get_widget_by_id(id=self.NumbersTables.SUMMARY.name, expect_type=DataTable)
+        columns = [x.title() for x in FiveNumberApp.FIVE_NUMBER_FIELDS]
+        columns.insert(0, 'Summary (Minutes)')
+        summary_table.add_columns(*columns)
+        summary_table.add_rows(self.summary_rows(snapshot.summary))
 
-    @work(exclusive=False, thread=True)
-    def update_gender_table(self, gender_table: DataTable) -> None:
-        gdf, gender_header = count_by_gender(FiveNumberApp.DF)
-        worker = get_current_worker()
-        if not worker.is_cancelled:
-            for column in gender_header:
-                self.call_from_thread(
-                    gender_table.add_column,
-                    column,
-                    key=column
-                )
-            gender_rows = dt_to_sorted_dict(gdf).items()
-            self.call_from_thread(
-                gender_table.add_rows,
-                gender_rows
-            )
+        for table_id, (counter, header) in FiveNumberApp.COUNTER_TABLES.items():
+            table = self.get_widget_by_id(id=table_id.name, expect_type=DataTable)
+            for column in header:
+                table.add_column(column, key=column)
+            for key, count in getattr(snapshot, counter):
+                table.add_row(key, count, key=str(key))
 
-    @work(exclusive=False, thread=True)
-    def update_age_bucket_table(self, age_bucket_table: DataTable) -> None:
-        age_categories, age_cols_head = age_bins(FiveNumberApp.DF)
-        worker = get_current_worker()
-        if not worker.is_cancelled:
-            for column in age_cols_head:
-                self.call_from_thread(
-                    age_bucket_table.add_column,
-                    column,
-                    key=column
-                )
-            self.call_from_thread(
-                age_bucket_table.add_rows,
-                dt_to_sorted_dict(age_categories.value_counts()).items()
-            )
+        for table in self.query(DataTable):
+            table.loading = False
+        self.notify(
+            message=f"All metrics were calculated for {snapshot.runners} runners.",
+            title="Race statistics status",
+            severity="information"
+        )
+        if FiveNumberApp.TAIL is not None and self.follow_timer is None:
+            self.follow_timer = self.set_interval(FiveNumberApp.FOLLOW_INTERVAL, self.check_results)
 
-    @work(exclusive=False, thread=True)
-    def update_time_bucket_table(self, time_bucket_table: DataTable) -> None:
-        time_categories, time_cols_head = time_bins(FiveNumberApp.DF)
-        worker = get_current_worker()
-        if not worker.is_cancelled:
-            for column in time_cols_head:
-                self.call_from_thread(
-                    time_bucket_table.add_column,
-                    column,
-                    key=column
-                )
-            times = dt_to_sorted_dict(time_categories.value_counts()).items()
-            self.call_from_thread(
-                time_bucket_table.add_rows,
-                times
-            )
+    @staticmethod
+    def summary_rows(summary: dict[str, dict[str, float]]) -> list[list[Any]]:
+        """
+        Summary table rows, race times are shown in minutes
+        """
+        rows = []
+        for metric in SUMMARY_METRICS:
+            stats = summary[metric.value]
+            row = [metric.value.title(), int(stats['count'])]
+            for field in FiveNumberApp.FIVE_NUMBER_FIELDS[1:]:
+                row.append(f"{stats[field]:.2f}" if metric.value in TIME_FIELDS else stats[field])
+            rows.append(row)
+        return rows
 
-    @work(exclusive=False, thread=True)
-    def update_country_counts_table(self, country_counts_table: DataTable) -> None:
-        countries_counts, _, _ = get_country_counts(FiveNumberApp.DF)
-        rows = series_to_list_of_tuples(countries_counts)
-        worker = get_current_worker()
-        if not worker.is_cancelled:
-            for column in ['Country', 'Count']:
-                self.call_from_thread(
-                    country_counts_table.add_column,
-                    column,
-                    key=column
-                )
-            self.call_from_thread(
-                country_counts_table.add_rows,
-                rows
-            )
+    def check_results(self) -> None:
+        """
+        Follow timer callback, a tick is skipped while the previous batch is still being applied
+        """
+        if self.follow_worker is None or self.follow_worker.is_finished:
+            self.follow_worker = self.follow_results()
 
-    async def on_mount(self) -> None:
+    @work(exclusive=False, thread=True, group='follow')
+    def follow_results(self) -> None:
         """
-        Initialize component contents
+        Apply the results appended to the followed file one chunk at a time, only the changed table rows are patched
         """
+        stale_summary = False
+        for batch in FiveNumberApp.TAIL.iter_read():
+            if self.aggregates is None:
+                self.aggregates = LiveAggregates(FiveNumberApp.DF)
+            FiveNumberApp.DF, replaced = merge_results(FiveNumberApp.DF, batch)
+            changes = self.aggregates.update(df=FiveNumberApp.DF, batch=batch, replaced=replaced)
+            stale_summary = stale_summary or summary_changed(batch, replaced)
+            self.call_from_thread(self.patch_tables, changes)
+        # The summary needs all the runners, it is computed once per tick and only if a summary metric changed
+        if stale_summary:
+            self.call_from_thread(self.patch_summary, summarize(FiveNumberApp.DF))
 
+    def patch_summary(self, summary: dict[str, dict[str, float]]) -> None:
+        """
+        Update the summary table after live results
+        """
         summary_table = self.get_widget_by_id(id=self.NumbersTables.SUMMARY.name, expect_type=DataTable)
-        summary_table.loading = False
-        self.update_summary(summary_table=summary_table)
-
-        age_table = self.get_widget_by_id(id=self.NumbersTables.COUNT_BY_AGE.name, expect_type=DataTable)
-        self.update_age_table(age_table=age_table)
-        age_table.loading = False
+        for row_idx, row in enumerate(self.summary_rows(summary)):
+            for column_idx, value in enumerate(row[1:], start=1):
+                summary_table.update_cell_at(Coordinate(row_idx, column_idx), value)
 
-        gender_table = self.get_widget_by_id(id=self.NumbersTables.GENDER_BUCKET.name, expect_type=DataTable)
-        self.update_gender_table(gender_table=gender_table)
-        gender_table.loading = False
-
-        age_bucket_table = self.get_widget_by_id(id=self.NumbersTables.AGE_BUCKET.name, expect_type=DataTable)
-        age_bucket_table.loading = False
-        self.update_age_bucket_table(age_bucket_table=age_bucket_table)
+    def patch_tables(self, changes: LiveChanges) -> None:
+        """
+        Update the counter cells that changed after a batch of live results
+        """
+        for table_id, (counter, _) in FiveNumberApp.COUNTER_TABLES.items():
+            table = self.get_widget_by_id(id=table_id.name, expect_type=DataTable)
+            for key in changes.counters[counter]:
+                count = self.aggregates.counters[counter][key]
+                if str(key) in table.rows:
+                    table.update_cell(str(key), 'Count', count)
+                else:
+                    table.add_row(key, count, key=str(key))
+        self.sub_title = f"Runners: {FiveNumberApp.DF.shape[0]} (Live: {FiveNumberApp.TAIL.data_file.name})"
 
-        time_bucket_table = self.get_widget_by_id(id=self.NumbersTables.TIME_BUCKET.name, expect_type=DataTable)
-        self.update_time_bucket_table(time_bucket_table=time_bucket_table)
-        time_bucket_table.loading = False
+    async def on_mount(self) -> None:
+        """
+        Initialize component contents
+        """
+        self.update_all_tables()
 
-        country_counts_table = self.get_widget_by_id(id=self.NumbersTables.COUNTRY_COUNTS.name, expect_type=DataTable)
-        self.update_country_counts_table(country_counts_table=country_counts_table)
-        country_counts_table.loading = False
+    def action_next_year(self) -> None:
+        """
+        Show the next race year, sliced from the race store without reloading any files
+        """
+        if FiveNumberApp.STORE is None or len(FiveNumberApp.STORE.years) < 2:
+            self.notify(message="Only one race year was loaded", title="Race statistics status", severity="warning")
+            return
+        FiveNumberApp.YEAR = FiveNumberApp.STORE.next_year(FiveNumberApp.YEAR)
+        FiveNumberApp.DF = FiveNumberApp.STORE.year(FiveNumberApp.YEAR)
+        self.sub_title = f"Runners: {FiveNumberApp.DF.shape[0]} (Year: {FiveNumberApp.YEAR})"
+        for table in self.query(DataTable):
+            table.clear(columns=True)
+        self.update_all_tables()
 
-        self.notify(
-            message=f"All metrics were calculated for {FiveNumberApp.DF.shape[0]} runners.",
-            title="Race statistics status",
-            severity="information"
-        )
+    def update_all_tables(self) -> None:
+        """
+        Fill all the metric tables, from the current DataFrame
+        """
+        for table in self.query(DataTable):
+            table.loading = True
+        self.update_tables()
 
     def sort_reverse(self, sort_type: str):
         """
@@ -255,12 +284,22 @@ class OutlierApp(App):
     Outlier application
     """
     DF: DataFrame = None
+    STORE: RaceStore = None
+    YEAR: int = DEFAULT_YEAR
+    METHOD: OutlierMethod = OutlierMethod.ZSCORE
+    GROUP_BY: OutlierGroups = None
+    TAIL: ResultsTail = None
+    FOLLOW_INTERVAL = 2.0
     BINDINGS = [
         ("q", "quit_app", "Quit"),
+        ("y", "next_year", "Next year"),
     ]
     CSS_PATH = "outliers.tcss"
     ENABLE_COMMAND_PALETTE = False
     current_sorts: set = set()
+    detectors: dict[RaceFields, StreamingOutlierDetector] = None
+    follow_timer: Timer = None
+    follow_worker: Worker = None
 
     def action_quit_app(self):
         """
@@ -298,20 +337,81 @@ class OutlierApp(App):
                 table.add_columns,
                 *columns,
             )
-        outliers = get_outliers(df=OutlierApp.DF, column=column.value)
+        outliers = get_outliers(
+            df=OutlierApp.DF,
+            column=column.value,
+            method=OutlierApp.METHOD,
+            group_by=OutlierApp.GROUP_BY
+        )
         self.log.info(f"Outliers {column}: {outliers} ({len(outliers.keys())})")
-        if column == RaceFields.AGE:
-            transformed_outliers = outliers.to_dict().items()
-        else:
-            transformed_outliers = []
-            for bib, timedelta in outliers.items():
-                transformed_outliers.append((bib, f"{timedelta.total_seconds() / 60.0:.2f}"))
+        transformed_outliers = self.outlier_rows(column, outliers)
         self.log.info(f"Transformed Outliers {column}: {transformed_outliers}")
         if not worker.is_cancelled:
-            self.call_from_thread(
-                table.add_rows,
-                transformed_outliers
-            )
+            self.call_from_thread(self.add_outlier_rows, table, transformed_outliers)
+
+    @staticmethod
+    def add_outlier_rows(table: DataTable, rows: list[tuple[int, Any]]) -> None:
+        """
+        Add outlier rows keyed by BIB, so live results can patch them
+        """
+        for row in rows:
+            table.add_row(*row, key=str(row[0]))
+
+    @staticmethod
+    def outlier_rows(column: RaceFields, outliers: Series) -> list[tuple[int, Any]]:
+        """
+        Outlier table rows, race times are shown in minutes
+        """
+        if column == RaceFields.AGE:
+            return list(outliers.to_dict().items())
+        return [(bib, f"{timedelta.total_seconds() / 60.0:.2f}") for bib, timedelta in as_duration(outliers).items()]
+
+    def check_results(self) -> None:
+        """
+        Follow timer callback, a tick is skipped while the previous batch is still being applied
+        """
+        if self.follow_worker is None or self.follow_worker.is_finished:
+            self.follow_worker = self.follow_results()
+
+    @work(exclusive=False, thread=True, group='follow')
+    def follow_results(self) -> None:
+        """
+        Check the results appended to the followed file, new runners are compared with the running
+        moments of the runners seen before them (z-score, whatever the METHOD), and the outliers are added to the tables.
+        Runners reported again take back their previous values from the moments, and their rows are patched.
+        """
+        for batch in OutlierApp.TAIL.iter_read():
+            if self.detectors is None:
+                self.detectors = {metric: StreamingOutlierDetector() for metric in SUMMARY_METRICS}
+                for metric, detector in self.detectors.items():
+                    detector.update_frame(OutlierApp.DF, metric.value, group_by=OutlierApp.GROUP_BY)
+            OutlierApp.DF, replaced = merge_results(OutlierApp.DF, batch)
+            batch = batch[~batch.index.duplicated(keep='last')]
+            new_rows = {}
+            for metric, detector in self.detectors.items():
+                detector.remove_frame(replaced, metric.value, group_by=OutlierApp.GROUP_BY)
+                new_rows[metric] = self.outlier_rows(
+                    metric, detector.update_frame(batch, metric.value, group_by=OutlierApp.GROUP_BY)
+                )
+            self.call_from_thread(self.patch_tables, new_rows, [str(bib) for bib in batch.index])
+
+    def patch_tables(self, new_rows: dict[RaceFields, list[tuple[int, Any]]], bibs: list[str]) -> None:
+        """
+        Show the outliers found on a batch of live results. Runners of the batch already on a table are
+        updated, or removed if they are no longer outliers.
+        """
+        for metric, rows in new_rows.items():
+            table = self.get_widget_by_id(f'col_{metric.name}_outlier', expect_type=DataTable)
+            outliers = {str(row[0]): row for row in rows}
+            for bib in bibs:
+                if bib not in table.rows:
+                    continue
+                if bib in outliers:
+                    table.update_cell_at(Coordinate(table.get_row_index(bib), 1), outliers.pop(bib)[1])
+                else:
+                    table.remove_row(bib)
+            self.add_outlier_rows(table, list(outliers.values()))
+        self.sub_title = f"Runners: {OutlierApp.DF.shape[0]} (Live: {OutlierApp.TAIL.data_file.name})"
 
     def on_mount(self) -> None:
         """
@@ -323,10 +423,26 @@ class OutlierApp(App):
             self.update_tables(table=table, column=column)
 
         self.notify(
-            message=f"All metrics were calculated for {OutlierApp.DF.shape[0]} runners.",
+            message=f"All metrics were calculated for {OutlierApp.DF.shape[0]} runners (method: {OutlierApp.METHOD.value}).",
             title="Outliers statistics status",
             severity="information"
         )
+        if OutlierApp.TAIL is not None and self.follow_timer is None:
+            self.follow_timer = self.set_interval(OutlierApp.FOLLOW_INTERVAL, self.check_results)
+
+    def action_next_year(self) -> None:
+        """
+        Show the outliers for the next race year, sliced from the race store without reloading any files
+        """
+        if OutlierApp.STORE is None or len(OutlierApp.STORE.years) < 2:
+            self.notify(message="Only one race year was loaded", title="Outliers statistics status", severity="warning")
+            return
+        OutlierApp.YEAR = OutlierApp.STORE.next_year(OutlierApp.YEAR)
+        OutlierApp.DF = OutlierApp.STORE.year(OutlierApp.YEAR)
+        self.sub_title = f"Runners: {OutlierApp.DF.shape[0]} (Year: {OutlierApp.YEAR})"
+        for table in self.query(DataTable):
+            table.clear(columns=True)
+        self.on_mount()
 
     def sort_reverse(self, sort_type: str):
         """
@@ -358,31 +474,37 @@ class OutlierApp(App):
         """
         table = event.data_table
         row = table.get_row(event.row_key)
-        bibs = [row[0]]
-        outlier_runner = df_to_list_of_tuples(df=OutlierApp.DF, bibs=bibs)
-        runner_detail = OutlierDetailScreen(runner_data=outlier_runner)
-        self.push_screen(runner_detail)
+        self.show_outlier(row[0])
+
+    def show_outlier(self, bib: int) -> None:
+        """
+        Build and show the detail screen of an outlier, the runner data is only gathered here
+        """
+        outlier_runner = df_to_list_of_tuples(df=OutlierApp.DF, bibs=[bib])
+        self.push_screen(OutlierDetailScreen(runner_data=outlier_runner))
 
 
 class Plotter:
     """
     Plot different metrics
     """
-    def __init__(self, year: int, data_file: Path = None):
+    def __init__(self, year: int, data_file: Path = None, df: DataFrame = None):
         """
         Constructor, load data from file using helper.
+        Args:
+            df: Results already loaded (like a RaceStore year), data_file is ignored then
         """
-        self.df = load_json_data(data_file=data_file, use_pretty=False)
+        self.df = load_json_data(data_file=data_file, use_pretty=False) if df is None else df
         self.year = year
 
-    def plot_age(self, gtype: str):
+    def plot_age(self, gtype: str) -> Figure | None:
         """
-        Plot age.
+        Plot age, returns the figure.
         Borrowed coloring recipe for histogram from Matplotlib documentation
         """
         if gtype == 'box':
             series = self.df[RaceFields.AGE.value]
-            _, ax = plt.subplots(layout='constrained')
+            fig, ax = plt.subplots(layout='constrained')
             ax.boxplot(series)
             ax.set_title(f"Age details (Race year: {self.year})")
             ax.set_ylabel('Years')
@@ -390,21 +512,24 @@ class Plotter:
             ax.grid(True)
         elif gtype == 'hist':
             series = self.df[RaceFields.AGE.value]
-            _, ax = plt.subplots(layout='constrained')
+            fig, ax = plt.subplots(layout='constrained')
             _, bins, _ = ax.hist(series, density=False, alpha=0.75)
             ax.set_xlabel('Age [years]')
             ax.set_ylabel('Count')
             ax.set_title(f'Age details for {series.shape[0]} racers\nBins={len(bins)}\nYear={self.year}\n')
             ax.grid(True)
+        else:
+            return None
+        return fig
 
-    def plot_country(self):
+    def plot_country(self) -> Figure:
         """
         Plot country details
         """
         fastest = find_fastest(self.df, FastestFilters.COUNTRY)
         series = self.df[RaceFields.COUNTRY.value].value_counts()
         series.sort_values(inplace=True)
-        _, ax = plt.subplots(layout='constrained')
+        fig, ax = plt.subplots(layout='constrained')
         rects = ax.barh(series.keys(), series.values)
         ax.bar_label(
             rects,
@@ -417,13 +542,14 @@ class Plotter:
         ax.set_stacked = True
         ax.set_ylabel('Country')
         ax.set_xlabel('Count per country')
+        return fig
 
-    def plot_gender(self):
+    def plot_gender(self) -> Figure:
         """
         Plot gender details
         """
         series = self.df[RaceFields.GENDER.value].value_counts()
-        _, ax = plt.subplots(layout='constrained')
+        fig, ax = plt.subplots(layout='constrained')
         wedges, _, _ = ax.pie(
             series.values,
             labels=series.keys(),
@@ -442,6 +568,7 @@ class Plotter:
                   title=f"Fastest (Race year: {self.year})",
                   loc="center left",
                   bbox_to_anchor=(1, 0, 0.5, 1))
+        return fig
 
 
 class BrowserApp(App):
@@ -449,8 +576,10 @@ class BrowserApp(App):
     Racer detail browser  application
     Shows racers for a given year on a table.
     """
-    BINDINGS = [("q", "quit_app", "Quit")]
+    BINDINGS = [("q", "quit_app", "Quit"), ("y", "next_year", "Next year")]
     CSS_PATH = "browser.tcss"
+    ROW_BATCH_SIZE = 500
+    FOLLOW_INTERVAL = 2.0
     ENABLE_COMMAND_PALETTE = True
     COMMANDS = App.COMMANDS | {BrowserAppCommand}
     current_sorts: set = set()
@@ -460,15 +589,37 @@ class BrowserApp(App):
             driver_class: type[Driver] | None = None,
             css_path: CSSPathType | None = None,
             watch_css: bool = False,
-            country_data: DataFrame = None,
-            df: DataFrame = None
+            country_data: CountryIndex = None,
+            df: DataFrame = None,
+            store: RaceStore = None,
+            year: int = DEFAULT_YEAR,
+            tail: ResultsTail = None,
+            virtual: bool = False
     ):
         """
         Constructor
+        Args:
+            country_data: Country index used to show the country names on the runner details, defaults to load_country_index
+            tail: Follow the results appended to a file, df has the results read so far
+            virtual: Read the cells from the DataFrame on display (FrameTable), instead of copying the rows into the table
         """
         super().__init__(driver_class, css_path, watch_css)
-        self.country_data = country_data if country_data else load_country_details()
-        self.df = load_json_data() if (df is None or df.empty) else df
+        self.country_data = country_data if country_data is not None else load_country_index()
+        self.store = store
+        self.year = year
+        self.tail = tail
+        self.virtual = virtual
+        self.search_index = None
+        self.aggregates = None
+        self.follow_timer = None
+        self.follow_worker = None
+        self.current_sort = (RaceFields.TIME.value, False)
+        if df is not None and not df.empty:
+            self.df = df
+        elif store is not None:
+            self.df = store.year(year)
+        else:
+            self.df = load_json_data()
 
     def action_quit_app(self):
         """
@@ -481,40 +632,133 @@ class BrowserApp(App):
         UI element layout
         """
         yield Header(show_clock=True)
-        table = DataTable(id='runners')
+        table = FrameTable(id='runners') if self.virtual else RunnerTable(id='runners')
         table.loading = True
         yield table
         yield Footer()
 
     @work(exclusive=True, thread=True)
-    def update_table(self, table: DataTable) -> None:
-        columns_raw, rows = df_to_list_of_tuples(df=self.df)
+    def update_table(self, table: RunnerTable | FrameTable) -> None:
         worker = get_current_worker()
+        if isinstance(table, FrameTable):
+            # Virtual table, cells are read from the DataFrame when displayed
+            self.call_from_thread(table.set_frame, self.df)
+        else:
+            self.load_rows(table)
         if not worker.is_cancelled:
-            for column in columns_raw:
+            self.search_index = RunnerSearchIndex(self.df)
+            self.current_sort = (RaceFields.TIME.value, False)
+            self.call_from_thread(
+                table.sort_by_frame,
+                self.df,
+                RaceFields.TIME.value
+            )
+            if self.tail is not None:
+                self.call_from_thread(self.start_following)
+
+    def load_rows(self, table: RunnerTable) -> None:
+        """
+        Copy the DataFrame rows into the table, in batches. Runs on the update_table worker.
+        """
+        worker = get_current_worker()
+        rows = iter_rows(df=self.df)
+        if not worker.is_cancelled:
+            for column in FIELD_NAMES:
+                # Race times are formatted on render, so their width cannot be measured from the raw values
                 self.call_from_thread(
                     table.add_column,
                     column.title(),
-                    key=column
+                    key=column,
+                    width=max(len(column), 8) if column in TIME_FIELDS else None
                 )
-        for number, row in enumerate(rows[0:], start=1):
-            label = Text(str(number), style="#B0FC38 italic")
-            self.call_from_thread(
-                table.add_row,
-                *row,
-                label=label
-            )
-        if not worker.is_cancelled:
-            self.call_from_thread(
-                table.sort,
-                RaceFields.TIME.value
+        total = self.df.shape[0]
+        next_progress = total // 4
+        for start in range(0, total, self.ROW_BATCH_SIZE):
+            if worker.is_cancelled:
+                return
+            batch = list(islice(rows, self.ROW_BATCH_SIZE))
+            self.call_from_thread(self.add_row_batch, table, batch, start + 1)
+            loaded = start + len(batch)
+            if total > self.ROW_BATCH_SIZE and (loaded >= next_progress or loaded == total):
+                next_progress += total // 4
+                self.call_from_thread(
+                    self.notify,
+                    message=f"Loaded {loaded} of {total} runners.",
+                    title="Race Runners",
+                    severity="information",
+                    timeout=2
+                )
+
+    def add_row_batch(self, table: DataTable, rows: list[tuple], first_number: int) -> None:
+        """
+        Add a batch of rows on a single trip to the event loop, rows are labeled with their load order
+        and keyed by BIB.
+        """
+        bib_idx = FIELD_NAMES_AND_POS[RaceFields.BIB]
+        for number, row in enumerate(rows, start=first_number):
+            table.add_row(*row, key=str(row[bib_idx]), label=Text(str(number), style="#B0FC38 italic"))
+
+    def start_following(self) -> None:
+        """
+        Check the followed file for new results periodically
+        """
+        if self.follow_timer is None:
+            self.follow_timer = self.set_interval(self.FOLLOW_INTERVAL, self.check_results)
+
+    def check_results(self) -> None:
+        """
+        Follow timer callback, a tick is skipped while the previous batch is still being applied
+        """
+        if self.follow_worker is None or self.follow_worker.is_finished:
+            self.follow_worker = self.follow_results()
+
+    @work(exclusive=False, thread=True, group='follow')
+    def follow_results(self) -> None:
+        """
+        Apply the results appended to the followed file, new runners are added and updated runners are patched
+        """
+        for batch in self.tail.iter_read():
+            if self.aggregates is None:
+                self.aggregates = LiveAggregates(self.df)
+            self.df, replaced = merge_results(self.df, batch)
+            changes = self.aggregates.update(df=self.df, batch=batch, replaced=replaced)
+            self.search_index = RunnerSearchIndex(self.df)
+            self.call_from_thread(self.patch_runners, list(iter_rows(df=batch)), changes)
+
+    def patch_runners(self, rows: list[tuple], changes: LiveChanges) -> None:
+        """
+        Show a batch of live results, keeping the current sort, and announce the new fastest runners per gender
+        """
+        table = self.get_widget_by_id('runners')
+        if isinstance(table, FrameTable):
+            table.set_frame(self.df)
+        else:
+            bib_idx = FIELD_NAMES_AND_POS[RaceFields.BIB]
+            new_rows = []
+            for row in rows:
+                row_key = str(row[bib_idx])
+                if row_key in table.rows:
+                    for column, value in zip(FIELD_NAMES, row, strict=True):
+                        table.update_cell(row_key, column, value)
+                else:
+                    new_rows.append(row)
+            self.add_row_batch(table, new_rows, table.row_count + 1)
+        column, reverse = self.current_sort
+        table.sort_by_frame(self.df, column, reverse=reverse)
+        self.sub_title = f"Browse details: {self.df.shape[0]} (Live: {self.tail.data_file.name})"
+        for gender in changes.fastest.get(FastestFilters.GENDER, ()):
+            runner = self.aggregates.fastest[FastestFilters.GENDER][gender]
+            self.notify(
+                message=f"{runner['name']}: {format_duration(runner['time'])}",
+                title=f"New fastest runner ({gender})",
+                severity="information"
             )
 
     def on_mount(self) -> None:
         """
         UI element rendering
         """
-        table = self.get_widget_by_id('runners', expect_type=DataTable)
+        table = self.get_widget_by_id('runners')
         table.zebra_stripes = True
         table.cursor_type = 'row'
         table.loading = False
@@ -526,6 +770,21 @@ class BrowserApp(App):
             severity="information"
         )
 
+    def action_next_year(self) -> None:
+        """
+        Browse the runners of the next race year, sliced from the race store without reloading any files
+        """
+        if self.store is None or len(self.store.years) < 2:
+            self.notify(message="Only one race year was loaded", title="Race Runners", severity="warning")
+            return
+        self.year = self.store.next_year(self.year)
+        self.df = self.store.year(self.year)
+        self.search_index = None
+        self.sub_title = f"Browse details: {self.df.shape[0]} (Year: {self.year})"
+        table = self.get_widget_by_id('runners')
+        table.clear(columns=True)
+        self.update_table(table=table)
+
     def sort_reverse(self, sort_type: str):
         """
         Toggle sort type. To be passed to sort method
@@ -538,22 +797,28 @@ class BrowserApp(App):
         return reverse
 
     @on(DataTable.HeaderSelected, '#runners')
+    @on(FrameTable.HeaderSelected, '#runners')
     def on_header_clicked(self, event: DataTable.HeaderSelected):
         """
-        Callback when user clicks the table column header
+        Callback when user clicks the table column header.
+        Sorting runs on the DataFrame columns, not on the table cells.
         """
         table = event.data_table
-        table.sort(
-            event.column_key,
-            reverse=self.sort_reverse(str(event.column_key.value))
+        column = str(event.column_key.value)
+        self.current_sort = (column, self.sort_reverse(column))
+        table.sort_by_frame(
+            self.df,
+            column,
+            reverse=self.current_sort[1]
         )
 
     @on(DataTable.RowSelected)
+    @on(FrameTable.RowSelected)
     def on_row_clicked(self, event: DataTable.RowSelected) -> None:
         """
         Callback when the user clicks a row, to get more racer details displayed
         """
         table = event.data_table
         row = table.get_row(event.row_key)
-        runner_detail_screen = RunnerDetailScreen(table=table, row=row)
+        runner_detail_screen = RunnerDetailScreen(table=table, row=row, country_data=self.country_data)
         self.push_screen(runner_detail_screen)
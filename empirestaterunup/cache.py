@@ -0,0 +1,252 @@
+"""
+On-disk columnar cache for normalized race results.
+Each cached DataFrame is a directory with one NumPy array per column plus a small JSON schema,
+so a cold start is a memory-mapped read instead of a full parse and clean pass.
+author: Jose Vicente Nunez <kodegeek.com@protonmail.com>
+"""
+import hashlib
+import json
+import logging
+import os
+import pickle
+import shutil
+import tempfile
+from collections.abc import Callable, Sequence
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+import pandas
+from pandas import DataFrame, Index
+
+CACHE_DIR = Path(os.environ.get('XDG_CACHE_HOME', Path.home().joinpath('.cache'))).joinpath('empirestaterunup')
+SCHEMA_FILE = "schema.json"
+SCHEMA_VERSION = 1
+COMPILED_DIR_NAME = "compiled"
+
+
+def file_digest(data_file: Path) -> str:
+    """
+    SHA-256 of the file contents, used to detect changes on the source data
+    """
+    digest = hashlib.sha256()
+    with open(data_file, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def cache_location(
+        data_file: Path | Sequence[Path],
+        version: int,
+        cache_dir: Path = None,
+        name: str = None,
+        **options: Any
+) -> Path:
+    """
+    Cache entry for a data file (or several, for data built from many files), keyed by the file contents,
+    the normalization code version and load options.
+    Args:
+        name: Entry name, defaults to the name of the (first) data file
+    """
+    def_dir = CACHE_DIR if cache_dir is None else cache_dir
+    data_files = [data_file] if isinstance(data_file, Path) else list(data_file)
+    digests = [file_digest(source) for source in data_files]
+    key = {
+        'digest': digests[0] if isinstance(data_file, Path) else digests,
+        'version': version,
+        'options': options
+    }
+    key_digest = hashlib.sha256(json.dumps(key, sort_keys=True).encode('utf-8')).hexdigest()
+    def_name = data_files[0].stem if name is None else name
+    return def_dir.joinpath(f"{def_name}-{key_digest[:24]}")
+
+
+def _column_to_arrays(series: pandas.Series) -> tuple[dict[str, Any], dict[str, np.ndarray]]:
+    """
+    Split a column into its schema description and the arrays to persist
+    """
+    if isinstance(series.dtype, pandas.CategoricalDtype):
+        categories = series.cat.categories
+        cat_kind, cat_arrays = _column_to_arrays(pandas.Series(categories))
+        return (
+            {'kind': 'category', 'ordered': bool(series.cat.ordered), 'categories': cat_kind},
+            {'codes': series.cat.codes.to_numpy(), **{f"categories.{k}": v for k, v in cat_arrays.items()}}
+        )
+    if isinstance(series.dtype, pandas.api.extensions.ExtensionDtype) and hasattr(series.dtype, 'numpy_dtype'):
+        # Nullable numbers, values and missing mask are stored apart
+        return (
+            {'kind': 'masked', 'dtype': series.dtype.name},
+            {'values': series.to_numpy(dtype=series.dtype.numpy_dtype, na_value=0), 'mask': series.isna().to_numpy()}
+        )
+    if series.dtype == object:
+        if not series.map(type).eq(str).all():
+            raise TypeError(f"Column '{series.name}' has non string objects, it cannot be cached")
+        return {'kind': 'string'}, {'values': series.to_numpy(dtype=str)}
+    values = series.to_numpy()
+    if values.dtype.hasobject:
+        raise TypeError(f"Column '{series.name}' with dtype {series.dtype} cannot be cached")
+    return {'kind': 'array'}, {'values': values}
+
+
+def _arrays_to_column(description: dict[str, Any], arrays: dict[str, np.ndarray], name: str) -> pandas.Series:
+    """
+    Rebuild a column from its schema description and arrays
+    """
+    kind = description['kind']
+    if kind == 'category':
+        categories = _arrays_to_column(
+            description['categories'],
+            {k.removeprefix('categories.'): v for k, v in arrays.items() if k.startswith('categories.')},
+            None
+        )
+        return pandas.Series(
+            pandas.Categorical.from_codes(arrays['codes'], categories=categories.to_numpy(), ordered=description['ordered']),
+            name=name
+        )
+    if kind == 'masked':
+        series = pandas.Series(np.array(arrays['values']), dtype=description['dtype'], name=name)
+        series[np.asarray(arrays['mask'])] = pandas.NA
+        return series
+    if kind == 'string':
+        return pandas.Series(arrays['values'], dtype=object, name=name)
+    return pandas.Series(arrays['values'], name=name)
+
+
+def save_frame(df: DataFrame, location: Path, **metadata: Any) -> None:
+    """
+    Persist a DataFrame as a directory of column arrays. The write is atomic, readers never see a partial entry.
+    Other entries for the same source and options are removed, as they are stale now.
+    Raises TypeError if a column cannot be stored in columnar form.
+    """
+    location.parent.mkdir(parents=True, exist_ok=True)
+    work_dir = Path(tempfile.mkdtemp(prefix=f".{location.name}-", dir=location.parent))
+    try:
+        schema = {'schema_version': SCHEMA_VERSION, 'metadata': metadata, 'columns': []}
+        columns = [(df.index.name, df.index.to_series(), True)] + [(name, df[name], False) for name in df.columns]
+        for pos, (name, series, is_index) in enumerate(columns):
+            description, arrays = _column_to_arrays(series)
+            files = {}
+            for array_name, array in arrays.items():
+                array_file = f"{pos:03}.{array_name}.npy"
+                np.save(work_dir.joinpath(array_file), array, allow_pickle=False)
+                files[array_name] = array_file
+            schema['columns'].append({'name': name, 'index': is_index, 'files': files, **description})
+        with open(work_dir.joinpath(SCHEMA_FILE), 'w', encoding='utf-8') as f:
+            json.dump(schema, f)
+        if location.exists():
+            shutil.rmtree(location)
+        os.replace(work_dir, location)
+    except BaseException:
+        shutil.rmtree(work_dir, ignore_errors=True)
+        raise
+    for sibling in location.parent.glob(f"{location.name.rsplit('-', 1)[0]}-*"):
+        if sibling == location or not sibling.joinpath(SCHEMA_FILE).exists():
+            continue
+        try:
+            with open(sibling.joinpath(SCHEMA_FILE), encoding='utf-8') as f:
+                stale = json.load(f).get('metadata') == metadata
+        except (OSError, ValueError):
+            stale = True
+        if stale:
+            shutil.rmtree(sibling, ignore_errors=True)
+
+
+def has_frame(location: Path) -> bool:
+    """
+    Whether there is a cache entry at the given location
+    """
+    return location.joinpath(SCHEMA_FILE).exists()
+
+
+def load_frame(location: Path) -> DataFrame | None:
+    """
+    Load a DataFrame saved with save_frame, arrays are memory mapped copy-on-write: the DataFrame can be
+    updated like a freshly parsed one, and the updates stay on the process memory instead of the cache.
+    Returns None if there is no usable entry at the given location.
+    """
+    if not has_frame(location):
+        return None
+    schema_file = location.joinpath(SCHEMA_FILE)
+    try:
+        with open(schema_file, encoding='utf-8') as f:
+            schema = json.load(f)
+        if schema.get('schema_version') != SCHEMA_VERSION:
+            return None
+        index = None
+        columns = {}
+        for description in schema['columns']:
+            arrays = {
+                array_name: np.load(location.joinpath(array_file), mmap_mode='c', allow_pickle=False)
+                for array_name, array_file in description['files'].items()
+            }
+            series = _arrays_to_column(description, arrays, description['name'])
+            if description['index']:
+                index = Index(series, name=description['name'])
+            else:
+                columns[description['name']] = series.to_numpy() if description['kind'] == 'array' else series.array
+        return DataFrame(columns, index=index, copy=False)
+    except (OSError, ValueError, KeyError) as err:
+        logging.warning(f"Ignoring unreadable cache entry {location}: {err}")
+        return None
+
+
+def load_compiled(
+        source: Path,
+        compile_source: Callable[[Path], Any],
+        version: int,
+        cache_dir: Path = None
+) -> Any:
+    """
+    Data compiled from a small source file (like the TOML reference data), cached as a pickle.
+    The entry is valid while the modification time and size of the source match. If they changed but the
+    contents did not (a fresh checkout, for example), the entry is kept and only its stamp is refreshed.
+    Args:
+        source: Source file
+        compile_source: Builds the data from the source file, the result must be picklable
+        version: Version of compile_source, a different version invalidates the entry
+        cache_dir: Cache directory, defaults to CACHE_DIR
+    """
+    def_dir = (CACHE_DIR if cache_dir is None else cache_dir).joinpath(COMPILED_DIR_NAME)
+    source_key = hashlib.sha256(str(source.resolve()).encode('utf-8')).hexdigest()[:16]
+    entry_file = def_dir.joinpath(f"{source.stem}-{source_key}.pickle")
+    stat = source.stat()
+    stamp = {'version': version, 'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size}
+    entry = None
+    try:
+        with open(entry_file, 'rb') as f:
+            entry = pickle.load(f)
+    except FileNotFoundError:
+        pass
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ValueError) as err:
+        logging.warning(f"Ignoring unreadable compiled entry {entry_file}: {err}")
+    if entry is not None and entry['version'] == version:
+        if entry['mtime_ns'] == stamp['mtime_ns'] and entry['size'] == stamp['size']:
+            return entry['data']
+        digest = file_digest(source)
+        if digest == entry['digest']:
+            _save_compiled(entry_file, {**entry, **stamp})
+            return entry['data']
+    else:
+        digest = file_digest(source)
+    data = compile_source(source)
+    _save_compiled(entry_file, {**stamp, 'digest': digest, 'data': data})
+    return data
+
+
+def _save_compiled(entry_file: Path, entry: dict[str, Any]) -> None:
+    """
+    Atomic write of a compiled entry, failures only cost a new compilation next time
+    """
+    try:
+        entry_file.parent.mkdir(parents=True, exist_ok=True)
+        fd, work_file = tempfile.mkstemp(prefix=f".{entry_file.name}-", dir=entry_file.parent)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(work_file, entry_file)
+        except BaseException:
+            Path(work_file).unlink(missing_ok=True)
+            raise
+    except OSError as err:
+        logging.warning(f"Could not save compiled entry {entry_file}: {err}")
@@ -3,16 +3,29 @@ Data loading logic, after web scraping process is completed.
 author: Jose Vicente Nunez <kodegeek.com@protonmail.com>
 """
 import datetime
+import io
 import logging
-from collections import defaultdict
+import os
+import tomllib
+import unicodedata
+from collections.abc import Iterator
+from concurrent.futures import ProcessPoolExecutor
 from enum import Enum
+from functools import lru_cache, partial
 from pathlib import Path
-from typing import Any
+from typing import Any, NamedTuple
 
+import numpy
 import pandas
-import tomlkit
 from pandas import DataFrame, Series
-from tomlkit import TOMLDocument
+
+from empirestaterunup.cache import (
+    cache_location,
+    has_frame,
+    load_compiled,
+    load_frame,
+    save_frame,
+)
 
 logging.basicConfig(format='%(asctime)s %(message)s', encoding='utf-8', level=logging.INFO)
 
@@ -52,7 +65,34 @@ class RaceFields(Enum):
     SIXTY_FIVE_FLOOR_TIME = '65th floor'
 
 
+class SplitFields(Enum):
+    """
+    Fields available on each split record. Time is always flattened, the others are optional
+    """
+    TIME = "time_ms"
+    DISTANCE = "distance_m"
+    TIME_WITH_PENALTIES = "time_with_penalties_ms"
+    GUN_TIME = "gun_time_ms"
+
+
+class EventFields(Enum):
+    """
+    Event dimension, added to the runner details when several races are loaded together
+    """
+    YEAR = "year"
+    EVENT_ID = "event_id"
+    EVENT_NAME = "name"
+    EVENT_COURSE_ID = "event_course_id"
+    DISTANCE = "distance_m"
+    DATE = "date_utc_ms"
+
+
 FIELD_NAMES = [x.value for x in RaceFields]
+TIME_FIELDS = [x.value for x in (RaceFields.TIME, RaceFields.TWENTY_FLOOR_TIME, RaceFields.SIXTY_FIVE_FLOOR_TIME)]
+"""
+Text columns with many repeated values, stored as categories on compact mode
+"""
+CATEGORY_FIELDS = [x.value for x in (RaceFields.NAME, RaceFields.GENDER, RaceFields.COUNTRY, RaceFields.STATE, RaceFields.CITY)]
 FIELD_NAMES_AND_POS: dict[RaceFields, int] = {field: idx for idx, field in zip(range(0, len(RaceFields)), RaceFields, strict=False)}
 
 RACE_RESULTS_JSON_FULL_LEVEL = {
@@ -60,16 +100,34 @@ RACE_RESULTS_JSON_FULL_LEVEL = {
     2024: Path(__file__).parent.joinpath("results-2024.jsonl"),
     2025: Path(__file__).parent.joinpath("results-2025.jsonl")
 }
+RACE_METADATA = {
+    2023: Path(__file__).parent.joinpath("metadata-2023.json"),
+    2024: Path(__file__).parent.joinpath("metadata-2024.json"),
+    2025: Path(__file__).parent.joinpath("metadata-2025.json")
+}
 DEFAULT_YEAR = 2025
 COUNTRY_DETAILS = Path(__file__).parent.joinpath("country_codes.toml")
 LOCATION_DETAILS = Path(__file__).parent.joinpath("location_lookup.toml")
+"""
+Bump every time the normalization logic in load_json_data changes, so cached results are rebuilt.
+"""
+NORMALIZATION_VERSION = 2
+"""
+Bump every time the way the TOML reference data is compiled changes, see load_reference_data.
+"""
+REFERENCE_VERSION = 1
+DEFAULT_CHUNK_SIZE = 10_000
 
 
 def load_json_data(
         data_file: Path = None,
         remove_dnf: bool = True,
         default_year: int = DEFAULT_YEAR,
-        use_pretty: bool = False
+        use_pretty: bool = False,
+        use_cache: bool = True,
+        cache_dir: Path = None,
+        split_fields: tuple[SplitFields, ...] = (),
+        compact: bool = False
 ) -> DataFrame:
     """
     Load the JSON lines as a dataframe.
@@ -78,6 +136,13 @@ def load_json_data(
         remove_dnf: Whether to remove the DNF column from the dataframe. By default, remove non-finishers to avoid skewing the results.
         default_year: Default year to load the data from
         use_pretty: Whether to use pretty formatting class for the race durations or not.
+        use_cache: Whether to reuse (and save) the normalized results from the columnar cache.
+        cache_dir: Cache location, defaults to CACHE_DIR
+        split_fields: Extra split fields to flatten, besides the split time. See flatten_split_data
+        compact: Use a compact memory layout, see compact_results. Race durations are formatted at render time
+                 with format_duration, so use_pretty is ignored.
+    The normalized DataFrame is cached on disk, keyed by the source file contents, NORMALIZATION_VERSION and load options.
+    Pretty formatting is applied on top of the cached data, so it does not need its own cache entry.
     The split_data contains more nested details. When each row is converted to a dict it looks like this:
     [
     {'distance_m': 320, 'gun_time_ms': {'timeInMillis': 788000, 'timeUnit': 'm'},
@@ -103,17 +168,337 @@ def load_json_data(
 
     To better process as a dataframe, these are flattened too
     """
-    def_file = RACE_RESULTS_JSON_FULL_LEVEL[default_year] if data_file is None else data_file
-    df = pandas.read_json(def_file, lines=True, encoding='utf-8')
+    def_file = RACE_RESULTS_JSON_FULL_LEVEL[default_year] if data_file is None else Path(data_file)
+    df = None
+    location = None
+    if use_cache:
+        location = _results_cache_location(
+            data_file=def_file,
+            cache_dir=cache_dir,
+            remove_dnf=remove_dnf,
+            split_fields=split_fields,
+            compact=compact
+        )
+        df = load_frame(location)
+    if df is None:
+        df = _parse_json_data(data_file=def_file, remove_dnf=remove_dnf, split_fields=split_fields, compact=compact)
+        if use_cache:
+            try:
+                save_frame(
+                    df,
+                    location,
+                    source=def_file.resolve().as_posix(),
+                    remove_dnf=remove_dnf,
+                    split_fields=[field.value for field in split_fields],
+                    compact=compact
+                )
+            except (OSError, TypeError) as err:
+                logging.warning(f"Could not cache {def_file}: {err}")
+
+    if use_pretty and not compact:
+        for time_field in TIME_FIELDS:
+            df[time_field] = df[time_field].apply(PrettyDuration)
+
+    return df
+
+
+def _results_cache_location(
+        data_file: Path,
+        cache_dir: Path = None,
+        remove_dnf: bool = True,
+        split_fields: tuple[SplitFields, ...] = (),
+        compact: bool = False
+) -> Path:
+    """
+    Cache entry for the normalized results, see load_json_data
+    """
+    return cache_location(
+        data_file=data_file,
+        version=NORMALIZATION_VERSION,
+        cache_dir=cache_dir,
+        remove_dnf=remove_dnf,
+        split_fields=[field.value for field in split_fields],
+        compact=compact
+    )
+
+
+def _cache_json_data(data_file: Path, **cache_options: Any) -> None:
+    """
+    Worker side of load_json_files, results go to the cache and are not sent back to the caller.
+    """
+    load_json_data(data_file=data_file, use_cache=True, **cache_options)
+
+
+def _load_json_data(data_file: Path, **load_options: Any) -> DataFrame:
+    """
+    Worker side of load_json_files when the cache is off, results are sent back to the caller.
+    """
+    return load_json_data(data_file=data_file, **load_options)
+
+
+def load_json_files(
+        data_files: list[Path],
+        max_workers: int = None,
+        **load_options: Any
+) -> list[DataFrame]:
+    """
+    Load several results files, parsing and normalizing each one on its own worker process.
+    Workers hand over their results through the columnar cache, so the caller memory maps the DataFrames
+    instead of receiving pickled object columns. Files that are already cached skip the worker pool.
+    With use_cache=False the parsed DataFrames are sent back from the workers instead.
+    Args:
+        data_files: JSON files, see load_json_data
+        max_workers: Number of worker processes, defaults to one per file up to the number of CPUs
+        load_options: Same options as load_json_data
+    Returns:
+        One DataFrame per file, in the same order as data_files
+    """
+    def_files = [Path(data_file) for data_file in data_files]
+    if not load_options.get('use_cache', True):
+        # Nothing to hand over through, workers send the parsed results back
+        if len(def_files) < 2:
+            return [load_json_data(data_file=data_file, **load_options) for data_file in def_files]
+        workers = min(len(def_files), max_workers if max_workers else (os.cpu_count() or 1))
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(partial(_load_json_data, **load_options), def_files))
+    cache_options = {
+        option: value for option, value in load_options.items() if option in ('cache_dir', 'remove_dnf', 'split_fields', 'compact')
+    }
+    pending = [
+        data_file for data_file in dict.fromkeys(def_files)
+        if not has_frame(_results_cache_location(data_file=data_file, **cache_options))
+    ]
+    if len(pending) > 1:
+        workers = min(len(pending), max_workers if max_workers else (os.cpu_count() or 1))
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(partial(_cache_json_data, **cache_options), pending))
+    return [load_json_data(data_file=data_file, **load_options) for data_file in def_files]
+
+
+def flatten_split_data(
+        split_data: Series,
+        split_fields: tuple[SplitFields, ...] = ()
+) -> DataFrame:
+    """
+    Flatten the nested split records into one column per split, in a few vectorized steps.
+    Args:
+        split_data: Series with the list of split records for each runner
+        split_fields: Extra split fields to flatten, besides the split time
+    Splits are matched by name and ordered by split number, so runners with partial splits are aligned and
+    missing values are NA. Values are nullable int64 (milliseconds, or meters for the distance).
+    Columns are named after the split ('full course'), extra fields get the field name as suffix ('full course distance_m').
+    """
+    exploded = split_data.explode().dropna()
+    splits = DataFrame.from_records(exploded.tolist(), index=exploded.index)
+    if splits.empty:
+        return DataFrame(index=split_data.index)
+    splits['name'] = splits['name'].str.lower()
+    if SplitFields.GUN_TIME in split_fields:
+        splits[SplitFields.GUN_TIME.value] = splits[SplitFields.GUN_TIME.value].str.get('timeInMillis')
+    split_names = splits.groupby('name', sort=False)['number'].min().sort_values().index
+    splits = splits.rename_axis('runner').reset_index().drop_duplicates(['runner', 'name'])
+
+    flattened = {}
+    for field in (SplitFields.TIME, *[f for f in split_fields if f != SplitFields.TIME]):
+        pivot = splits.pivot(index='runner', columns='name', values=field.value)
+        pivot = pivot.reindex(index=split_data.index, columns=split_names)
+        for name in split_names:
+            column = name if field == SplitFields.TIME else f"{name} {field.value}"
+            flattened[column] = pivot[name].astype('Int64')
+    return DataFrame(flattened, index=split_data.index)
+
+
+def _parse_json_data(
+        data_file: Path,
+        remove_dnf: bool,
+        split_fields: tuple[SplitFields, ...] = (),
+        compact: bool = False
+) -> DataFrame:
+    """
+    Parse and normalize the race results, see load_json_data
+    """
+    # Missing ages are filled once all the chunks are read, with the median of the whole file
+    df = pandas.concat(iter_json_data(
+        data_file=data_file,
+        remove_dnf=remove_dnf,
+        split_fields=split_fields,
+        fill_age=False
+    ))
+    df[RaceFields.AGE.value] = fill_missing_age(df[RaceFields.AGE.value])
+    return compact_results(df) if compact else df
+
+
+def iter_json_data(
+        data_file: Path = None,
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+        remove_dnf: bool = True,
+        default_year: int = DEFAULT_YEAR,
+        use_pretty: bool = False,
+        split_fields: tuple[SplitFields, ...] = (),
+        median_age: float = None,
+        fill_age: bool = True,
+        compact: bool = False
+) -> Iterator[DataFrame]:
+    """
+    Stream the JSON lines as normalized dataframes of at most chunk_size runners, memory use does not grow with the file.
+    Same normalization as load_json_data, with one difference: missing ages are filled with median_age, or with the
+    median of each chunk if it is not given. With fill_age=False they are left as NaN, for callers that fill them
+    afterward (see fill_missing_age). Chunks without runners are skipped.
+    """
+    def_file = RACE_RESULTS_JSON_FULL_LEVEL[default_year] if data_file is None else Path(data_file)
+    with pandas.read_json(def_file, lines=True, encoding='utf-8', chunksize=chunk_size) as reader:
+        for chunk in reader:
+            df = _normalize_chunk(
+                raw=chunk, remove_dnf=remove_dnf, split_fields=split_fields, median_age=median_age, fill_age=fill_age
+            )
+            if df is None:
+                continue
+            if compact:
+                df = compact_results(df)
+            elif use_pretty:
+                for time_field in TIME_FIELDS:
+                    df[time_field] = df[time_field].apply(PrettyDuration)
+            yield df
+
+
+def _normalize_chunk(raw: DataFrame, remove_dnf: bool, **normalize_options: Any) -> DataFrame | None:
+    """
+    Normalize a chunk of raw results, None if no runner is left (see normalize_results)
+    """
+    if raw.empty or (remove_dnf and not raw.racer_has_finished.any()):
+        return None
+    return normalize_results(df=raw, remove_dnf=remove_dnf, **normalize_options)
+
+
+class ResultsTail:
+    """
+    Follow a growing JSON lines results file, like the live results published during the race.
+    Each read returns only the complete records appended since the previous one, normalized.
+    """
+
+    def __init__(
+            self,
+            data_file: Path,
+            remove_dnf: bool = True,
+            split_fields: tuple[SplitFields, ...] = (),
+            median_age: float = None,
+            compact: bool = False,
+            chunk_size: int = DEFAULT_CHUNK_SIZE
+    ):
+        """
+        Args:
+            data_file: Results file, it may not exist yet
+            remove_dnf: Whether to skip the runners that did not finish
+            split_fields: Extra split fields to flatten, besides the split time
+            median_age: Age used for runners without one, defaults to the median age of the first chunk read
+            compact: Use the compact memory layout
+            chunk_size: Most records parsed at once, see iter_read
+        """
+        self.data_file = Path(data_file)
+        self.remove_dnf = remove_dnf
+        self.split_fields = split_fields
+        self.median_age = median_age
+        self.compact = compact
+        self.chunk_size = chunk_size
+        self.offset = 0
+
+    def iter_read(self) -> Iterator[DataFrame]:
+        """
+        Stream the records appended since the last read, as normalized dataframes of at most chunk_size runners,
+        so a big block of new results does not have to fit in memory at once. A partial last line is left for
+        the next read. If the file shrinks (rewritten) it is read again from the start, so callers should merge
+        by BIB (merge_results).
+        """
+        try:
+            size = self.data_file.stat().st_size
+        except FileNotFoundError:
+            return
+        if size < self.offset:
+            logging.warning(f"{self.data_file} was truncated, reading it again from the start")
+            self.offset = 0
+        if size == self.offset:
+            return
+        with open(self.data_file, 'rb') as f:
+            f.seek(self.offset)
+            lines = []
+            read = 0
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                read += len(line)
+                if line.strip():
+                    lines.append(line)
+                if len(lines) == self.chunk_size:
+                    df = self._read_lines(lines, read)
+                    lines, read = [], 0
+                    if df is not None:
+                        yield df
+            df = self._read_lines(lines, read)
+            if df is not None:
+                yield df
 
+    def _read_lines(self, lines: list[bytes], read: int) -> DataFrame | None:
+        """
+        Normalize a chunk of complete lines, and move the offset after them
+        """
+        self.offset += read
+        if not lines:
+            return None
+        raw = pandas.read_json(io.StringIO(b''.join(lines).decode('utf-8')), lines=True)
+        df = _normalize_chunk(raw=raw, remove_dnf=self.remove_dnf, split_fields=self.split_fields, median_age=self.median_age)
+        if df is None:
+            return None
+        if self.median_age is None:
+            self.median_age = df[RaceFields.AGE.value].median()
+        return compact_results(df) if self.compact else df
+
+    def read(self) -> DataFrame | None:
+        """
+        Get all the records appended since the last read, see iter_read.
+        Returns None if there are no new runners
+        """
+        frames = list(self.iter_read())
+        if not frames:
+            return None
+        return frames[0] if len(frames) == 1 else pandas.concat(frames)
+
+
+def merge_results(df: DataFrame, new: DataFrame) -> tuple[DataFrame, DataFrame]:
+    """
+    Add new results to a DataFrame, runners already present (same BIB) are replaced by their new record
+    Args:
+        df: Current results
+        new: New results
+    Returns:
+        The merged results, and the previous records of the replaced runners
+    """
+    new = new[~new.index.duplicated(keep='last')]
+    known = df.index.isin(new.index)
+    return pandas.concat([df[~known], new]), df[known]
+
+
+def normalize_results(
+        df: DataFrame,
+        remove_dnf: bool = True,
+        split_fields: tuple[SplitFields, ...] = (),
+        median_age: float = None,
+        fill_age: bool = True
+) -> DataFrame:
+    """
+    Normalize raw race results, as read from the JSON lines file
+    Args:
+        df: Raw race results
+        remove_dnf: Whether to remove the runners that did not finish
+        split_fields: Extra split fields to flatten, besides the split time
+        median_age: Age used for runners without one, defaults to the median age of the given results
+        fill_age: Whether to fill the missing ages, see fill_missing_age
+    """
     if remove_dnf:
-        df = df.loc[df.racer_has_finished, :]
+        df = df.loc[df.racer_has_finished, :].copy()
 
     # Normalize Age
-    median_age = df[RaceFields.AGE.value].median()
-    df[RaceFields.AGE.value] = df[RaceFields.AGE.value].fillna(median_age)
-    df[RaceFields.AGE.value] = df[RaceFields.AGE.value].apply(lambda x: median_age if x == 0 else x)
-    df[RaceFields.AGE.value] = df[RaceFields.AGE.value].astype(int)
+    if fill_age:
+        df[RaceFields.AGE.value] = fill_missing_age(df[RaceFields.AGE.value], median_age=median_age)
 
     # Normalize state and city
     df.replace({RaceFields.STATE.value: {'-': ''}}, inplace=True)
@@ -126,48 +511,240 @@ def load_json_data(
         df[col] = df[col].apply(lambda x: x.title())
 
     # Flatten inner keys, ignore others
-    new_cols = defaultdict(list)
-    for _, split_details in pandas.Series(df['split_data']).to_dict().items():
-        for split_detail in split_details:
-            name = split_detail['name'].lower()
-            time = split_detail['time_ms']
-            new_cols[name].append(time)
-    df.drop('split_data', axis=1, inplace=True)
-    for name, rows in new_cols.items():
-        df[name] = rows
-    del new_cols
+    splits = flatten_split_data(df['split_data'], split_fields=split_fields)
+    df = pandas.concat([df.drop('split_data', axis=1), splits], axis=1)
 
     # Uppercase
     for col in [
         RaceFields.COUNTRY.value,
         RaceFields.GENDER.value,
     ]:
-        df[col] = df[col].apply(lambda x: x.upper())
-    country_data = load_country_details()
-    df[RaceFields.COUNTRY.value] = df[RaceFields.COUNTRY.value].apply(
-        lambda x: lookup_country_by_code(country_data=country_data, letter_code=x)[0]
-    )
+        df[col] = df[col].str.upper()
+    df[RaceFields.COUNTRY.value] = load_country_index().normalize(df[RaceFields.COUNTRY.value])
 
     # Normalize BIB and make it the index
     df[RaceFields.BIB.value] = df[RaceFields.BIB.value].astype(int)
     df.set_index(RaceFields.BIB.value, inplace=True)
 
     # Normalize timestamps
-    for time_field in [
-        RaceFields.TIME.value,
-        RaceFields.TWENTY_FLOOR_TIME.value,
-        RaceFields.SIXTY_FIVE_FLOOR_TIME.value
-    ]:
+    for time_field in TIME_FIELDS:
+        if time_field not in df.columns:
+            df[time_field] = pandas.Series(pandas.NA, index=df.index, dtype='Int64')
         try:
             df[time_field] = pandas.to_timedelta(df[time_field], unit="milliseconds")
-            if use_pretty:
-                df[time_field] = df[time_field].apply(PrettyDuration)
         except ValueError as ve:
             raise ValueError(f'{time_field}={df[time_field]}', ve) from ve
 
     return df
 
 
+def fill_missing_age(ages: Series, median_age: float = None) -> Series:
+    """
+    Runners without an age (missing or 0) get the median age, defaults to the median of the given ages
+    """
+    if median_age is None:
+        median_age = ages.median()
+    ages = ages.fillna(median_age)
+    return ages.mask(ages == 0, median_age).astype(int)
+
+
+def load_metadata(data_file: Path) -> DataFrame:
+    """
+    Load the event descriptors, generated by the same run from https://github.com/josevnz/athlinks-races
+    [
+    {"name": "Empire State Building Run-Up Presented by NYU Langone Health", "event_id": 1124263, "event_course_id": 2644840,
+    "distance_m": 320, "split_info": [{"name": "Full Course", "distance_m": 320}, ...], "date_utc_ms": 1759968000000}
+    ]
+    """
+    return pandas.read_json(data_file, encoding='utf-8')
+
+
+class RaceStore:
+    """
+    Results of several race years on a single DataFrame, with categorical year and event_id columns.
+    Rows of each year are contiguous, so a year is a cheap positional slice and not a new parse of the file.
+    """
+
+    def __init__(
+            self,
+            results: dict[int, Path] = None,
+            metadata: dict[int, Path] = None,
+            max_workers: int = None,
+            **load_options: Any
+    ):
+        """
+        Args:
+            results: Results file per year, defaults to RACE_RESULTS_JSON_FULL_LEVEL
+            metadata: Event descriptors file per year, defaults to RACE_METADATA
+            max_workers: Worker processes used to parse the results files, see load_json_files
+            load_options: Passed as is to load_json_data
+        """
+        def_results = RACE_RESULTS_JSON_FULL_LEVEL if results is None else results
+        def_metadata = RACE_METADATA if metadata is None else metadata
+        self.years = sorted(def_results.keys())
+        event_ids = {}
+        events = []
+        for year in self.years:
+            if year in def_metadata and def_metadata[year].exists():
+                # Each results file comes from a single event course, first descriptor is the one that matches
+                event = load_metadata(def_metadata[year]).iloc[0]
+                event_ids[year] = int(event[EventFields.EVENT_ID.value])
+                events.append({EventFields.YEAR.value: year, **{
+                    field.value: event[field.value] for field in EventFields if field != EventFields.YEAR
+                }})
+        self.events = DataFrame(events, columns=[field.value for field in EventFields]).set_index(EventFields.YEAR.value)
+
+        # The combined frame is cached too, so processes sharing a cache directory map the same pages
+        location = None
+        self.df = None
+        if load_options.get('use_cache', True) and not load_options.get('use_pretty', False):
+            store_options = {
+                'years': self.years,
+                'remove_dnf': load_options.get('remove_dnf', True),
+                'split_fields': [field.value for field in load_options.get('split_fields', ())],
+                'compact': load_options.get('compact', False)
+            }
+            location = cache_location(
+                data_file=[def_results[year] for year in self.years] + [
+                    def_metadata[year] for year in self.years if year in event_ids
+                ],
+                version=NORMALIZATION_VERSION,
+                cache_dir=load_options.get('cache_dir'),
+                name="store",
+                **store_options
+            )
+            self.df = load_frame(location)
+        if self.df is None:
+            self.df = self._concat_years(def_results, event_ids, max_workers, **load_options)
+            if location is not None:
+                try:
+                    save_frame(self.df, location, source="store", **store_options)
+                except (OSError, TypeError) as err:
+                    logging.warning(f"Could not cache the race store: {err}")
+        self.partitions: dict[int, slice] = {}
+        start = 0
+        for year, count in self.df[EventFields.YEAR.value].value_counts(sort=False).items():
+            self.partitions[year] = slice(start, start + count)
+            start += count
+
+    def _concat_years(
+            self,
+            results: dict[int, Path],
+            event_ids: dict[int, int],
+            max_workers: int = None,
+            **load_options: Any
+    ) -> DataFrame:
+        """
+        Load every year and put them together, years are contiguous and in order
+        """
+        frames = []
+        year_frames = load_json_files(
+            data_files=[results[year] for year in self.years],
+            max_workers=max_workers,
+            **load_options
+        )
+        for year, df in zip(self.years, year_frames, strict=True):
+            df.insert(0, EventFields.EVENT_ID.value, event_ids.get(year))
+            df.insert(0, EventFields.YEAR.value, year)
+            frames.append(df)
+        df = pandas.concat(frames)
+        df[EventFields.YEAR.value] = pandas.Categorical(df[EventFields.YEAR.value], categories=self.years)
+        df[EventFields.EVENT_ID.value] = df[EventFields.EVENT_ID.value].astype('category')
+        # Categories of each year are different, concat turns them back into text
+        return compact_results(df) if load_options.get('compact', False) else df
+
+    def __contains__(self, year: int) -> bool:
+        return year in self.partitions
+
+    def year(self, year: int) -> DataFrame:
+        """
+        Runners for a given race year
+        """
+        if year not in self.partitions:
+            raise KeyError(f"Year {year} is not loaded, available: {self.years}")
+        return self.df.iloc[self.partitions[year]]
+
+    def next_year(self, year: int) -> int:
+        """
+        Year loaded after the given one, wraps around to the first one
+        """
+        return self.years[(self.years.index(year) + 1) % len(self.years)]
+
+
+def compact_results(df: DataFrame) -> DataFrame:
+    """
+    Shrink the memory used by normalized race results, for big archives:
+    * Repeated text columns (CATEGORY_FIELDS) become categories
+    * Age uses the smallest integer type that fits
+    * Split times are stored as int32 milliseconds (nullable Int32 if any split is missing), use as_duration
+      to get them back as timedelta and format_duration to display them
+    """
+    compact = df.copy()
+    for field in CATEGORY_FIELDS:
+        compact[field] = compact[field].astype('category')
+    compact[RaceFields.AGE.value] = pandas.to_numeric(compact[RaceFields.AGE.value], downcast='integer')
+    for field in [column for column in compact.columns if pandas.api.types.is_timedelta64_dtype(compact[column])]:
+        milliseconds = compact[field] // pandas.Timedelta(milliseconds=1)
+        compact[field] = milliseconds.astype('Int32' if milliseconds.isna().any() else 'int32')
+    return compact
+
+
+def as_duration(series: Series) -> Series:
+    """
+    Race times as timedelta. Compact results keep them as integer milliseconds.
+    """
+    if pandas.api.types.is_timedelta64_dtype(series):
+        return series
+    return pandas.to_timedelta(series, unit='milliseconds')
+
+
+def format_duration(duration: datetime.timedelta | int) -> str:
+    """
+    Display a race time (timedelta or milliseconds) as M:SS, see PrettyDuration
+    """
+    if pandas.isna(duration):
+        return ''
+    if not isinstance(duration, datetime.timedelta):
+        duration = datetime.timedelta(milliseconds=int(duration))
+    return str(PrettyDuration(duration))
+
+
+def select_runners(df: DataFrame, bibs: list[int] = None) -> DataFrame:
+    """
+    Filter runners by racing BIB with an index lookup, keeping the DataFrame order.
+    Args:
+        df: DataFrame indexed by BIB
+        bibs: List of racing BIB to filter, all runners if empty
+    """
+    if not bibs:
+        return df
+    if df.index.is_unique:
+        positions = df.index.get_indexer(bibs)
+    else:
+        positions, _ = df.index.get_indexer_non_unique(bibs)
+    return df.take(numpy.unique(positions[positions >= 0]))
+
+
+def iter_rows(
+        df: DataFrame,
+        bibs: list[int] = None,
+        fields: list[str] = None
+) -> Iterator[tuple]:
+    """
+    Stream runner rows as tuples, one column array at a time instead of one Series per row.
+    Args:
+        df: DataFrame indexed by BIB
+        bibs: List of racing BIB to filter
+        fields: Fields on each tuple, defaults to FIELD_NAMES. The BIB comes from the index
+    """
+    selected = select_runners(df=df, bibs=bibs)
+    def_fields = FIELD_NAMES if fields is None else fields
+    columns = [
+        selected.index.tolist() if field == selected.index.name else selected[field].tolist() for field in def_fields
+    ]
+    yield from zip(*columns, strict=True)
+
+
 def df_to_list_of_tuples(
         df: DataFrame,
         bibs: list[int] = None
@@ -178,21 +755,9 @@ def df_to_list_of_tuples(
         param df DataFrame to convert
         param bibs List of racing BIB to filter
     return list of Tuple of rows, Tuple with columns
+    See iter_rows to stream the rows instead.
     """
-    bib_as_column = df.reset_index(level=0, inplace=False)
-    if not bibs:
-        filtered = bib_as_column
-    else:
-        filtered = bib_as_column[bib_as_column[RaceFields.BIB.value].isin(bibs)]
-    rows = []
-    for _, r in filtered.iterrows():
-        ind_row: list[Any] = []
-        for col in FIELD_NAMES:
-            ind_row.append(r[col])
-        tpl = tuple(ind_row)
-        rows.append(tpl)
-
-    return tuple(FIELD_NAMES), rows
+    return tuple(FIELD_NAMES), list(iter_rows(df=df, bibs=bibs))
 
 
 def series_to_list_of_tuples(series: Series) -> list[tuple]:
@@ -206,10 +771,32 @@ def series_to_list_of_tuples(series: Series) -> list[tuple]:
     return rows
 
 
-def load_country_details(data_file: Path = None) -> TOMLDocument:
+def parse_toml(data_file: Path) -> dict[str, dict[str, str]]:
+    """
+    Plain dictionaries from a TOML file, read only (no style or comments are kept)
+    """
+    with open(data_file, 'rb') as f:
+        return tomllib.load(f)
+
+
+def load_reference_data(data_file: Path, use_cache: bool = True, cache_dir: Path = None) -> dict[str, dict[str, str]]:
+    """
+    TOML reference data (countries, locations), compiled once into a cached artifact, see cache.load_compiled.
+    Args:
+        data_file: TOML file
+        use_cache: Use the compiled cache, or parse the file every time
+        cache_dir: Cache directory, defaults to CACHE_DIR
+    """
+    if not use_cache:
+        return parse_toml(data_file)
+    return load_compiled(source=data_file, compile_source=parse_toml, version=REFERENCE_VERSION, cache_dir=cache_dir)
+
+
+def load_country_details(data_file: Path = None, **cache_options: Any) -> dict[str, dict[str, str]]:
     """
     Args:
         data_file (Path): Path to data file in TOML format
+        cache_options: Passed as is to load_reference_data
     [ISOCountryCodes]
     name = "United States of America"
     alpha-2 = "US"
@@ -225,15 +812,14 @@ def load_country_details(data_file: Path = None) -> TOMLDocument:
 
     """
     def_file = COUNTRY_DETAILS if data_file is None else data_file
-    with open(def_file, encoding='utf-8') as f:
-        data = tomlkit.load(fp=f)
-        return data
+    return load_reference_data(data_file=def_file, **cache_options)
 
 
-def load_location_lookup(data_file: Path = None) -> TOMLDocument:
+def load_location_lookup(data_file: Path = None, **cache_options: Any) -> dict[str, dict[str, str]]:
     """
     Args:
         data_file (Path): Path to data file in TOML format
+        cache_options: Passed as is to load_reference_data
         [albany]
         alpha-2 = "US"
 
@@ -241,9 +827,7 @@ def load_location_lookup(data_file: Path = None) -> TOMLDocument:
         alpha-2 = "US"
     """
     def_file = LOCATION_DETAILS if data_file is None else data_file
-    with open(def_file, encoding='utf-8') as f:
-        data = tomlkit.load(fp=f)
-        return data
+    return load_reference_data(data_file=def_file, **cache_options)
 
 
 class CountryColumns(Enum):
@@ -267,15 +851,15 @@ COUNTRY_COLUMNS = [country.value for country in CountryColumns]
 
 
 def lookup_country_by_code(
-        country_data: TOMLDocument,
+        country_data: dict[str, dict[str, str]],
         letter_code: str
-) -> tuple[str, TOMLDocument] | None:
+) -> tuple[str, dict[str, str]] | None:
     """
     Args:
-        country_data (TOMLDocument): TOML document with country details
+        country_data: Country details, see load_country_details
         letter_code: 2,3-letter ISO code used to filter country
     Returns:
-        TOML document with country details, none if the lookup fails
+        Country name and details, none if the lookup fails
     """
     if len(letter_code) == 3:
         for country_name, country_details in country_data.items():
@@ -290,6 +874,80 @@ def lookup_country_by_code(
     return None
 
 
+class CountryRecord(NamedTuple):
+    """
+    Compact, read-only view of a single country entry from the country codes file
+    """
+    name: str
+    alpha_2: str
+    alpha_3: str
+    country_code: str
+    iso_3166_2: str
+    region: str
+    sub_region: str
+    intermediate_region: str
+    region_code: str
+    sub_region_code: str
+    intermediate_region_code: str
+
+
+class CountryIndex:
+    """
+    Hash index over the country codes, so lookups do not walk the whole document.
+    Alpha-2, alpha-3 and numeric (country-code) codes are all indexed.
+    """
+
+    def __init__(self, country_data: dict[str, dict[str, str]]):
+        self.by_alpha_2: dict[str, CountryRecord] = {}
+        self.by_alpha_3: dict[str, CountryRecord] = {}
+        self.by_numeric: dict[str, CountryRecord] = {}
+        for country_name, country_details in country_data.items():
+            record = CountryRecord(
+                str(country_name),
+                *[str(country_details[column]) for column in COUNTRY_COLUMNS[1:]]
+            )
+            self.by_alpha_2[record.alpha_2] = record
+            self.by_alpha_3[record.alpha_3] = record
+            self.by_numeric[record.country_code] = record
+        # Codes never collide across the three maps (2 letters, 3 letters, 3 digits)
+        self.code_to_name: dict[str, str] = {
+            code: record.name
+            for mapping in (self.by_alpha_2, self.by_alpha_3, self.by_numeric)
+            for code, record in mapping.items()
+        }
+
+    def __len__(self) -> int:
+        return len(self.by_alpha_2)
+
+    def lookup(self, code: str) -> CountryRecord | None:
+        """
+        Args:
+            code: 2,3-letter ISO code or 3-digit numeric code
+        Returns:
+            Country record, none if the lookup fails
+        """
+        if len(code) == 2:
+            return self.by_alpha_2.get(code)
+        if len(code) == 3:
+            return self.by_numeric.get(code) if code.isdigit() else self.by_alpha_3.get(code)
+        raise ValueError(f"Invalid country code: '{code}'")
+
+    def normalize(self, codes: Series) -> Series:
+        """
+        Replace country codes with country names, in one pass over the column.
+        Unknown codes are kept as they are.
+        """
+        return codes.map(self.code_to_name).fillna(codes)
+
+
+@lru_cache(maxsize=8)
+def load_country_index(data_file: Path = None) -> CountryIndex:
+    """
+    Build the country index once per process and data file
+    """
+    return CountryIndex(country_data=load_country_details(data_file=data_file))
+
+
 def get_times(df: DataFrame) -> DataFrame:
     """
     Get times from dataframe
@@ -346,6 +1004,22 @@ class PrettyDuration:
         raise ValueError(f"Not a PrettyDuration: {other}")
 
 
+def normalize_text(text: str) -> str:
+    """
+    Lower case text without accents, for searching
+    """
+    decomposed = unicodedata.normalize('NFKD', str(text).casefold())
+    return ''.join(char for char in decomposed if not unicodedata.combining(char)).strip()
+
+
+def trigrams(text: str) -> set[str]:
+    """
+    Character trigrams of a normalized word, padded so short words still have some
+    """
+    padded = f"  {text} "
+    return {padded[idx:idx + 3] for idx in range(len(padded) - 2)}
+
+
 class LocationLookup(Enum):
     """
     Location lookup columns
@@ -353,7 +1027,7 @@ class LocationLookup(Enum):
     ALPHA_2 = "alpha-2"
 
 
-def location_lookup(lookup_data: TOMLDocument, locality: str, default: str = "US") -> str:
+def location_lookup(lookup_data: dict[str, dict[str, str]], locality: str, default: str = "US") -> str:
     if locality in lookup_data:
         return lookup_data[locality][LocationLookup.ALPHA_2.value]
     return default
@@ -1,19 +1,518 @@
+import hashlib
+import io
+import json
+import logging
+import os
+import re
+import sqlite3
+import stat
+import tempfile
+from collections import Counter, deque
+from collections.abc import Iterable, Iterator
+from concurrent.futures import Future, ProcessPoolExecutor
+from contextlib import ExitStack
+from functools import partial
 from pathlib import Path
+from typing import NamedTuple
 
 import pandas
+from pandas import DataFrame, MultiIndex, Series
 
-from empirestaterunup.data import RaceFields, load_location_lookup, location_lookup
+from empirestaterunup.cache import CACHE_DIR, file_digest
+from empirestaterunup.data import (
+    COUNTRY_DETAILS,
+    DEFAULT_CHUNK_SIZE,
+    CountryIndex,
+    LocationLookup,
+    RaceFields,
+    load_country_index,
+    load_location_lookup,
+    normalize_text,
+    trigrams,
+)
+
+FUZZY_LOCALITY_THRESHOLD = 0.6
+"""
+Score of a locality found as a run of words inside a longer name ("astoria queens")
+"""
+TOKEN_MATCH_SCORE = 0.9
+LOCALITY_SPLIT = re.compile(r"[^\w]+")
+"""
+Bump every time the enrichment logic changes, so cached enriched records are not reused
+"""
+ENRICHMENT_VERSION = 3
+"""
+Columns of the raw race results with a fixed type, everything else is written back as it was read.
+Values that are not whole numbers are written as missing (null), and reported.
+"""
+RAW_RESULT_DTYPES = {RaceFields.BIB.value: 'Int64', RaceFields.AGE.value: 'Int64'}
+RECORD_CACHE_BATCH = 500
+RECORD_CACHE_FILE = CACHE_DIR.joinpath('enriched-records.sqlite')
+
+
+def normalize_key(values: Series) -> Series:
+    """
+    Lookup keys for locality and state columns, trimmed and lowercase
+    """
+    return values.fillna('').astype(str).str.strip().str.lower()
+
+
+def normalize_locality(locality: str) -> str:
+    """
+    Locality as a lookup key: lowercase, no accents, punctuation as single spaces and without
+    anything after a comma ("Brooklyn, NY" is "brooklyn")
+    """
+    name = normalize_text(locality).split(',')[0]
+    return ' '.join(filter(None, LOCALITY_SPLIT.split(name)))
+
+
+class LocalityMatcher:
+    """
+    Approximate matching of messy locality names against the lookup keys, with a trigram index.
+    Steps, first hit wins: normalized name, the longest run of words that is a key ("astoria queens"), and
+    trigram similarity (shared trigrams over the trigrams of the longest name) at or above the threshold.
+    Results are memoized per distinct locality.
+    """
+
+    def __init__(self, keys: Iterable[str], threshold: float = FUZZY_LOCALITY_THRESHOLD):
+        self.threshold = threshold
+        self.keys: dict[str, str] = {}
+        for key in keys:
+            self.keys.setdefault(normalize_locality(key), key)
+        self.keys.pop('', None)
+        self.key_trigrams: dict[str, set[str]] = {}
+        self.trigram_counts: dict[str, int] = {}
+        for normalized in self.keys:
+            key_trigrams = trigrams(normalized)
+            self.trigram_counts[normalized] = len(key_trigrams)
+            for trigram in key_trigrams:
+                self.key_trigrams.setdefault(trigram, set()).add(normalized)
+        self.memo: dict[str, tuple[str, float] | None] = {}
+
+    def match(self, locality: str) -> tuple[str, float] | None:
+        """
+        Best lookup key for a locality and its score (1.0 for a normalized exact match), None if nothing
+        reaches the threshold
+        """
+        if locality in self.memo:
+            return self.memo[locality]
+        self.memo[locality] = result = self._match(normalize_locality(locality))
+        return result
+
+    def match_many(self, localities: Iterable[str]) -> dict[str, tuple[str, float] | None]:
+        """
+        Match every distinct locality once
+        """
+        return {locality: self.match(locality) for locality in dict.fromkeys(localities)}
+
+    def _match(self, normalized: str) -> tuple[str, float] | None:
+        if not normalized:
+            return None
+        if normalized in self.keys:
+            return self.keys[normalized], 1.0
+        if self.threshold <= TOKEN_MATCH_SCORE:
+            words = normalized.split(' ')
+            for size in range(len(words) - 1, 0, -1):
+                for start in range(len(words) - size + 1):
+                    candidate = ' '.join(words[start:start + size])
+                    if candidate in self.keys:
+                        return self.keys[candidate], TOKEN_MATCH_SCORE
+        query_trigrams = trigrams(normalized)
+        shared: Counter[str] = Counter()
+        for trigram in query_trigrams:
+            shared.update(self.key_trigrams.get(trigram, ()))
+        best = None
+        for key, count in shared.items():
+            score = count / max(len(query_trigrams), self.trigram_counts[key])
+            if score >= self.threshold and (best is None or (score, key) > (best[1], best[0])):
+                best = key, score
+        return None if best is None else (self.keys[best[0]], best[1])
+
+
+class LocationTable:
+    """
+    Location lookup compiled into two indexed Series, one keyed by (locality, state) and one keyed by locality only.
+    Besides the country code, each locality on the lookup file may have sub-tables per state, for names
+    used in more than one country:
+        ["london"]
+        alpha-2 = "GB"
+
+        ["london".ontario]
+        alpha-2 = "CA"
+    Codes are used as they are on the lookup file, the ones that are blank or unknown to the country index are logged.
+    Localities without an exact hit go through a LocalityMatcher, unless fuzzy is off.
+    """
+
+    def __init__(
+            self,
+            lookup_data: dict[str, dict],
+            country_index: CountryIndex = None,
+            fuzzy: bool = True,
+            threshold: float = FUZZY_LOCALITY_THRESHOLD
+    ):
+        def_index = load_country_index() if country_index is None else country_index
+        pairs = {}
+        localities = {}
+        for locality, details in lookup_data.items():
+            locality_key = locality.strip().lower()
+            localities[locality_key] = details.get(LocationLookup.ALPHA_2.value, '')
+            for state, state_details in details.items():
+                if isinstance(state_details, dict):
+                    pairs[(locality_key, state.strip().lower())] = state_details.get(LocationLookup.ALPHA_2.value, '')
+        unknown = sorted({
+            f"{key[0]} ({key[1]})={code!r}" if isinstance(key, tuple) else f"{key}={code!r}"
+            for key, code in [*pairs.items(), *localities.items()] if code not in def_index.by_alpha_2
+        })
+        if unknown:
+            logging.warning(f"Location lookup codes that are blank or not a known country: {', '.join(unknown)}")
+        self.by_locality_state = Series(
+            list(pairs.values()),
+            index=MultiIndex.from_tuples(list(pairs.keys()), names=['locality', 'state']),
+            dtype=object
+        )
+        self.by_locality = Series(localities, dtype=object)
+        self.matcher = LocalityMatcher(self.by_locality.index, threshold=threshold) if fuzzy else None
+
+    def resolve(self, localities: Series, states: Series) -> Series:
+        """
+        Country codes for the given localities and states, in one join per key. Missing if they do not resolve.
+        """
+        locality_keys = normalize_key(localities)
+        pair_keys = MultiIndex.from_arrays([locality_keys, normalize_key(states)])
+        codes = Series(self.by_locality_state.reindex(pair_keys).to_numpy(), index=localities.index, dtype=object)
+        codes = codes.mask(codes.isna(), locality_keys.map(self.by_locality))
+        if self.matcher is not None and codes.isna().any():
+            missing = localities[codes.isna()].fillna('').astype(str)
+            matches = self.matcher.match_many(missing.unique())
+            fuzzy_codes = {
+                locality: self.by_locality[found[0]] for locality, found in matches.items() if found is not None
+            }
+            codes = codes.mask(codes.isna(), missing.map(fuzzy_codes))
+        return codes
+
+
+class RaceResultsEnricher:
+    """
+    Fill the blank countries of raw race results, column-wise. Localities that cannot be resolved get the
+    default country, and are counted on unresolved.
+    """
+
+    def __init__(self, location_table: LocationTable, default_country: str = "US"):
+        self.location_table = location_table
+        self.default_country = default_country
+        self.unresolved: Counter[str] = Counter()
+
+    def enrich(self, df: DataFrame) -> DataFrame:
+        """
+        Enrich a frame of raw results, in place. Returns the same frame.
+        """
+        blank = (df[RaceFields.COUNTRY.value].fillna('') == '').to_numpy()
+        if not blank.any():
+            return df
+        localities = df.loc[blank, RaceFields.CITY.value]
+        states = df.loc[blank, RaceFields.STATE.value] if RaceFields.STATE.value in df.columns \
+            else Series('', index=localities.index)
+        codes = self.location_table.resolve(localities, states)
+        missing = codes.isna()
+        self.unresolved.update(localities[missing].fillna('').astype(str).str.strip().value_counts().to_dict())
+        df.loc[blank, RaceFields.COUNTRY.value] = codes.fillna(self.default_country)
+        return df
+
+
+def frame_to_jsonl(df: DataFrame) -> str:
+    """
+    Race results as JSON lines, in one call
+    """
+    if df.empty:
+        return ''
+    lines = df.to_json(orient='records', lines=True, force_ascii=False)
+    return lines if lines.endswith('\n') else f"{lines}\n"
+
+
+def iter_raw_chunks(race_results_files: Iterable[Path], chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[list[str]]:
+    """
+    Raw JSON lines of several race results files, in order, in chunks of at most chunk_size records.
+    Every line ends with a new line, even the last one of a file without it.
+    """
+    chunk = []
+    for race_results_file in race_results_files:
+        with open(race_results_file, encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    chunk.append(line if line.endswith('\n') else f"{line}\n")
+                    if len(chunk) == chunk_size:
+                        yield chunk
+                        chunk = []
+    if chunk:
+        yield chunk
+
+
+class RecordCache:
+    """
+    Enriched records in SQLite, keyed by the digest of the raw record and the version of the lookup tables
+    (see lookup_version), so only new or changed records are enriched again.
+    """
+
+    def __init__(self, db_file: Path, version: str):
+        """
+        Args:
+            db_file: SQLite database, created if missing
+            version: Version of the lookup tables, records enriched with other versions are ignored
+        """
+        db_file.parent.mkdir(parents=True, exist_ok=True)
+        self.version = version
+        self.connection = sqlite3.connect(db_file)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS records ("
+            "digest TEXT NOT NULL, version TEXT NOT NULL, enriched TEXT NOT NULL, PRIMARY KEY (digest, version)"
+            ") WITHOUT ROWID"
+        )
+
+    def __enter__(self) -> 'RecordCache':
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def get_many(self, digests: Iterable[str]) -> dict[str, str]:
+        """
+        Enriched records found for the given digests
+        """
+        found = {}
+        unique = list(dict.fromkeys(digests))
+        for start in range(0, len(unique), RECORD_CACHE_BATCH):
+            batch = unique[start:start + RECORD_CACHE_BATCH]
+            found.update(self.connection.execute(
+                f"SELECT digest, enriched FROM records WHERE version = ? AND digest IN ({','.join('?' * len(batch))})",
+                [self.version, *batch]
+            ))
+        return found
+
+    def put_many(self, records: Iterable[tuple[str, str]]) -> None:
+        """
+        Save (digest, enriched record) pairs, in one transaction
+        """
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO records (digest, version, enriched) VALUES (?, ?, ?)",
+                ((digest, self.version, enriched) for digest, enriched in records)
+            )
+
+    def prune(self) -> int:
+        """
+        Remove the records enriched with other lookup table versions, returns how many
+        """
+        with self.connection:
+            return self.connection.execute("DELETE FROM records WHERE version != ?", [self.version]).rowcount
+
+
+def record_digest(line: str) -> str:
+    """
+    Content address of a raw race result (one JSON line)
+    """
+    return hashlib.sha256(line.strip().encode('utf-8')).hexdigest()
+
+
+def lookup_version(location_lookup_file: Path, default_country: str = "US") -> str:
+    """
+    Version of everything that decides the enriched output besides the raw record: lookup files, default country
+    and the enrichment code (ENRICHMENT_VERSION)
+    """
+    key = {
+        'location_lookup': file_digest(location_lookup_file),
+        'countries': file_digest(COUNTRY_DETAILS),
+        'default_country': default_country,
+        'fuzzy_threshold': FUZZY_LOCALITY_THRESHOLD,
+        'version': ENRICHMENT_VERSION
+    }
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+class EnrichmentSummary(NamedTuple):
+    """
+    Outcome of enrich_files. Unresolved localities and invalid values (see read_raw_results) only count the
+    records enriched on this run.
+    """
+    records: int
+    cached: int
+    unresolved: Counter
+    invalid: list[str]
+
+
+_WORKER_ENRICHER: RaceResultsEnricher | None = None
+
+
+def _init_enrich_worker(location_lookup_file: Path, default_country: str) -> None:
+    global _WORKER_ENRICHER
+    _WORKER_ENRICHER = RaceResultsEnricher(
+        location_table=LocationTable(load_location_lookup(data_file=location_lookup_file)),
+        default_country=default_country
+    )
+
+
+def read_raw_results(lines: str) -> tuple[DataFrame, list[str]]:
+    """
+    Raw race results from JSON lines. Types are not guessed from the values, so a record is written back the same
+    way whatever other records it is read with; only RAW_RESULT_DTYPES are converted.
+    Returns:
+        The results, and the values that could not be converted as "name (column=value)", or "name (bib missing)"
+    """
+    df = pandas.read_json(io.StringIO(lines), lines=True, dtype=False, convert_dates=False)
+    invalid = []
+    for column, dtype in RAW_RESULT_DTYPES.items():
+        if column not in df.columns:
+            continue
+        values = pandas.to_numeric(df[column], errors='coerce')
+        values = values.where(values % 1 == 0)
+        bad = values.isna() & (df[column].notna() | (column == RaceFields.BIB.value))
+        if bad.any():
+            names = df.loc[bad, RaceFields.NAME.value] if RaceFields.NAME.value in df.columns else Series('', index=df.index[bad])
+            invalid.extend(
+                f"{name} ({column} missing)" if pandas.isna(value) else f"{name} ({column}={value!r})"
+                for name, value in zip(names, df.loc[bad, column], strict=True)
+            )
+        df[column] = values.astype(dtype)
+    return df, invalid
+
+
+def _enrich_chunk(lines: list[str]) -> tuple[list[str], Counter, list[str]]:
+    """
+    Enrich a chunk of raw JSON lines on a worker, returns one enriched JSON line per record, the unresolved localities
+    and the invalid values
+    """
+    _WORKER_ENRICHER.unresolved = Counter()
+    if not lines:
+        return [], _WORKER_ENRICHER.unresolved, []
+    df, invalid = read_raw_results(''.join(lines))
+    _WORKER_ENRICHER.enrich(df)
+    # JSON escapes new lines inside values, other line breaks (like U+2028) are kept, so no splitlines
+    return frame_to_jsonl(df).rstrip('\n').split('\n'), _WORKER_ENRICHER.unresolved, invalid
+
+
+def _completed(lines: list[str]) -> Future:
+    future = Future()
+    future.set_result(_enrich_chunk(lines))
+    return future
+
+
+def output_mode(destination: Path) -> int:
+    """
+    Permissions for a new version of destination: the ones it has now, or the default for new files (umask)
+    """
+    try:
+        return stat.S_IMODE(destination.stat().st_mode)
+    except FileNotFoundError:
+        umask = os.umask(0)
+        os.umask(umask)
+        return 0o666 & ~umask
+
+
+def enrich_files(
+        race_results_files: list[Path],
+        location_lookup_file: Path,
+        enriched_race_results_file: Path,
+        default_country: str = "US",
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+        max_workers: int = None,
+        record_cache: Path = None
+) -> EnrichmentSummary:
+    """
+    Enrich several raw race results files into one, chunks are enriched on worker processes and written in input
+    order as soon as they are ready. Output goes to a temporary file renamed at the end, so the destination
+    never has a partial result.
+    Args:
+        race_results_files: Raw race results (JSON lines), in output order
+        location_lookup_file: Location lookup, see LocationTable
+        enriched_race_results_file: Destination
+        default_country: Country for the localities that cannot be resolved
+        chunk_size: Records per chunk
+        max_workers: Worker processes, defaults to the number of CPUs. With 1 everything runs on this process.
+        record_cache: SQLite file with the records enriched before (see RecordCache), only new or changed
+                      records are enriched. None to enrich everything.
+    Returns:
+        Records written, how many came from the record cache, the unresolved localities and the invalid values
+    """
+    workers = max_workers if max_workers else (os.cpu_count() or 1)
+    unresolved: Counter[str] = Counter()
+    invalid = []
+    records = 0
+    cached = 0
+    destination = enriched_race_results_file
+    destination.parent.mkdir(parents=True, exist_ok=True)
+    cache = None if record_cache is None else RecordCache(
+        db_file=record_cache, version=lookup_version(location_lookup_file, default_country)
+    )
+    fd, work_file = tempfile.mkstemp(prefix=f".{destination.name}-", dir=destination.parent)
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as outfile, ExitStack() as stack:
+            if workers == 1:
+                _init_enrich_worker(location_lookup_file, default_country)
+                submit = _completed
+            else:
+                executor = stack.enter_context(ProcessPoolExecutor(
+                    max_workers=workers,
+                    initializer=_init_enrich_worker,
+                    initargs=(location_lookup_file, default_country)
+                ))
+                submit = partial(executor.submit, _enrich_chunk)
+            pending = deque()
+
+            def write_oldest() -> None:
+                nonlocal records, cached
+                digests, hits, missing, future = pending.popleft()
+                enriched, chunk_unresolved, chunk_invalid = future.result()
+                fresh = iter(enriched)
+                lines = [hits[digest] if digest in hits else next(fresh) for digest in digests]
+                outfile.write(''.join(f"{line}\n" for line in lines))
+                if cache is not None and missing:
+                    cache.put_many(zip(missing, enriched, strict=True))
+                records += len(lines)
+                cached += len(lines) - len(enriched)
+                unresolved.update(chunk_unresolved)
+                invalid.extend(chunk_invalid)
+
+            for chunk in iter_raw_chunks(race_results_files, chunk_size=chunk_size):
+                digests = [record_digest(line) for line in chunk]
+                hits = {} if cache is None else cache.get_many(digests)
+                missing = [digest for digest in digests if digest not in hits]
+                lines = [line for line, digest in zip(chunk, digests, strict=True) if digest not in hits]
+                pending.append((digests, hits, missing, submit(lines)))
+                if len(pending) >= workers * 2:
+                    write_oldest()
+            while pending:
+                write_oldest()
+        # mkstemp files are private (0600), the output keeps the mode of the file it replaces, or follows the umask
+        os.chmod(work_file, output_mode(destination))
+        os.replace(work_file, destination)
+    except BaseException:
+        Path(work_file).unlink(missing_ok=True)
+        raise
+    finally:
+        if cache is not None:
+            cache.close()
+    return EnrichmentSummary(records=records, cached=cached, unresolved=unresolved, invalid=invalid)
 
 
 def enrich_race_results(
         location_lookup_file: Path,
-        race_results_file: Path
+        race_results_file: Path,
+        default_country: str = "US"
 ) -> list[dict]:
-    ll = load_location_lookup(data_file=location_lookup_file)
-    race_results = pandas.read_json(race_results_file, lines=True, encoding='utf-8').to_dict(orient='records')
-    for result in race_results:
-        if result[RaceFields.COUNTRY.value] == '':
-            locality = result[RaceFields.CITY.value].lower()
-            two_letter_code = location_lookup(lookup_data=ll, locality=locality)
-            result[RaceFields.COUNTRY.value] = two_letter_code
-    return race_results
+    """
+    Enriched race results as dictionaries, see enrich_files
+    """
+    with tempfile.TemporaryDirectory(prefix="esru-") as work_dir:
+        enriched_race_results_file = Path(work_dir).joinpath(race_results_file.name)
+        enrich_files(
+            race_results_files=[race_results_file],
+            location_lookup_file=location_lookup_file,
+            enriched_race_results_file=enriched_race_results_file,
+            default_country=default_country,
+            max_workers=1
+        )
+        with open(enriched_race_results_file, encoding='utf-8') as f:
+            return [json.loads(line) for line in f]
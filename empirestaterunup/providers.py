@@ -1,19 +1,157 @@
 """
 Module to handle all the providers' logic.
 """
-from collections.abc import AsyncGenerator
+import asyncio
+import heapq
+import re
+from bisect import bisect_left
+from collections import Counter
+from collections.abc import AsyncGenerator, Iterable
 from functools import partial
-from typing import Any
+from itertools import islice
+from typing import Any, NamedTuple
 
+from pandas import DataFrame
 from rich.style import Style
 from textual.command import DiscoveryHit, Hit, Provider
 from textual.screen import Screen
-from textual.widgets import DataTable
 
-from empirestaterunup.data import FIELD_NAMES_AND_POS, RaceFields
+from empirestaterunup.data import (
+    FIELD_NAMES_AND_POS,
+    RaceFields,
+    normalize_text,
+    trigrams,
+)
 from empirestaterunup.screens import RunnerDetailScreen
 
 PALETTE_FIELDS = [RaceFields.BIB, RaceFields.NAME, RaceFields.COUNTRY]
+MAX_HITS = 25
+MAX_DISCOVERY_HITS = 5
+FUZZY_THRESHOLD = 0.5
+TOKEN_SPLIT = re.compile(r"[^\w]+")
+
+
+class SearchHit(NamedTuple):
+    """
+    Runner found on the search index
+    """
+    bib: int
+    name: str
+    field: RaceFields
+    text: str
+    score: float
+
+
+class RunnerSearchIndex:
+    """
+    In memory index of the runners, built once so each palette keystroke is a few dictionary lookups
+    instead of a scan of every table row. Covers BIB (exact and prefix), name (token prefix, and
+    token trigram similarity for typos) and country (prefix).
+    """
+
+    def __init__(self, df: DataFrame):
+        """
+        Args:
+            df: Runners, indexed by BIB
+        """
+        self.bibs = df.index.tolist()
+        self.names = df[RaceFields.NAME.value].astype(str).tolist()
+        self.countries = df[RaceFields.COUNTRY.value].astype(str).tolist()
+        self.by_bib: dict[str, int] = {str(bib): pos for pos, bib in enumerate(self.bibs)}
+        self.sorted_bibs = sorted(self.by_bib)
+        self.tokens: dict[str, set[int]] = {}
+        for pos, name in enumerate(self.names):
+            for token in filter(None, TOKEN_SPLIT.split(normalize_text(name))):
+                self.tokens.setdefault(token, set()).add(pos)
+        self.sorted_tokens = sorted(self.tokens)
+        self.token_trigrams: dict[str, set[str]] = {}
+        self.trigram_counts: dict[str, int] = {}
+        for token in self.tokens:
+            token_trigrams = trigrams(token)
+            self.trigram_counts[token] = len(token_trigrams)
+            for trigram in token_trigrams:
+                self.token_trigrams.setdefault(trigram, set()).add(token)
+        # Country hits all score the same, runners are kept in BIB order so only the first ones are read
+        self.by_country: dict[str, list[int]] = {}
+        for pos in sorted(range(len(self.bibs)), key=self.bibs.__getitem__):
+            self.by_country.setdefault(normalize_text(self.countries[pos]), []).append(pos)
+        self.sorted_countries = sorted(self.by_country)
+
+    def __len__(self) -> int:
+        return len(self.bibs)
+
+    @staticmethod
+    def _with_prefix(sorted_keys: list[str], prefix: str) -> Iterable[str]:
+        """
+        Keys starting with prefix, from a sorted list of keys
+        """
+        for idx in range(bisect_left(sorted_keys, prefix), len(sorted_keys)):
+            if not sorted_keys[idx].startswith(prefix):
+                break
+            yield sorted_keys[idx]
+
+    def _token_matches(self, query_token: str) -> dict[int, float]:
+        """
+        Runners with a name token similar to the query token, 1.0 if the name token starts with it,
+        otherwise the share of trigrams in common
+        """
+        matches: dict[int, float] = {}
+        query_trigrams = trigrams(query_token)
+        shared = Counter()
+        for trigram in query_trigrams:
+            shared.update(self.token_trigrams.get(trigram, ()))
+        for token, count in shared.items():
+            similarity = count / max(len(query_trigrams), self.trigram_counts[token])
+            if similarity >= FUZZY_THRESHOLD:
+                for pos in self.tokens[token]:
+                    matches[pos] = max(similarity, matches.get(pos, 0.0))
+        for token in self._with_prefix(self.sorted_tokens, query_token):
+            for pos in self.tokens[token]:
+                matches[pos] = 1.0
+        return matches
+
+    def search(self, query: str, limit: int = MAX_HITS) -> list[SearchHit]:
+        """
+        Find runners by BIB, name or country
+        Args:
+            query: What the user typed
+            limit: Maximum number of hits
+        Returns:
+            Best hits first, at most one per runner and field
+        """
+        normalized = normalize_text(query)
+        if not normalized:
+            return []
+        scores: dict[tuple[int, RaceFields], float] = {}
+
+        def score(pos: int, field: RaceFields, value: float) -> None:
+            key = (pos, field)
+            if value > scores.get(key, 0.0):
+                scores[key] = value
+
+        # BIB, exact or prefix
+        if normalized.isdigit():
+            for bib in self._with_prefix(self.sorted_bibs, normalized):
+                score(self.by_bib[bib], RaceFields.BIB, 1.0 if bib == normalized else 0.9)
+
+        # Name, every query token is a prefix of a name token, or close to one (typos)
+        query_tokens = [token for token in TOKEN_SPLIT.split(normalized) if token]
+        if query_tokens:
+            token_matches = [self._token_matches(token) for token in query_tokens]
+            for pos in set.intersection(*(set(matches) for matches in token_matches)):
+                score(pos, RaceFields.NAME, 0.8 * sum(matches[pos] for matches in token_matches) / len(token_matches))
+
+        # Country, prefix
+        countries = [self.by_country[country] for country in self._with_prefix(self.sorted_countries, normalized)]
+        for pos in islice(heapq.merge(*countries, key=self.bibs.__getitem__), limit):
+            score(pos, RaceFields.COUNTRY, 0.6)
+
+        best = heapq.nsmallest(limit, scores.items(), key=lambda item: (-item[1], self.bibs[item[0][0]]))
+        texts = {RaceFields.BIB: self.bibs, RaceFields.NAME: self.names, RaceFields.COUNTRY: self.countries}
+        return [
+            SearchHit(bib=self.bibs[pos], name=self.names[pos], field=field, text=str(texts[field][pos]), score=value)
+            for (pos, field), value in best
+        ]
 
 
 class BrowserAppCommand(Provider):
@@ -31,65 +169,72 @@ class BrowserAppCommand(Provider):
         """
         super().__init__(screen, match_style)
         self.table = None
+        self.index = None
         self.debug = debug
         self.log = self.app.log
 
     async def startup(self) -> None:
         """
-        Data loading on the palette startup
+        Data loading on the palette startup, the search index is shared with the application
         """
         browser_app = self.app
-        self.table = browser_app.query(DataTable).first()
+        self.table = browser_app.query_one('#runners')
+        if getattr(browser_app, 'search_index', None) is None:
+            browser_app.search_index = await asyncio.to_thread(RunnerSearchIndex, browser_app.df)
+        self.index = browser_app.search_index
         if self.debug:
             self.log.info(f"Table on provider: {self.table}")
-            self.log.info(f"Rows:{len(self.table.rows)}")
+            self.log.info(f"Rows:{len(self.table.rows)}, indexed runners: {len(self.index)}")
+
+    def show_runner(self, row_key: str) -> None:
+        """
+        Build and show the detail screen of a runner, only called for the hit the user picked
+        """
+        self.app.push_screen(RunnerDetailScreen(
+            table=self.table,
+            row=self.table.get_row(row_key),
+            country_data=self.app.country_data
+        ))
 
     async def discover(self) -> AsyncGenerator[DiscoveryHit, Any]:
         """
-        Pre-populate the palette with results, to give an idea how the search works
+        Pre-populate the palette with the fastest runners, to give an idea how the search works
         """
-        browser_app = self.screen.app
-        for row_key in self.table.rows:
+        name_idx = FIELD_NAMES_AND_POS[RaceFields.NAME]
+        for bib in self.app.df[RaceFields.TIME.value].nsmallest(MAX_DISCOVERY_HITS).index:
+            row_key = str(bib)
+            if row_key not in self.table.rows:
+                continue
             row = self.table.get_row(row_key)
             for name in PALETTE_FIELDS:
-                idx = FIELD_NAMES_AND_POS[name]
-                name_idx = FIELD_NAMES_AND_POS[RaceFields.NAME]
-                searchable = str(row[idx])
+                searchable = str(row[FIELD_NAMES_AND_POS[name]])
                 if name == RaceFields.NAME:
                     details = f"{searchable} - {name.value}"
                 else:
                     details = f"{searchable} - {name.value} ({row[name_idx]})"
-                runner_detail_screen = RunnerDetailScreen(table=self.table, row=row)
                 yield DiscoveryHit(
-                        command=partial(browser_app.push_screen, runner_detail_screen),
+                        command=partial(self.show_runner, row_key),
                         display=f"Field: {name.value.title()}",
                         help=f"{details}"
                 )
-            break
 
     async def search(self, query: str) -> AsyncGenerator[Hit, Any]:
         """
-        Return hits based on a user query
+        Return the best ranked hits from the search index, only for runners still on the table.
+        Hits carry the row key, the detail screen is built if the hit is chosen.
         """
         matcher = self.matcher(query)
-        browser_app = self.screen.app
-        for row_key in self.table.rows:
-            row = self.table.get_row(row_key)
-            for name in PALETTE_FIELDS:
-                idx = FIELD_NAMES_AND_POS[name]
-                name_idx = FIELD_NAMES_AND_POS[RaceFields.NAME]
-                searchable = str(row[idx])
-                score = matcher.match(searchable)
-                if score > 0:
-                    if name == RaceFields.NAME:
-                        details = f"{searchable} - {name.value}"
-                    else:
-                        details = f"{searchable} - {name.value} ({row[name_idx]})"
-                    runner_detail_screen = RunnerDetailScreen(
-                        table=self.table, row=row)
-                    yield Hit(
-                        score=score,
-                        match_display=matcher.highlight(f"{searchable}"),
-                        command=partial(browser_app.push_screen, runner_detail_screen),
-                        help=f"{details}"
-                    )
+        for hit in self.index.search(query):
+            row_key = str(hit.bib)
+            if row_key not in self.table.rows:
+                continue
+            if hit.field == RaceFields.NAME:
+                details = f"{hit.text} - {hit.field.value}"
+            else:
+                details = f"{hit.text} - {hit.field.value} ({hit.name})"
+            yield Hit(
+                score=hit.score,
+                match_display=matcher.highlight(hit.text),
+                command=partial(self.show_runner, row_key),
+                help=f"{details}"
+            )
@@ -0,0 +1,228 @@
+"""
+Headless report, every chart of Plotter and every table of esru_numbers and esru_outlier for the selected race years.
+Results are loaded once, items are rendered on worker processes with the Agg backend. A manifest keeps the fingerprint
+of the data behind each item, so items whose data did not change are not rendered again.
+author: Jose Vicente Nunez <kodegeek.com@protonmail.com>
+"""
+import html
+import json
+import logging
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from enum import Enum
+from pathlib import Path
+
+import matplotlib.pyplot as plt
+from pandas import DataFrame
+
+from empirestaterunup.analyze import (
+    FIVE_NUMBER_FIELDS,
+    SUMMARY_METRICS,
+    dataset_fingerprint,
+    get_outliers,
+    get_snapshot,
+)
+from empirestaterunup.apps import FiveNumberApp, OutlierApp, Plotter
+from empirestaterunup.data import RaceStore
+
+REPORT_VERSION = 1
+MANIFEST_FILE = "manifest.json"
+INDEX_FILE = "index.html"
+CHART_FORMATS = ('png', 'svg')
+
+
+class ReportItem(Enum):
+    """
+    Charts and tables on the report, for each race year
+    """
+    AGE_BOX = 'age-box'
+    AGE_HIST = 'age-hist'
+    COUNTRY = 'country'
+    GENDER = 'gender'
+    FIVE_NUMBERS = 'five-numbers'
+    OUTLIERS = 'outliers'
+
+
+CHARTS = {
+    ReportItem.AGE_BOX: lambda plotter: plotter.plot_age('box'),
+    ReportItem.AGE_HIST: lambda plotter: plotter.plot_age('hist'),
+    ReportItem.COUNTRY: Plotter.plot_country,
+    ReportItem.GENDER: Plotter.plot_gender,
+}
+
+
+def _init_worker() -> None:
+    plt.switch_backend('Agg')
+    plt.style.use('fivethirtyeight')  # Same style as esru_plot
+
+
+def _html_page(title: str, sections: list[tuple[str, DataFrame]]) -> str:
+    body = '\n'.join(
+        f"<h2>{html.escape(header)}</h2>\n{table.to_html(index=False, border=0)}" for header, table in sections
+    )
+    return f"<!DOCTYPE html>\n<html>\n<head><meta charset=\"utf-8\"><title>{html.escape(title)}</title></head>\n" \
+           f"<body>\n<h1>{html.escape(title)}</h1>\n{body}\n</body>\n</html>\n"
+
+
+def five_number_tables(df: DataFrame, snapshot_dir: Path = None) -> list[tuple[str, DataFrame]]:
+    """
+    Same tables as esru_numbers, race times in minutes
+    """
+    snapshot = get_snapshot(df, snapshot_dir=snapshot_dir)
+    sections = [(
+        "Summary",
+        DataFrame(FiveNumberApp.summary_rows(snapshot.summary), columns=['Metric', *FIVE_NUMBER_FIELDS])
+    )]
+    for table_id, (counter, header) in FiveNumberApp.COUNTER_TABLES.items():
+        sections.append((table_id.name.replace('_', ' ').title(), DataFrame(getattr(snapshot, counter), columns=header)))
+    return sections
+
+
+def outlier_tables(df: DataFrame) -> list[tuple[str, DataFrame]]:
+    """
+    Same tables as esru_outlier (z-score), race times in minutes
+    """
+    sections = []
+    for metric in SUMMARY_METRICS:
+        rows = OutlierApp.outlier_rows(metric, get_outliers(df=df, column=metric.value))
+        sections.append((f"{metric.value.title()} outliers", DataFrame(rows, columns=['BIB', metric.value.title()])))
+    return sections
+
+
+def output_files(item: ReportItem, year: int, output_dir: Path, formats: tuple[str, ...] = CHART_FORMATS) -> list[Path]:
+    """
+    Files written for a report item
+    """
+    if item in CHARTS:
+        return [output_dir.joinpath(f"{year}-{item.value}.{extension}") for extension in formats]
+    return [output_dir.joinpath(f"{year}-{item.value}.html")]
+
+
+def render_item(
+        item: ReportItem,
+        year: int,
+        df: DataFrame,
+        output_dir: Path,
+        formats: tuple[str, ...] = CHART_FORMATS,
+        snapshot_dir: Path = None
+) -> list[Path]:
+    """
+    Render a report item to its output files, runs on a worker process
+    """
+    files = output_files(item, year, output_dir, formats)
+    if item in CHARTS:
+        fig = CHARTS[item](Plotter(year=year, df=df))
+        if item == ReportItem.COUNTRY:
+            # One bar per country, the interactive window can be resized but the file cannot
+            fig.set_size_inches(16, max(6.0, 0.3 * len(fig.axes[0].patches)))
+        try:
+            for output_file in files:
+                fig.savefig(output_file)
+        finally:
+            plt.close(fig)
+    else:
+        if item == ReportItem.FIVE_NUMBERS:
+            tables = five_number_tables(df, snapshot_dir=snapshot_dir)
+        else:
+            tables = outlier_tables(df)
+        title = f"{item.value.replace('-', ' ').title()} (Race year: {year})"
+        files[0].write_text(_html_page(title, tables), encoding='utf-8')
+    return files
+
+
+def _load_manifest(output_dir: Path) -> dict[str, dict]:
+    try:
+        with open(output_dir.joinpath(MANIFEST_FILE), encoding='utf-8') as f:
+            manifest = json.load(f)
+        return manifest['items'] if manifest.get('report_version') == REPORT_VERSION else {}
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError, KeyError) as err:
+        logging.warning(f"Ignoring unreadable report manifest: {err}")
+        return {}
+
+
+def _save_manifest(output_dir: Path, items: dict[str, dict]) -> None:
+    fd, work_file = tempfile.mkstemp(prefix=f".{MANIFEST_FILE}-", dir=output_dir)
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump({'report_version': REPORT_VERSION, 'items': items}, f, indent=2, sort_keys=True)
+        os.replace(work_file, output_dir.joinpath(MANIFEST_FILE))
+    except BaseException:
+        Path(work_file).unlink(missing_ok=True)
+        raise
+
+
+def _write_index(output_dir: Path, items: dict[str, dict]) -> None:
+    links = '\n'.join(
+        f"<li>{html.escape(name)}: " + ' '.join(
+            f"<a href=\"{html.escape(file)}\">{html.escape(Path(file).suffix[1:])}</a>" for file in entry['files']
+        ) + "</li>"
+        for name, entry in sorted(items.items())
+    )
+    output_dir.joinpath(INDEX_FILE).write_text(
+        f"<!DOCTYPE html>\n<html>\n<head><meta charset=\"utf-8\"><title>Empire State Run-Up</title></head>\n"
+        f"<body>\n<h1>Empire State Run-Up</h1>\n<ul>\n{links}\n</ul>\n</body>\n</html>\n",
+        encoding='utf-8'
+    )
+
+
+def generate_report(
+        output_dir: Path,
+        store: RaceStore = None,
+        years: list[int] = None,
+        items: list[ReportItem] = None,
+        formats: tuple[str, ...] = CHART_FORMATS,
+        max_workers: int = None,
+        force: bool = False,
+        snapshot_dir: Path = None
+) -> tuple[list[Path], list[Path]]:
+    """
+    Write the report files for the selected years.
+    Args:
+        output_dir: Report directory, created if missing
+        store: Race results, defaults to a new RaceStore
+        years: Race years to report, defaults to all the years on the store
+        items: Charts and tables to render, defaults to all of them
+        formats: Chart file formats, tables are always HTML
+        max_workers: Number of worker processes, defaults to the number of CPUs
+        force: Render every item, even if its data did not change
+        snapshot_dir: Directory with the saved statistic snapshots, see get_snapshot
+    Returns:
+        Files written and files skipped
+    """
+    def_store = RaceStore() if store is None else store
+    def_years = def_store.years if years is None else years
+    def_items = list(ReportItem) if items is None else items
+    output_dir.mkdir(parents=True, exist_ok=True)
+    manifest = _load_manifest(output_dir)
+    written, skipped = [], []
+    pending = []
+    for year in def_years:
+        df = def_store.year(year)
+        fingerprint = dataset_fingerprint(df)
+        for item in def_items:
+            files = output_files(item, year, output_dir, formats)
+            entry = {'fingerprint': fingerprint, 'files': [output_file.name for output_file in files]}
+            name = f"{year}-{item.value}"
+            if not force and manifest.get(name) == entry and all(output_file.exists() for output_file in files):
+                skipped.extend(files)
+            else:
+                pending.append((name, entry, item, year, df))
+    if pending:
+        workers = min(len(pending), max_workers if max_workers else (os.cpu_count() or 1))
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as executor:
+            futures = [
+                (name, entry, executor.submit(render_item, item, year, df, output_dir, formats, snapshot_dir))
+                for name, entry, item, year, df in pending
+            ]
+            try:
+                for name, entry, future in futures:
+                    written.extend(future.result())
+                    manifest[name] = entry
+            finally:
+                # Whatever finished is recorded, a failed run does not render it again
+                _save_manifest(output_dir, manifest)
+    _write_index(output_dir, manifest)
+    return written, skipped
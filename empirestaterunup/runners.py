@@ -4,26 +4,61 @@ I wrote this script to normalize the data results from the 'Empire State Buildin
 
 Author Jose Vicente Nunez (kodegeek.com@protonmail.com)
 """
-import json
 import logging
+import time
 from argparse import ArgumentParser
 from pathlib import Path
 
 from matplotlib import pyplot as plt
+from pandas import DataFrame
 
+from empirestaterunup.analyze import SNAPSHOT_DIR, OutlierGroups, OutlierMethod
 from empirestaterunup.apps import BrowserApp, FiveNumberApp, OutlierApp, Plotter
+from empirestaterunup.cache import CACHE_DIR
 from empirestaterunup.data import (
+    DEFAULT_CHUNK_SIZE,
     DEFAULT_YEAR,
     RACE_RESULTS_JSON_FULL_LEVEL,
-    load_country_details,
-    load_json_data,
+    RaceStore,
+    ResultsTail,
+    load_country_index,
 )
-from empirestaterunup.devtools import enrich_race_results
+from empirestaterunup.devtools import RECORD_CACHE_FILE, enrich_files
+from empirestaterunup.report import CHART_FORMATS, generate_report
 
 logging.basicConfig(format='%(asctime)s %(message)s', encoding='utf-8', level=logging.INFO)
 RESULTS = list(RACE_RESULTS_JSON_FULL_LEVEL.keys())
 
 
+def add_store_arguments(parser: ArgumentParser) -> None:
+    """
+    Options to load the race store, shared by the applications
+    """
+    parser.add_argument(
+        "--cache-dir",
+        action="store",
+        type=Path,
+        default=None,
+        help=f"Results cache directory. Default: {CACHE_DIR}"
+    )
+    parser.add_argument(
+        "--compact",
+        action="store_true",
+        default=False,
+        help="Compact memory layout for the results (categories and integer milliseconds)."
+    )
+
+
+def wait_for_results(tail: ResultsTail, interval: float = 2.0) -> DataFrame:
+    """
+    Block until the followed results file has finished runners, returns them
+    """
+    while (df := tail.read()) is None:
+        logging.info(f"Waiting for results on {tail.data_file}")
+        time.sleep(interval)
+    return df
+
+
 def run_5_number():
     """
     Entry point for 5 number app
@@ -38,14 +73,35 @@ def run_5_number():
         nargs='?',
         help="Race results."
     )
+    parser.add_argument(
+        "--snapshot-dir",
+        action="store",
+        type=Path,
+        default=SNAPSHOT_DIR,
+        help=f"Directory with saved statistic snapshots, new snapshots are written there too. Default: {SNAPSHOT_DIR}"
+    )
+    parser.add_argument(
+        "--follow",
+        action="store",
+        type=Path,
+        default=None,
+        help="Follow a live results file (JSON lines), new results are shown as they are appended. Replaces the race year."
+    )
+    add_store_arguments(parser)
     options = parser.parse_args()
-    if options.results:
-        FiveNumberApp.DF = load_json_data(data_file=RACE_RESULTS_JSON_FULL_LEVEL[options.results])
+    FiveNumberApp.SNAPSHOT_DIR = options.snapshot_dir
+    if options.follow:
+        FiveNumberApp.TAIL = ResultsTail(options.follow)
+        FiveNumberApp.DF = wait_for_results(FiveNumberApp.TAIL)
+        source = f"Live: {options.follow.name}"
     else:
-        FiveNumberApp.DF = load_json_data()
+        FiveNumberApp.STORE = RaceStore(cache_dir=options.cache_dir, compact=options.compact)
+        FiveNumberApp.YEAR = options.results if options.results else DEFAULT_YEAR
+        FiveNumberApp.DF = FiveNumberApp.STORE.year(FiveNumberApp.YEAR)
+        source = f"Year: {options.results}"
     app = FiveNumberApp()
     app.title = "Five Number Summary".title()
-    app.sub_title = f"Runners: {FiveNumberApp.DF.shape[0]} (Year: {options.results})"
+    app.sub_title = f"Runners: {FiveNumberApp.DF.shape[0]} ({source})"
     app.run()
 
 
@@ -63,14 +119,45 @@ def run_outlier():
         nargs='?',
         help="Race results."
     )
+    parser.add_argument(
+        "--method",
+        action="store",
+        choices=[method.value for method in OutlierMethod],
+        default=OutlierMethod.ZSCORE.value,
+        help="Outlier detection method: z-score, IQR (Tukey fences) or MAD (robust z-score)."
+    )
+    parser.add_argument(
+        "--group-by",
+        action="store",
+        choices=[group.value for group in OutlierGroups],
+        default=None,
+        help="Find the outliers inside each group of runners, instead of the whole race."
+    )
+    parser.add_argument(
+        "--follow",
+        action="store",
+        type=Path,
+        default=None,
+        help="Follow a live results file (JSON lines), new results are shown as they are appended. Replaces the race year."
+    )
+    add_store_arguments(parser)
     options = parser.parse_args()
-    if options.results:
-        OutlierApp.DF = load_json_data(data_file=RACE_RESULTS_JSON_FULL_LEVEL[options.results], use_pretty=False)
+    if options.follow and OutlierMethod(options.method) != OutlierMethod.ZSCORE:
+        parser.error("--follow finds the outliers with running moments, only the z-score method is supported")
+    OutlierApp.METHOD = OutlierMethod(options.method)
+    OutlierApp.GROUP_BY = None if options.group_by is None else OutlierGroups(options.group_by)
+    if options.follow:
+        OutlierApp.TAIL = ResultsTail(options.follow)
+        OutlierApp.DF = wait_for_results(OutlierApp.TAIL)
+        source = f"Live: {options.follow.name}"
     else:
-        OutlierApp.DF = load_json_data(use_pretty=False)
+        OutlierApp.STORE = RaceStore(use_pretty=False, cache_dir=options.cache_dir, compact=options.compact)
+        OutlierApp.YEAR = options.results if options.results else DEFAULT_YEAR
+        OutlierApp.DF = OutlierApp.STORE.year(OutlierApp.YEAR)
+        source = f"Year: {options.results}"
     app = OutlierApp()
     app.title = "Outliers Summary".title()
-    app.sub_title = f"Runners: {OutlierApp.DF.shape[0]} (Year: {options.results})"
+    app.sub_title = f"Runners: {OutlierApp.DF.shape[0]} ({source})"
     app.run()
 
 
@@ -117,6 +204,58 @@ def simple_plot():
     plt.show()
 
 
+def run_report():
+    """
+    Entry point for the batch report
+    """
+    parser = ArgumentParser(description="Write all the charts and tables of the Empire State RunUp as files")
+    parser.add_argument(
+        "--output",
+        action="store",
+        type=Path,
+        default=Path("report"),
+        help="Report directory. Default: report"
+    )
+    parser.add_argument(
+        "--format",
+        action="store",
+        choices=CHART_FORMATS,
+        default=list(CHART_FORMATS),
+        nargs="+",
+        help=f"Chart formats, tables are always HTML. Default: {CHART_FORMATS}"
+    )
+    parser.add_argument(
+        "--workers",
+        action="store",
+        type=int,
+        default=None,
+        help="Worker processes, defaults to the number of CPUs"
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        default=False,
+        help="Render every chart and table, even if its data did not change"
+    )
+    parser.add_argument(
+        "results",
+        action="store",
+        type=int,
+        choices=RESULTS,
+        nargs='*',
+        help="Race results, defaults to all the years."
+    )
+    options = parser.parse_args()
+    written, skipped = generate_report(
+        output_dir=options.output,
+        years=options.results if options.results else None,
+        formats=tuple(options.format),
+        max_workers=options.workers,
+        force=options.force
+    )
+    logging.info(f"Report on {options.output}: {len(written)} files written, {len(skipped)} unchanged")
+
+
 def run_browser():
     """
     Entry point for runner browser app
@@ -138,14 +277,39 @@ def run_browser():
         nargs='?',
         help="Race results."
     )
+    parser.add_argument(
+        "--follow",
+        action="store",
+        type=Path,
+        default=None,
+        help="Follow a live results file (JSON lines), new results are shown as they are appended. Replaces the race year."
+    )
+    parser.add_argument(
+        "--virtual",
+        action="store_true",
+        default=False,
+        help="Read the table cells from the results on display, instead of copying every runner into the table. "
+             "Uses less memory on large archives."
+    )
+    add_store_arguments(parser)
     options = parser.parse_args()
-    country_df = None
-    df = load_json_data(data_file=RACE_RESULTS_JSON_FULL_LEVEL[options.results], use_pretty=True)
+    country_index = None
     if options.country:
-        country_df = load_country_details(data_file=options.country)
-    app = BrowserApp(df=df, country_data=country_df)
+        country_index = load_country_index(data_file=options.country)
+    if options.follow:
+        tail = ResultsTail(options.follow)
+        app = BrowserApp(df=wait_for_results(tail), tail=tail, country_data=country_index, virtual=options.virtual)
+        source = f"Live: {options.follow.name}"
+    else:
+        app = BrowserApp(
+            store=RaceStore(cache_dir=options.cache_dir, compact=options.compact),
+            year=options.results,
+            country_data=country_index,
+            virtual=options.virtual
+        )
+        source = f"Year: {options.results}"
     app.title = "Race runners".title()
-    app.sub_title = f"Browse details: {app.df.shape[0]} (Year: {options.results})"
+    app.sub_title = f"Browse details: {app.df.shape[0]} ({source})"
     app.run()
 
 
@@ -165,8 +329,36 @@ def run_enricher():
         "--raw-race-results-file",
         action="store",
         type=Path,
+        nargs="+",
         required=True,
-        help="Location of raw race results"
+        help="Location of raw race results, several files are enriched into one, in the given order"
+    )
+    parser.add_argument(
+        "--chunk-size",
+        action="store",
+        type=int,
+        default=DEFAULT_CHUNK_SIZE,
+        help=f"Number of race results enriched at once ({DEFAULT_CHUNK_SIZE})"
+    )
+    parser.add_argument(
+        "--workers",
+        action="store",
+        type=int,
+        default=None,
+        help="Worker processes, defaults to the number of CPUs"
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        default=False,
+        help="Only enrich new or changed records, the others come from the record cache"
+    )
+    parser.add_argument(
+        "--record-cache",
+        action="store",
+        type=Path,
+        default=RECORD_CACHE_FILE,
+        help=f"Enriched records cache for --incremental. Default: {RECORD_CACHE_FILE}"
     )
     parser.add_argument(
         "enriched_race_results_file",
@@ -175,13 +367,28 @@ def run_enricher():
         help="Destination of enriched race results"
     )
     options = parser.parse_args()
-    if options.enriched_race_results_file == options.raw_race_results_file:
+    destination = options.enriched_race_results_file.resolve()
+    if any(destination == raw_file.resolve() for raw_file in options.raw_race_results_file):
         raise ValueError("Raw race results cannot be the same as the enriched file!")
 
-    enriched_data = enrich_race_results(
-        race_results_file=options.raw_race_results_file,
-        location_lookup_file=options.location_lookup_file
+    summary = enrich_files(
+        race_results_files=options.raw_race_results_file,
+        location_lookup_file=options.location_lookup_file,
+        enriched_race_results_file=options.enriched_race_results_file,
+        chunk_size=options.chunk_size,
+        max_workers=options.workers,
+        record_cache=options.record_cache if options.incremental else None
+    )
+    logging.info(
+        f"Enriched {summary.records} race results into {options.enriched_race_results_file} "
+        f"({summary.cached} unchanged, from the record cache)"
     )
-    with open(options.enriched_race_results_file.as_posix(), 'w') as outfile:
-        for race_result in enriched_data:
-            print(json.dumps(race_result), file=outfile)
+    if summary.invalid:
+        logging.warning(
+            f"{len(summary.invalid)} runners with a value that is not a number, written as null: {summary.invalid}"
+        )
+    if summary.unresolved:
+        logging.warning(
+            f"{sum(summary.unresolved.values())} runners from {len(summary.unresolved)} unknown localities got the "
+            f"default country: {dict(summary.unresolved.most_common())}"
+        )
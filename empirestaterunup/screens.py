@@ -8,7 +8,13 @@ from textual.app import ComposeResult
 from textual.screen import ModalScreen
 from textual.widgets import Button, DataTable, MarkdownViewer
 
-from empirestaterunup.data import FIELD_NAMES_AND_POS, RaceFields
+from empirestaterunup.data import (
+    FIELD_NAMES_AND_POS,
+    TIME_FIELDS,
+    CountryIndex,
+    RaceFields,
+    format_duration,
+)
 
 
 class RunnerDetailScreen(ModalScreen):
@@ -26,14 +32,18 @@ class RunnerDetailScreen(ModalScreen):
             row: list[Any] | None = None,
             table: DataTable | None = None,
             debug: bool = True,
+            country_data: CountryIndex | None = None,
     ):
         """
         Constructor
+        Args:
+            country_data: Country index, country codes left on the results are shown with their name
         """
         super().__init__(name, ident, classes)
         self.row = row
         self.table = table
         self.debug = debug
+        self.country_data = country_data
 
     def compose(self) -> ComposeResult:
         """
@@ -44,13 +54,17 @@ class RunnerDetailScreen(ModalScreen):
         row_markdown = ""
         if self.table:
             col_map: dict[int, str] = {idx: val.label.plain for idx, val in zip(range(0, len(self.table.columns)), self.table.columns.values(), strict=False)}
+            time_columns = {idx for idx, key in enumerate(self.table.columns.keys()) if key.value in TIME_FIELDS}
+            country_idx = FIELD_NAMES_AND_POS[RaceFields.COUNTRY]
             if self.debug:
                 col_def = dict(self.table.columns.items())
                 self.log.info(f"Columns def: {col_def}")
                 self.log.info(f"Row: {self.row}")
                 self.log.info(f"Col Map: {col_map}")
             for idx, col_name in col_map.items():
-                value = self.row[idx]
+                value = format_duration(self.row[idx]) if idx in time_columns else self.row[idx]
+                if idx == country_idx and self.country_data is not None:
+                    value = self.country_data.code_to_name.get(value, value)
                 row_markdown += f"* **{col_name}**: {value}\n"
 
         yield MarkdownViewer(f"""# Full Course Race details
@@ -103,6 +117,8 @@ York', 'Massapequa', Timedelta('0 days 01:05:19'), Timedelta('0 days 00:07:52'),
             if self.debug:
                 self.log.info(f"Runners data: {self.runner_data}")
             for col_name, value in zip(self.runner_data[0], self.runner_data[1][0], strict=False):
+                if col_name in TIME_FIELDS:
+                    value = format_duration(value)
                 row_markdown += f"* **{col_name.title()}**: {value}\n"
 
         yield MarkdownViewer(f"""# Full Course Race details
@@ -1,17 +1,91 @@
 """
 Wrapper around CLI applications that use Textual, now they can also be run as web applications.
+textual-serve starts a new process for every browser session, so the results are parsed and analyzed once,
+before serving, into a shared cache directory. Sessions memory map that cache instead of loading the data again.
 """
+import logging
+import shlex
 from argparse import ArgumentParser
 from pathlib import Path
 
+from aiohttp import web
 from textual_serve.server import Server
 
+from empirestaterunup.analyze import get_snapshot
+from empirestaterunup.api import create_app
+from empirestaterunup.cache import CACHE_DIR
+from empirestaterunup.data import DEFAULT_YEAR, RACE_RESULTS_JSON_FULL_LEVEL, RaceStore
+
 APPLICATIONS = [
     "esru_numbers",
     "esru_outlier",
     "esru_browser"
 ]
 PORT = 8000
+SERVER_CACHE_DIR = CACHE_DIR.joinpath('server')
+SNAPSHOT_DIR_NAME = 'snapshots'
+
+
+def warm_up(cache_dir: Path = None) -> RaceStore:
+    """
+    Load the race store and the statistic snapshots of every year into the shared cache directory.
+    Args:
+        cache_dir: Cache shared by the sessions, defaults to SERVER_CACHE_DIR
+    """
+    def_cache_dir = SERVER_CACHE_DIR if cache_dir is None else cache_dir
+    store = RaceStore(cache_dir=def_cache_dir, compact=True)
+    for year in store.years:
+        get_snapshot(store.year(year), snapshot_dir=def_cache_dir.joinpath(SNAPSHOT_DIR_NAME))
+    return store
+
+
+def session_command(application: str, cache_dir: Path, year: int = None, results_file: Path = None) -> str:
+    """
+    Command run by textual-serve on each new session
+    Args:
+        application: One of APPLICATIONS
+        cache_dir: Cache shared by the sessions
+        year: Race year, the application default if missing
+        results_file: External results file, read (and followed) by the application instead of a race year
+    """
+    cmd = [application, "--cache-dir", str(cache_dir.resolve()), "--compact"]
+    if application == "esru_numbers":
+        cmd.extend(["--snapshot-dir", str(cache_dir.joinpath(SNAPSHOT_DIR_NAME).resolve())])
+    if results_file is not None:
+        cmd.extend(["--follow", str(results_file.resolve())])
+    elif year is not None:
+        cmd.append(str(year))
+    return shlex.join(cmd)
+
+
+class ResultsServer(Server):
+    """
+    textual-serve server that can also run the JSON API (see api.py) on its own port, on the same event loop
+    """
+
+    def __init__(self, *args, api: web.Application = None, api_port: int = None, **kwargs):
+        """
+        Args:
+            api: JSON API application, nothing extra is served if missing
+            api_port: Port for the API
+        """
+        super().__init__(*args, **kwargs)
+        self.api = api
+        self.api_port = api_port
+        self.api_runner: web.AppRunner | None = None
+
+    async def on_startup(self, app: web.Application) -> None:
+        await super().on_startup(app)
+        if self.api is not None:
+            self.api_runner = web.AppRunner(self.api)
+            await self.api_runner.setup()
+            await web.TCPSite(self.api_runner, self.host, self.api_port).start()
+            self.console.print(f"Serving the results API on http://{self.host}:{self.api_port}/api/years")
+
+    async def on_shutdown(self, app: web.Application) -> None:
+        if self.api_runner is not None:
+            await self.api_runner.cleanup()
+        await super().on_shutdown(app)
 
 
 def main():
@@ -29,15 +103,38 @@ def main():
     parser.add_argument(
         "--port",
         action="store",
+        type=int,
         default=PORT,
         help=f"Default port ({PORT})"
     )
+    parser.add_argument(
+        "--api-port",
+        action="store",
+        type=int,
+        default=None,
+        help="Also serve the read only JSON API on this port"
+    )
+    parser.add_argument(
+        "--cache-dir",
+        action="store",
+        type=Path,
+        default=SERVER_CACHE_DIR,
+        help=f"Results cache shared by all the sessions. Default: {SERVER_CACHE_DIR}"
+    )
     parser.add_argument(
         "--debug",
         action="store_true",
         default=False,
         help="Enable debug mode"
     )
+    parser.add_argument(
+        "--year",
+        action="store",
+        type=int,
+        choices=list(RACE_RESULTS_JSON_FULL_LEVEL.keys()),
+        default=None,
+        help=f"Race year shown by the sessions. Default: {DEFAULT_YEAR}"
+    )
     parser.add_argument(
         "results",
         action="store",
@@ -46,12 +143,24 @@ def main():
         help="Race results."
     )
     options = parser.parse_args()
-    if options.results:
-        cmd = f"{options.application} {''.join([str(result.resolve()) for result in options.results])}"
-    else:
-        cmd = f"{options.application}"
-    server = Server(
-        command=cmd,
-        port=PORT
+    if len(options.results) > 1:
+        parser.error("Only one results file can be served")
+    if options.results and options.year is not None:
+        parser.error("Use either a results file or --year")
+    logging.info(f"Warming up the results cache on {options.cache_dir}")
+    store = warm_up(options.cache_dir)
+    api = None
+    if options.api_port is not None:
+        api = create_app(store=store, snapshot_dir=options.cache_dir.joinpath(SNAPSHOT_DIR_NAME))
+    server = ResultsServer(
+        command=session_command(
+            options.application,
+            options.cache_dir,
+            year=options.year,
+            results_file=options.results[0] if options.results else None
+        ),
+        port=options.port,
+        api=api,
+        api_port=options.api_port
     )
     server.serve(options.debug)
@@ -0,0 +1,369 @@
+"""
+Custom widgets shared by the applications.
+author: Jose Vicente Nunez <kodegeek.com@protonmail.com>
+"""
+from collections.abc import Callable, Iterator, Mapping
+from typing import Any
+
+import numpy as np
+import pandas
+from pandas import DataFrame
+from rich.segment import Segment
+from rich.style import Style
+from rich.text import Text
+from textual import events
+from textual._two_way_dict import TwoWayDict
+from textual.binding import Binding
+from textual.geometry import Size
+from textual.message import Message
+from textual.reactive import reactive
+from textual.scroll_view import ScrollView
+from textual.strip import Strip
+from textual.widgets import DataTable
+from textual.widgets.data_table import Column, ColumnKey, RowKey
+
+from empirestaterunup.data import FIELD_NAMES, TIME_FIELDS, format_duration
+
+MAX_COLUMN_WIDTH = 40
+WIDTH_SAMPLE_SIZE = 1_000
+
+
+class RunnerTable(DataTable):
+    """
+    DataTable that keeps native values (timedelta, integer milliseconds) on its cells and formats them only
+    when a visible row is rendered. Sorting is delegated to the DataFrame, see sort_by_frame.
+    """
+
+    def __init__(
+            self,
+            *args: Any,
+            formatters: dict[str, Callable[[Any], str]] = None,
+            **kwargs: Any
+    ):
+        """
+        Args:
+            formatters: Cell formatter per column key, defaults to format_duration for the race times
+        """
+        super().__init__(*args, **kwargs)
+        self.formatters = {field: format_duration for field in TIME_FIELDS} if formatters is None else formatters
+
+    def _compute_row_renderables(self, row_index: int):
+        """
+        Format the cells of the columns with a formatter, everything else uses the DataTable defaults
+        """
+        row_renderables = super()._compute_row_renderables(row_index)
+        if row_index == -1 or not self.formatters:
+            return row_renderables
+        row = self.get_row_at(row_index)
+        cells = list(row_renderables.cells)
+        for idx, column in enumerate(self.ordered_columns):
+            formatter = self.formatters.get(column.key.value)
+            if formatter is not None and idx < len(row):
+                cells[idx] = Text(formatter(row[idx]), no_wrap=True, end="")
+        return row_renderables._replace(cells=cells)
+
+    def sort_by_frame(self, df: DataFrame, column: str, reverse: bool = False) -> None:
+        """
+        Sort the rows using a vectorized sort on the DataFrame, the row order of the table is rebuilt from the
+        sorted index, no cell is read or compared.
+        Args:
+            df: DataFrame with the same rows as the table, each row keyed by its DataFrame index (as string)
+            column: Column to sort by, it can also be the name of the DataFrame index
+            reverse: Descending order
+        Raises:
+            ValueError: The DataFrame and the table do not have the same number of rows
+        """
+        if df.shape[0] != self.row_count:
+            raise ValueError(f"Cannot sort {self.row_count} rows with a DataFrame of {df.shape[0]} rows")
+        values = df.index.to_series() if column == df.index.name else df[column]
+        ordered = values.sort_values(ascending=not reverse, kind='stable')
+        self._row_locations = TwoWayDict(
+            {RowKey(key): position for position, key in enumerate(ordered.index.astype(str))}
+        )
+        self._update_count += 1
+        self.refresh()
+
+
+class FrameRows(Mapping):
+    """
+    Read only view of the FrameTable rows, keyed by the DataFrame index (as string) like DataTable.rows.
+    Iterates in display order.
+    """
+
+    def __init__(self, table: 'FrameTable'):
+        self.table = table
+
+    def __getitem__(self, row_key: str | RowKey) -> int:
+        key = row_key.value if isinstance(row_key, RowKey) else row_key
+        index = self.table.df.index
+        if pandas.api.types.is_integer_dtype(index.dtype):
+            if not key.lstrip('-').isdigit() or str(int(key)) != key:
+                raise KeyError(row_key)
+            key = int(key)
+        return index.get_loc(key)
+
+    def __iter__(self) -> Iterator[str]:
+        index = self.table.df.index
+        return (str(index[pos]) for pos in self.table.order)
+
+    def __len__(self) -> int:
+        return len(self.table.order)
+
+
+class FrameTable(ScrollView, can_focus=True):
+    """
+    Virtual table, cells are read from the DataFrame only for the lines on screen, so no row is copied into the widget.
+    Sorting runs on the DataFrame and is kept as a permutation of the row positions.
+    It mimics the parts of the DataTable API used by the applications (columns, rows, get_row, sort_by_frame and
+    the header and row selected messages).
+    """
+
+    BINDINGS = [
+        Binding("up", "cursor_up", "Cursor up", show=False),
+        Binding("down", "cursor_down", "Cursor down", show=False),
+        Binding("pageup", "page_up", "Page up", show=False),
+        Binding("pagedown", "page_down", "Page down", show=False),
+        Binding("home", "scroll_home", "Top", show=False),
+        Binding("end", "scroll_end", "Bottom", show=False),
+        Binding("enter", "select_cursor", "Select", show=False),
+    ]
+    COMPONENT_CLASSES = {
+        "frame-table--header",
+        "frame-table--cursor",
+        "frame-table--even-row",
+    }
+    DEFAULT_CSS = """
+    FrameTable {
+        background: $surface;
+    }
+    FrameTable > .frame-table--header {
+        text-style: bold;
+        background: $panel;
+        color: $foreground;
+    }
+    FrameTable > .frame-table--cursor {
+        background: $block-cursor-background;
+        color: $block-cursor-foreground;
+        text-style: bold;
+    }
+    FrameTable > .frame-table--even-row {
+        background: $surface-darken-1 40%;
+    }
+    """
+    cursor_row: reactive[int] = reactive(0)
+
+    class HeaderSelected(Message):
+        """
+        A column header was clicked
+        """
+
+        def __init__(self, data_table: 'FrameTable', column_key: ColumnKey, column_index: int):
+            super().__init__()
+            self.data_table = data_table
+            self.column_key = column_key
+            self.column_index = column_index
+
+        @property
+        def control(self) -> 'FrameTable':
+            return self.data_table
+
+    class RowSelected(Message):
+        """
+        A row was selected, with the enter key or a click on the cursor row
+        """
+
+        def __init__(self, data_table: 'FrameTable', cursor_row: int, row_key: RowKey):
+            super().__init__()
+            self.data_table = data_table
+            self.cursor_row = cursor_row
+            self.row_key = row_key
+
+        @property
+        def control(self) -> 'FrameTable':
+            return self.data_table
+
+    def __init__(
+            self,
+            *args: Any,
+            fields: tuple[str, ...] = tuple(FIELD_NAMES),
+            formatters: dict[str, Callable[[Any], str]] = None,
+            **kwargs: Any
+    ):
+        """
+        Args:
+            fields: Columns to show, the DataFrame index can be one of them
+            formatters: Cell formatter per column, defaults to format_duration for the race times
+        """
+        super().__init__(*args, **kwargs)
+        self.fields = fields
+        self.formatters = {field: format_duration for field in TIME_FIELDS} if formatters is None else formatters
+        self.zebra_stripes = False
+        self.cursor_type = 'row'
+        self.columns: dict[ColumnKey, Column] = {}
+        self.rows = FrameRows(self)
+        self.clear()
+
+    def clear(self, columns: bool = False) -> 'FrameTable':
+        """
+        Forget the DataFrame
+        """
+        self.set_frame(DataFrame({field: [] for field in self.fields}))
+        return self
+
+    def set_frame(self, df: DataFrame) -> None:
+        """
+        Show a DataFrame, in its original order
+        """
+        self.df = df
+        self.values = [
+            df.index.array if field == df.index.name else df[field].array
+            for field in self.fields
+        ]
+        self.order = np.arange(df.shape[0])
+        self.columns = {}
+        for field, values in zip(self.fields, self.values, strict=True):
+            width = min(max(len(field), self._content_width(field, values)), MAX_COLUMN_WIDTH)
+            self.columns[ColumnKey(field)] = Column(
+                key=ColumnKey(field), label=Text(field.title()), width=width, content_width=width
+            )
+        self.virtual_size = Size(sum(column.width + 1 for column in self.columns.values()), len(self.order) + 1)
+        self.cursor_row = min(self.cursor_row, max(len(self.order) - 1, 0))
+        self.refresh()
+
+    def _content_width(self, field: str, values: Any) -> int:
+        """
+        Widest cell of a column, without formatting every value: numbers are measured by their extremes,
+        categories by their labels and anything else on an evenly spaced sample of WIDTH_SAMPLE_SIZE values
+        """
+        if len(values) == 0:
+            return 0
+        if field in self.formatters:
+            return 8
+        series = pandas.Series(values, copy=False)
+        if isinstance(series.dtype, pandas.CategoricalDtype):
+            series = pandas.Series(series.cat.categories)
+        elif pandas.api.types.is_numeric_dtype(series):
+            return max(len(str(series.min())), len(str(series.max())))
+        if len(series) > WIDTH_SAMPLE_SIZE:
+            series = series.iloc[np.linspace(0, len(series) - 1, WIDTH_SAMPLE_SIZE, dtype=int)]
+        return int(series.astype(str).str.len().max())
+
+    @property
+    def row_count(self) -> int:
+        return len(self.order)
+
+    def _cell(self, column: int, pos: int) -> str:
+        value = self.values[column][pos]
+        formatter = self.formatters.get(self.fields[column])
+        return formatter(value) if formatter is not None else str(value)
+
+    def get_row_at(self, row_index: int) -> list[Any]:
+        """
+        Values of the row at a display position
+        """
+        pos = self.order[row_index]
+        return [values[pos] for values in self.values]
+
+    def get_row(self, row_key: str | RowKey) -> list[Any]:
+        """
+        Values of the row with the given key (the DataFrame index, as string), found through the DataFrame index
+        """
+        pos = self.rows[row_key]
+        return [values[pos] for values in self.values]
+
+    def sort_by_frame(self, df: DataFrame, column: str, reverse: bool = False) -> None:
+        """
+        Sort using the DataFrame, the rows are displayed following the resulting permutation.
+        Same signature as RunnerTable.sort_by_frame, df must be the DataFrame on display.
+        """
+        values = df.index.to_series() if column == df.index.name else df[column]
+        ordered = values.reset_index(drop=True).sort_values(ascending=not reverse, kind='stable')
+        self.order = ordered.index.to_numpy()
+        self.refresh()
+
+    def render_line(self, y: int) -> Strip:
+        """
+        Render one line of the viewport, the header stays on the first line
+        """
+        scroll_x, scroll_y = self.scroll_offset
+        width = self.size.width
+        if y == 0:
+            cells = [column.label.plain.ljust(column.width)[:column.width] for column in self.columns.values()]
+            style = self.get_component_rich_style("frame-table--header")
+        else:
+            row = scroll_y + y - 1
+            if row >= len(self.order):
+                return Strip.blank(width, self.rich_style)
+            pos = self.order[row]
+            cells = [
+                self._cell(idx, pos).ljust(column.width)[:column.width]
+                for idx, column in enumerate(self.columns.values())
+            ]
+            style = self.rich_style
+            if self.zebra_stripes and row % 2:
+                style += self.get_component_rich_style("frame-table--even-row")
+            if row == self.cursor_row:
+                style += self.get_component_rich_style("frame-table--cursor")
+        line = ' '.join(cells) + ' '
+        return Strip([Segment(line, style)]).crop_extend(scroll_x, scroll_x + width, Style())
+
+    def watch_cursor_row(self, previous: int, current: int) -> None:
+        """
+        Keep the cursor on screen
+        """
+        visible_rows = max(self.scrollable_content_region.height - 1, 1)
+        if current < self.scroll_offset.y:
+            self.scroll_to(y=current, animate=False)
+        elif current >= self.scroll_offset.y + visible_rows:
+            self.scroll_to(y=current - visible_rows + 1, animate=False)
+        self.refresh()
+
+    def _move_cursor(self, rows: int) -> None:
+        if self.order.size:
+            self.cursor_row = min(max(self.cursor_row + rows, 0), len(self.order) - 1)
+
+    def action_cursor_up(self) -> None:
+        self._move_cursor(-1)
+
+    def action_cursor_down(self) -> None:
+        self._move_cursor(1)
+
+    def action_page_up(self) -> None:
+        self._move_cursor(-max(self.scrollable_content_region.height - 1, 1))
+
+    def action_page_down(self) -> None:
+        self._move_cursor(max(self.scrollable_content_region.height - 1, 1))
+
+    def action_scroll_home(self) -> None:
+        self._move_cursor(-len(self.order))
+
+    def action_scroll_end(self) -> None:
+        self._move_cursor(len(self.order))
+
+    def action_select_cursor(self) -> None:
+        if self.order.size:
+            row_key = RowKey(str(self.df.index[self.order[self.cursor_row]]))
+            self.post_message(self.RowSelected(self, self.cursor_row, row_key))
+
+    def on_click(self, event: events.Click) -> None:
+        """
+        Clicks on the header select a column, clicks on a row move the cursor (or select the cursor row)
+        """
+        offset = event.get_content_offset(self)
+        if offset is None:
+            return
+        if offset.y == 0:
+            x = offset.x + self.scroll_offset.x
+            for idx, column in enumerate(self.columns.values()):
+                if x < column.width + 1:
+                    self.post_message(self.HeaderSelected(self, column.key, idx))
+                    return
+                x -= column.width + 1
+            return
+        row = self.scroll_offset.y + offset.y - 1
+        if row >= len(self.order):
+            return
+        if row == self.cursor_row:
+            self.action_select_cursor()
+        else:
+            self.cursor_row = row
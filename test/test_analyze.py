@@ -1,22 +1,42 @@
 """
 Multiple tests for data analysis
 """
+import math
+import shutil
+import tempfile
 import unittest
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
 
+import pandas
 from pandas import DataFrame
 
 from empirestaterunup.analyze import (
+    _SNAPSHOTS,
+    FASTEST_RANK,
+    MAX_SNAPSHOTS,
     SUMMARY_METRICS,
+    AnalysisSnapshot,
+    OutlierGroups,
+    OutlierMethod,
+    StreamingOutlierDetector,
     age_bins,
     count_by_age,
     count_by_gender,
+    fastest_by,
     get_5_number,
     get_country_counts,
     get_outliers,
+    get_snapshot,
     get_zscore,
+    summary_changed,
     time_bins,
 )
-from empirestaterunup.data import RACE_RESULTS_JSON_FULL_LEVEL, load_json_data
+from empirestaterunup.data import (
+    RACE_RESULTS_JSON_FULL_LEVEL,
+    RaceFields,
+    load_json_data,
+)
 
 
 class AnalyzeTestCase(unittest.TestCase):
@@ -31,7 +51,7 @@ class AnalyzeTestCase(unittest.TestCase):
         Refresh data setup, class level
         """
         for _, data_file in RACE_RESULTS_JSON_FULL_LEVEL.items():
-            AnalyzeTestCase.df_list.append(load_json_data(data_file=data_file))
+            AnalyzeTestCase.df_list.append(load_json_data(data_file=data_file, use_cache=False))
 
     def test_get_5_number(self):
         """
@@ -77,6 +97,65 @@ class AnalyzeTestCase(unittest.TestCase):
             for bib, value in outliers.items():
                 print(f"{column} {bib}: {value}")
 
+    def test_get_outliers_methods(self):
+        """
+        Robust and grouped outlier methods
+        """
+        df = self.df_list[0]
+        time_column = RaceFields.TIME.value
+        zscore = get_outliers(df=df, column=time_column)
+        self.assertListEqual(get_outliers(df=df, column=time_column, std_threshold=3).index.tolist(), zscore.index.tolist())
+        for method in OutlierMethod:
+            for group_by in [None, *OutlierGroups]:
+                outliers = get_outliers(df=df, column=time_column, method=method, group_by=group_by)
+                self.assertLess(0, outliers.shape[0])
+                self.assertTrue(outliers.index.isin(df.index).all())
+        # Fences are wider than the data, nothing to flag
+        self.assertEqual(0, get_outliers(df=df, column=time_column, method=OutlierMethod.IQR, std_threshold=100).shape[0])
+        # Tukey fences are less strict than 3 standard deviations
+        iqr = get_outliers(df=df, column=time_column, method=OutlierMethod.IQR)
+        self.assertTrue(zscore.index.isin(iqr.index).all())
+
+    def test_streaming_outlier_detector(self):
+        """
+        Running moments match the batch ones, and outliers are flagged as they arrive
+        """
+        df = self.df_list[0]
+        detector = StreamingOutlierDetector(min_samples=10)
+        for chunk_start in range(0, df.shape[0], 50):
+            detector.update_frame(df.iloc[chunk_start:chunk_start + 50], RaceFields.AGE.value)
+        ages = df[RaceFields.AGE.value]
+        self.assertAlmostEqual(ages.mean(), detector.mean())
+        self.assertAlmostEqual(ages.std(ddof=0), detector.std())
+        self.assertFalse(detector.update(ages.mean()))
+        self.assertTrue(detector.update(ages.mean() + 10 * ages.std(ddof=0)))
+        detector = StreamingOutlierDetector(min_samples=10)
+        outliers = detector.update_frame(df, RaceFields.TIME.value, group_by=RaceFields.GENDER.value)
+        self.assertLess(0, outliers.shape[0])
+        self.assertSetEqual(set(df[RaceFields.GENDER.value].unique()), set(detector.moments.keys()))
+
+        # Corrected results take back the previous value
+        detector = StreamingOutlierDetector(min_samples=10)
+        detector.update_frame(df, RaceFields.AGE.value)
+        detector.remove_frame(df.iloc[:100], RaceFields.AGE.value)
+        self.assertAlmostEqual(ages.iloc[100:].mean(), detector.mean())
+        self.assertAlmostEqual(ages.iloc[100:].std(ddof=0), detector.std())
+        detector.remove_frame(df.iloc[100:], RaceFields.AGE.value)
+        self.assertDictEqual({}, detector.moments)
+
+    def test_summary_changed(self):
+        """
+        Only new runners or corrected summary metrics make the summary stale
+        """
+        df = self.df_list[0]
+        self.assertTrue(summary_changed(df.iloc[:10], df.iloc[:0]))
+        self.assertFalse(summary_changed(df.iloc[:10], df.iloc[:10]))
+        corrected = df.iloc[:10].copy()
+        corrected[RaceFields.CITY.value] = 'Gotham'
+        self.assertFalse(summary_changed(corrected, df.iloc[:10]))
+        corrected[RaceFields.AGE.value] += 1
+        self.assertTrue(summary_changed(corrected, df.iloc[:10]))
+
     def test_age_bins(self):
         """
         make sure age bins are accurate
@@ -115,6 +194,64 @@ class AnalyzeTestCase(unittest.TestCase):
         self.assertIsNotNone(max_countries)
         self.assertEqual(14, max_countries.shape[0])
 
+    def test_fastest_by(self):
+        """
+        Top N runners per category, with and without ties
+        """
+        df = DataFrame(
+            {
+                RaceFields.NAME.value: ['A', 'B', 'C', 'D', 'E', 'F'],
+                RaceFields.GENDER.value: ['M', 'F', 'M', 'F', 'M', 'M'],
+                RaceFields.TIME.value: pandas.to_timedelta([600, 700, 500, 650, 600, 900], unit='seconds')
+            },
+            index=pandas.Index([1, 2, 3, 4, 5, 6], name=RaceFields.BIB.value)
+        )
+        fastest = fastest_by(df, RaceFields.GENDER.value)
+        self.assertListEqual(['C', 'D'], fastest[RaceFields.NAME.value].tolist())
+        fastest = fastest_by(df, RaceFields.GENDER.value, top_n=2)
+        self.assertListEqual(['C', 'A', 'D', 'B'], fastest[RaceFields.NAME.value].tolist())
+        self.assertListEqual([1, 2, 1, 2], fastest[FASTEST_RANK].tolist())
+        fastest = fastest_by(df, RaceFields.GENDER.value, top_n=2, keep_ties=True)
+        self.assertListEqual(['C', 'A', 'E', 'D', 'B'], fastest[RaceFields.NAME.value].tolist())
+
+        for data in self.df_list:
+            fastest = fastest_by(data, RaceFields.COUNTRY.value, top_n=3)
+            counts = fastest[RaceFields.COUNTRY.value].value_counts()
+            self.assertEqual(data[RaceFields.COUNTRY.value].nunique(), counts.shape[0])
+            self.assertGreaterEqual(3, counts.max())
+
+    def test_analysis_snapshot(self):
+        """
+        Snapshots match the individual statistics, and are reused from disk
+        """
+        snapshot_dir = Path(tempfile.mkdtemp())
+        try:
+            df = self.df_list[0]
+            snapshot = get_snapshot(df, snapshot_dir=snapshot_dir)
+            self.assertEqual(df.shape[0], snapshot.runners)
+            self.assertEqual(df.shape[0], sum(count for _, count in snapshot.count_by_gender))
+            self.assertEqual(df.shape[0], sum(count for _, count in snapshot.time_buckets))
+            self.assertEqual(get_5_number(RaceFields.AGE.value, df)['mean'], snapshot.summary[RaceFields.AGE.value]['mean'])
+            self.assertIs(snapshot, get_snapshot(df, snapshot_dir=snapshot_dir))
+            single = get_snapshot(df.head(1), use_disk=False)
+            self.assertTrue(math.isnan(single.summary[RaceFields.TIME.value]['std']))
+            snapshot_file = snapshot_dir.joinpath(f"{snapshot.fingerprint}.json")
+            self.assertEqual(snapshot, AnalysisSnapshot.load(snapshot_file))
+            self.assertNotEqual(snapshot.fingerprint, get_snapshot(df.head(10), use_disk=False).fingerprint)
+            # Only the most recent snapshots stay in memory
+            for rows in range(20, 20 + MAX_SNAPSHOTS):
+                get_snapshot(df.head(rows), use_disk=False)
+            self.assertEqual(MAX_SNAPSHOTS, len(_SNAPSHOTS))
+            self.assertNotIn(snapshot.fingerprint, _SNAPSHOTS)
+            # Worker threads share the cache
+            frames = [df.head(rows) for rows in range(40, 40 + 2 * MAX_SNAPSHOTS)]
+            with ThreadPoolExecutor(max_workers=8) as executor:
+                snapshots = list(executor.map(lambda frame: get_snapshot(frame, use_disk=False), frames * 2))
+            self.assertListEqual([frame.shape[0] for frame in frames * 2], [snapshot.runners for snapshot in snapshots])
+            self.assertEqual(MAX_SNAPSHOTS, len(_SNAPSHOTS))
+        finally:
+            shutil.rmtree(snapshot_dir, ignore_errors=True)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,149 @@
+"""
+Unit tests for the JSON API
+"""
+import json
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+
+from aiohttp import web
+from aiohttp.test_utils import AioHTTPTestCase, TestClient, TestServer
+
+from empirestaterunup.analyze import get_snapshot
+from empirestaterunup.api import create_app
+from empirestaterunup.data import RACE_RESULTS_JSON_FULL_LEVEL, RaceFields, RaceStore
+
+CACHE_DIR = Path(tempfile.mkdtemp())
+STORE = RaceStore(cache_dir=CACHE_DIR)
+
+
+def tearDownModule() -> None:
+    shutil.rmtree(CACHE_DIR, ignore_errors=True)
+
+
+class ApiTestCase(AioHTTPTestCase):
+    """
+    Unit tests for the JSON API
+    """
+
+    async def get_application(self) -> web.Application:
+        self.snapshot_dir = Path(tempfile.mkdtemp())
+        return create_app(store=STORE, snapshot_dir=self.snapshot_dir)
+
+    async def asyncTearDown(self) -> None:
+        await super().asyncTearDown()
+        shutil.rmtree(self.snapshot_dir, ignore_errors=True)
+
+    async def test_statistics(self):
+        """
+        Same numbers as the snapshot used by the applications
+        """
+        snapshot = get_snapshot(STORE.year(2024), use_disk=False)
+        async with self.client.get("/api/2024/summary") as resp:
+            self.assertEqual(200, resp.status)
+            data = await resp.json()
+        self.assertEqual(snapshot.runners, data['runners'])
+        self.assertDictEqual(snapshot.summary, data['summary'])
+        async with self.client.get("/api/2024/buckets") as resp:
+            data = await resp.json()
+        self.assertListEqual([list(row) for row in snapshot.age_buckets], data['age'])
+        async with self.client.get("/api/2024/countries") as resp:
+            data = await resp.json()
+        self.assertEqual(snapshot.country_counts[0][0], data['countries'][0][0])
+        async with self.client.get("/api/years") as resp:
+            data = await resp.json()
+        self.assertEqual(snapshot.fingerprint, data['years']['2024'])
+
+    async def test_etag(self):
+        """
+        Responses carry an ETag, a matching If-None-Match gets a 304 and different queries get different tags
+        """
+        async with self.client.get("/api/2025/outliers", params={'method': 'mad'}) as resp:
+            self.assertEqual(200, resp.status)
+            etag = resp.headers['ETag']
+            data = await resp.json()
+        self.assertEqual('mad', data['method'])
+        self.assertTrue(data['outliers']['full course'])
+        async with self.client.get("/api/2025/outliers", params={'method': 'mad'}, headers={'If-None-Match': etag}) as resp:
+            self.assertEqual(304, resp.status)
+        async with self.client.get("/api/2025/outliers", params={'method': 'iqr'}, headers={'If-None-Match': etag}) as resp:
+            self.assertEqual(200, resp.status)
+            self.assertNotEqual(etag, resp.headers['ETag'])
+        async with self.client.get("/api/2025/outliers", params={'method': 'bad'}) as resp:
+            self.assertEqual(400, resp.status)
+
+    async def test_if_none_match(self):
+        """
+        Weak tags, lists of tags and '*' are matched like the tag alone
+        """
+        async with self.client.get("/api/2024/countries") as resp:
+            etag = resp.headers['ETag']
+        for header in [etag, f"W/{etag}", f'"other", W/{etag}', '*']:
+            async with self.client.get("/api/2024/countries", headers={'If-None-Match': header}) as resp:
+                self.assertEqual(304, resp.status, header)
+        async with self.client.get("/api/2024/countries", headers={'If-None-Match': '"other", W/"another"'}) as resp:
+            self.assertEqual(200, resp.status)
+
+    async def test_missing_values(self):
+        """
+        Missing values are null, the responses are valid JSON
+        """
+        work_dir = Path(tempfile.mkdtemp())
+        try:
+            # A single runner has no standard deviation
+            results = work_dir.joinpath("results-2025.jsonl")
+            with open(RACE_RESULTS_JSON_FULL_LEVEL[2025], encoding='utf-8') as f:
+                results.write_text(f.readline(), encoding='utf-8')
+            store = RaceStore(results={2025: results}, cache_dir=work_dir)
+            async with (
+                TestClient(TestServer(create_app(store=store, snapshot_dir=work_dir))) as client,
+                client.get("/api/2025/summary") as resp
+            ):
+                self.assertEqual(200, resp.status)
+                data = json.loads(await resp.text(), parse_constant=self.fail)
+            self.assertIsNone(data['summary'][RaceFields.AGE.value]['std'])
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    async def test_duplicated_bib(self):
+        """
+        A BIB with more than one result is a conflict, not a server error
+        """
+        work_dir = Path(tempfile.mkdtemp())
+        try:
+            results = work_dir.joinpath("results-2025.jsonl")
+            with open(RACE_RESULTS_JSON_FULL_LEVEL[2025], encoding='utf-8') as f:
+                line = f.readline()
+            results.write_text(line * 2, encoding='utf-8')
+            bib = json.loads(line)[RaceFields.BIB.value]
+            store = RaceStore(results={2025: results}, cache_dir=work_dir)
+            async with (
+                TestClient(TestServer(create_app(store=store, snapshot_dir=work_dir))) as client,
+                client.get(f"/api/2025/runners/{bib}") as resp
+            ):
+                self.assertEqual(409, resp.status)
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    async def test_fastest_and_runner(self):
+        """
+        Fastest runners per category and runner lookup by BIB
+        """
+        async with self.client.get("/api/2023/fastest", params={'category': 'gender'}) as resp:
+            data = await resp.json()
+        self.assertListEqual(['year', 'gender'], list(data.keys()))
+        fastest = min(data['gender'].values(), key=lambda runner: runner['time'])
+        bib = STORE.year(2023).sort_values('full course').index[0]
+        async with self.client.get(f"/api/2023/runners/{bib}") as resp:
+            runner = await resp.json()
+        self.assertEqual(fastest['name'], runner['name'])
+        self.assertEqual(fastest['time'], runner['full course'])
+        async with self.client.get("/api/2023/runners/999999") as resp:
+            self.assertEqual(404, resp.status)
+        async with self.client.get("/api/1931/summary") as resp:
+            self.assertEqual(404, resp.status)
+
+
+if __name__ == '__main__':
+    unittest.main()
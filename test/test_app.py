@@ -1,23 +1,50 @@
 """
 Unit tests for application
 """
+import shutil
+import tempfile
 import unittest
+from pathlib import Path
 
+from pandas import Timedelta
 from textual.widgets import DataTable, MarkdownViewer
 
-from empirestaterunup.apps import BrowserApp
-from empirestaterunup.data import RACE_RESULTS_JSON_FULL_LEVEL, load_json_data
+from empirestaterunup.apps import BrowserApp, FiveNumberApp, OutlierApp
+from empirestaterunup.data import (
+    COUNTRY_COLUMNS,
+    FIELD_NAMES_AND_POS,
+    RACE_RESULTS_JSON_FULL_LEVEL,
+    CountryIndex,
+    RaceFields,
+    RaceStore,
+    ResultsTail,
+    load_json_data,
+)
+from empirestaterunup.providers import (
+    MAX_DISCOVERY_HITS,
+    PALETTE_FIELDS,
+    BrowserAppCommand,
+)
+from empirestaterunup.screens import OutlierDetailScreen
+from empirestaterunup.widgets import FrameTable
 
 
 class AppTestCase(unittest.IsolatedAsyncioTestCase):
     """
     Unit tests for application
     """
+
+    def setUp(self) -> None:
+        self.cache_dir = Path(tempfile.mkdtemp())
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
     async def test_browser_app(self):
         """
         Simulate running browser app, with some commands
         """
-        df = load_json_data(data_file=RACE_RESULTS_JSON_FULL_LEVEL[2023])
+        df = load_json_data(data_file=RACE_RESULTS_JSON_FULL_LEVEL[2023], cache_dir=self.cache_dir)
         app = BrowserApp(df=df)
         self.assertIsNotNone(app)
         async with app.run_test() as pilot:
@@ -39,6 +66,260 @@ class AppTestCase(unittest.IsolatedAsyncioTestCase):
             # Quit the app by pressing q
             await pilot.press("q")
 
+    async def test_browser_app_discover(self):
+        """
+        The palette opens with the fastest runners only
+        """
+        df = load_json_data(data_file=RACE_RESULTS_JSON_FULL_LEVEL[2023], cache_dir=self.cache_dir)
+        app = BrowserApp(df=df)
+        async with app.run_test() as pilot:
+            await app.workers.wait_for_complete()
+            provider = BrowserAppCommand(app.screen)
+            await provider.startup()
+            hits = [hit async for hit in provider.discover()]
+            self.assertEqual(MAX_DISCOVERY_HITS * len(PALETTE_FIELDS), len(hits))
+            fastest = df.loc[df[RaceFields.TIME.value].idxmin(), RaceFields.NAME.value]
+            self.assertIn(fastest, hits[0].help)
+            await pilot.press("q")
+
+    async def test_browser_app_country(self):
+        """
+        Runner details show country codes with the names from the given country index
+        """
+        df = load_json_data(data_file=RACE_RESULTS_JSON_FULL_LEVEL[2023], cache_dir=self.cache_dir)
+        df[RaceFields.COUNTRY.value] = 'XX'
+        country_data = CountryIndex({
+            "Atlantis": {column: '' for column in COUNTRY_COLUMNS[1:]} | {"alpha-2": "XX", "alpha-3": "XXX", "country-code": "999"}
+        })
+        app = BrowserApp(df=df, country_data=country_data)
+        async with app.run_test() as pilot:
+            await app.workers.wait_for_complete()
+            await pilot.pause()
+            table = app.screen.query(DataTable).first()
+            table.focus()
+            await pilot.press("enter")
+            await pilot.pause()
+            self.assertIn("**Country**: Atlantis", app.screen.query(MarkdownViewer).first().document.source)
+            await pilot.click("#close")
+            await pilot.press("q")
+
+    async def test_browser_app_sort(self):
+        """
+        Cells keep native race times, sorting is done on the DataFrame
+        """
+        df = load_json_data(data_file=RACE_RESULTS_JSON_FULL_LEVEL[2024], cache_dir=self.cache_dir)
+        app = BrowserApp(df=df)
+        app.ROW_BATCH_SIZE = 100
+        async with app.run_test() as pilot:
+            await app.workers.wait_for_complete()
+            await pilot.pause()
+            table = app.screen.query(DataTable).first()
+            self.assertEqual(df.shape[0], table.row_count)
+            time_idx = FIELD_NAMES_AND_POS[RaceFields.TIME]
+            age_idx = FIELD_NAMES_AND_POS[RaceFields.AGE]
+            first_row = table.get_row_at(0)
+            self.assertIsInstance(first_row[time_idx], Timedelta)
+            self.assertEqual(df[RaceFields.TIME.value].min(), first_row[time_idx])
+            table.sort_by_frame(df, RaceFields.AGE.value, reverse=True)
+            self.assertEqual(df[RaceFields.AGE.value].max(), table.get_row_at(0)[age_idx])
+            expected = df[RaceFields.AGE.value].sort_values(ascending=False, kind='stable').index.astype(str)
+            self.assertListEqual(list(expected), [row.key.value for row in table.ordered_rows])
+            table.sort_by_frame(df, RaceFields.BIB.value)
+            self.assertEqual(df.index.min(), table.get_row_at(0)[FIELD_NAMES_AND_POS[RaceFields.BIB]])
+            with self.assertRaises(ValueError):
+                table.sort_by_frame(df.iloc[1:], RaceFields.AGE.value)
+            await pilot.press("q")
+
+    async def test_browser_app_next_year(self):
+        """
+        Switch race years without reloading the data
+        """
+        store = RaceStore(cache_dir=self.cache_dir)
+        app = BrowserApp(store=store, year=2023)
+        async with app.run_test() as pilot:
+            await app.workers.wait_for_complete()
+            table = app.screen.query(DataTable).first()
+            self.assertEqual(store.year(2023).shape[0], table.row_count)
+            await pilot.press("y")
+            await app.workers.wait_for_complete()
+            await pilot.pause()
+            self.assertEqual(2024, app.year)
+            self.assertEqual(store.year(2024).shape[0], table.row_count)
+            await pilot.press("q")
+
+    async def test_five_number_app(self):
+        """
+        All the statistic tables are filled from one snapshot
+        """
+        FiveNumberApp.DF = load_json_data(data_file=RACE_RESULTS_JSON_FULL_LEVEL[2024], cache_dir=self.cache_dir)
+        FiveNumberApp.SNAPSHOT_DIR = self.cache_dir.joinpath("snapshots")
+        app = FiveNumberApp()
+        try:
+            async with app.run_test() as pilot:
+                await app.workers.wait_for_complete()
+                await pilot.pause()
+                for table in app.query(DataTable):
+                    self.assertLess(0, table.row_count)
+                gender_table = app.get_widget_by_id(FiveNumberApp.NumbersTables.GENDER_BUCKET.name, expect_type=DataTable)
+                self.assertEqual(FiveNumberApp.DF.shape[0], sum(row[1] for row in map(gender_table.get_row_at, range(gender_table.row_count))))
+                await pilot.press("q")
+        finally:
+            FiveNumberApp.SNAPSHOT_DIR = None
+
+    async def test_five_number_app_follow(self):
+        """
+        Live results update the tables, their snapshots are not saved
+        """
+        lines = RACE_RESULTS_JSON_FULL_LEVEL[2024].read_text(encoding='utf-8').splitlines(keepends=True)
+        with tempfile.TemporaryDirectory() as work_dir:
+            live_file = Path(work_dir).joinpath("live.jsonl")
+            live_file.write_text(''.join(lines[:100]), encoding='utf-8')
+            FiveNumberApp.TAIL = ResultsTail(live_file)
+            FiveNumberApp.DF = FiveNumberApp.TAIL.read()
+            FiveNumberApp.SNAPSHOT_DIR = self.cache_dir.joinpath("snapshots")
+            app = FiveNumberApp()
+            try:
+                async with app.run_test() as pilot:
+                    await app.workers.wait_for_complete()
+                    await pilot.pause()
+                    with open(live_file, 'a', encoding='utf-8') as f:
+                        f.write(''.join(lines[100:]))
+                    await app.workers.wait_for_complete()
+                    app.check_results()
+                    await app.workers.wait_for_complete()
+                    await pilot.pause()
+                    summary_table = app.get_widget_by_id(FiveNumberApp.NumbersTables.SUMMARY.name, expect_type=DataTable)
+                    self.assertEqual(FiveNumberApp.DF.shape[0], summary_table.get_row_at(0)[1])
+                    self.assertListEqual([], list(FiveNumberApp.SNAPSHOT_DIR.glob("*.json")))
+                    await pilot.press("q")
+            finally:
+                FiveNumberApp.TAIL = None
+                FiveNumberApp.SNAPSHOT_DIR = None
+
+    async def test_browser_app_follow(self):
+        """
+        Results appended to a live file are added to the table
+        """
+        lines = RACE_RESULTS_JSON_FULL_LEVEL[2025].read_text(encoding='utf-8').splitlines(keepends=True)
+        with tempfile.TemporaryDirectory() as work_dir:
+            live_file = Path(work_dir).joinpath("live.jsonl")
+            live_file.write_text(''.join(lines[:50]), encoding='utf-8')
+            tail = ResultsTail(live_file)
+            app = BrowserApp(df=tail.read(), tail=tail)
+            app.FOLLOW_INTERVAL = 0.1
+            async with app.run_test() as pilot:
+                await app.workers.wait_for_complete()
+                table = app.screen.query(DataTable).first()
+                self.assertEqual(app.df.shape[0], table.row_count)
+                with open(live_file, 'a', encoding='utf-8') as f:
+                    f.write(''.join(lines[50:]))
+                # Only one batch is applied at a time
+                app.check_results()
+                worker = app.follow_worker
+                app.check_results()
+                self.assertIs(worker, app.follow_worker)
+                await pilot.pause(0.5)
+                await app.workers.wait_for_complete()
+                await pilot.pause()
+                self.assertEqual(load_json_data(data_file=live_file, use_cache=False).shape[0], table.row_count)
+                time_idx = FIELD_NAMES_AND_POS[RaceFields.TIME]
+                self.assertEqual(app.df[RaceFields.TIME.value].min(), table.get_row_at(0)[time_idx])
+                await pilot.press("q")
+
+    async def test_outlier_app(self):
+        """
+        Outlier details are built when a row is selected
+        """
+        OutlierApp.DF = load_json_data(data_file=RACE_RESULTS_JSON_FULL_LEVEL[2023], use_pretty=False, cache_dir=self.cache_dir)
+        app = OutlierApp()
+        async with app.run_test() as pilot:
+            await app.workers.wait_for_complete()
+            await pilot.pause()
+            table = app.get_widget_by_id(f'col_{RaceFields.TIME.name}_outlier', expect_type=DataTable)
+            self.assertLess(0, table.row_count)
+            table.focus()
+            await pilot.press("enter")
+            await pilot.pause()
+            self.assertIsInstance(app.screen, OutlierDetailScreen)
+            await pilot.click("#close")
+            await pilot.press("q")
+
+    async def test_outlier_app_follow(self):
+        """
+        Live outliers get one row per runner, runners reported again replace their previous values
+        """
+        lines = RACE_RESULTS_JSON_FULL_LEVEL[2024].read_text(encoding='utf-8').splitlines(keepends=True)
+        with tempfile.TemporaryDirectory() as work_dir:
+            live_file = Path(work_dir).joinpath("live.jsonl")
+            live_file.write_text(''.join(lines[:100]), encoding='utf-8')
+            OutlierApp.TAIL = ResultsTail(live_file)
+            OutlierApp.DF = OutlierApp.TAIL.read()
+            app = OutlierApp()
+            try:
+                async with app.run_test() as pilot:
+                    await app.workers.wait_for_complete()
+                    await pilot.pause()
+                    for _ in range(2):
+                        with open(live_file, 'a', encoding='utf-8') as f:
+                            f.write(''.join(lines[100:]))
+                        await app.workers.wait_for_complete()
+                        app.check_results()
+                        await app.workers.wait_for_complete()
+                        await pilot.pause()
+                    for detector in app.detectors.values():
+                        self.assertEqual(OutlierApp.DF.shape[0], sum(count for count, _, _ in detector.moments.values()))
+                    rows = 0
+                    for table in app.query(DataTable):
+                        bibs = [table.get_row_at(idx)[0] for idx in range(table.row_count)]
+                        self.assertEqual(len(set(bibs)), len(bibs))
+                        rows += len(bibs)
+                    self.assertLess(0, rows)
+                    await pilot.press("q")
+            finally:
+                OutlierApp.TAIL = None
+
+    async def test_browser_app_virtual(self):
+        """
+        Virtual table reads the rows from the DataFrame, sorting and details work the same way
+        """
+        store = RaceStore(cache_dir=self.cache_dir)
+        app = BrowserApp(store=store, year=2024, virtual=True)
+        async with app.run_test() as pilot:
+            await app.workers.wait_for_complete()
+            await pilot.pause()
+            table = app.get_widget_by_id('runners', expect_type=FrameTable)
+            df = store.year(2024)
+            self.assertEqual(df.shape[0], table.row_count)
+            time_idx = FIELD_NAMES_AND_POS[RaceFields.TIME]
+            self.assertEqual(df[RaceFields.TIME.value].min(), table.get_row_at(0)[time_idx])
+            await pilot.click('#runners', offset=(2, 0))  # BIB header
+            await pilot.pause()
+            self.assertEqual(df.index.min(), table.get_row_at(0)[FIELD_NAMES_AND_POS[RaceFields.BIB]])
+            # Rows are found through the DataFrame index, keys are the index as string
+            bib = int(df.index[10])
+            self.assertEqual(bib, table.get_row(str(bib))[FIELD_NAMES_AND_POS[RaceFields.BIB]])
+            self.assertEqual(str(df.index.min()), next(iter(table.rows)))
+            self.assertNotIn("999999", table.rows)
+            self.assertNotIn(f"0{bib}", table.rows)
+            table.focus()
+            await pilot.press("down", "down", "enter")
+            await pilot.pause()
+            markdown_viewer = app.screen.query(MarkdownViewer).first()
+            self.assertIn(str(table.get_row_at(2)[FIELD_NAMES_AND_POS[RaceFields.BIB]]), markdown_viewer.document.source)
+            await pilot.click("#close")
+
+            await pilot.press("ctrl+\\")
+            for char in "jose":
+                await pilot.press(char)
+            await pilot.press("enter")
+            self.assertTrue(app.screen.query(MarkdownViewer).first().document)
+            await pilot.click("#close")
+            await pilot.press("y")
+            await app.workers.wait_for_complete()
+            await pilot.pause()
+            self.assertEqual(store.year(2025).shape[0], table.row_count)
+            await pilot.press("q")
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,175 @@
+"""
+Unit tests for the columnar results cache
+"""
+import os
+import shlex
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+
+import numpy as np
+import pandas
+from pandas.testing import assert_frame_equal
+
+from empirestaterunup.cache import cache_location, load_compiled, load_frame, save_frame
+from empirestaterunup.data import (
+    COUNTRY_DETAILS,
+    NORMALIZATION_VERSION,
+    RACE_RESULTS_JSON_FULL_LEVEL,
+    RaceFields,
+    RaceStore,
+    load_country_details,
+    load_json_data,
+    parse_toml,
+)
+from empirestaterunup.server import SNAPSHOT_DIR_NAME, session_command, warm_up
+
+
+class CacheTestCase(unittest.TestCase):
+    """
+    Unit tests for the columnar results cache
+    """
+
+    def setUp(self) -> None:
+        self.cache_dir = Path(tempfile.mkdtemp())
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+    def test_save_load_frame(self):
+        """
+        All the supported column types survive a round trip
+        """
+        df = pandas.DataFrame(
+            {
+                'name': ['Jose', 'Veronica', ''],
+                'age': pandas.Series([50, 45, 30], dtype='int8'),
+                'country': pandas.Categorical(['US', 'VE', 'US']),
+                'time': pandas.to_timedelta([600000, 700000, 800000], unit='milliseconds'),
+                'finished': [True, True, False],
+                'distance': pandas.Series([320, None, 61], dtype='Int64')
+            },
+            index=pandas.Index([1, 2, 3], name='bib')
+        )
+        location = self.cache_dir.joinpath("frame-1")
+        save_frame(df, location)
+        assert_frame_equal(df, load_frame(location))
+        self.assertIsNone(load_frame(self.cache_dir.joinpath("missing-1")))
+        with self.assertRaises(TypeError):
+            save_frame(df.assign(bad=[object(), 1, 2]), self.cache_dir.joinpath("frame-2"))
+
+    def test_load_json_data_cache(self):
+        """
+        Cached results match a fresh parse, and changes on the source file invalidate the entry
+        """
+        data_file = self.cache_dir.joinpath("results-2023.jsonl")
+        shutil.copy(RACE_RESULTS_JSON_FULL_LEVEL[2023], data_file)
+        fresh = load_json_data(data_file=data_file, use_cache=False)
+        load_json_data(data_file=data_file, cache_dir=self.cache_dir)
+        location = cache_location(
+            data_file=data_file,
+            version=NORMALIZATION_VERSION,
+            cache_dir=self.cache_dir,
+            remove_dnf=True,
+            split_fields=[],
+            compact=False
+        )
+        self.assertTrue(location.exists())
+        assert_frame_equal(fresh, load_json_data(data_file=data_file, cache_dir=self.cache_dir))
+
+        lines = data_file.read_text(encoding='utf-8').splitlines(keepends=True)
+        data_file.write_text(''.join(lines[:100]), encoding='utf-8')
+        self.assertGreater(fresh.shape[0], load_json_data(data_file=data_file, cache_dir=self.cache_dir).shape[0])
+        self.assertFalse(location.exists())
+
+    def test_cached_frame_writable(self):
+        """
+        Cached and freshly parsed results take the same updates, and updates never reach the cache
+        """
+        for compact in [False, True]:
+            fresh = load_json_data(data_file=RACE_RESULTS_JSON_FULL_LEVEL[2024], use_cache=False, compact=compact)
+            load_json_data(data_file=RACE_RESULTS_JSON_FULL_LEVEL[2024], cache_dir=self.cache_dir, compact=compact)
+            cached = load_json_data(data_file=RACE_RESULTS_JSON_FULL_LEVEL[2024], cache_dir=self.cache_dir, compact=compact)
+            for df in [fresh, cached]:
+                first, second = df.index[:2]
+                for column in df.columns:
+                    df.loc[first, column] = df.loc[second, column]
+                df.iloc[1, df.columns.get_loc(RaceFields.TIME.value)] = df.iloc[2, df.columns.get_loc(RaceFields.TIME.value)]
+            assert_frame_equal(fresh, cached)
+            assert_frame_equal(
+                load_json_data(data_file=RACE_RESULTS_JSON_FULL_LEVEL[2024], use_cache=False, compact=compact),
+                load_json_data(data_file=RACE_RESULTS_JSON_FULL_LEVEL[2024], cache_dir=self.cache_dir, compact=compact)
+            )
+
+    def test_load_compiled(self):
+        """
+        Compiled data is reused until the source contents or the compiler version change
+        """
+        source = self.cache_dir.joinpath("countries.toml")
+        shutil.copy(COUNTRY_DETAILS, source)
+        calls = []
+
+        def compile_source(data_file: Path) -> dict:
+            calls.append(data_file)
+            return parse_toml(data_file)
+
+        countries = load_compiled(source, compile_source, version=1, cache_dir=self.cache_dir)
+        self.assertDictEqual(countries, load_compiled(source, compile_source, version=1, cache_dir=self.cache_dir))
+        self.assertEqual(1, len(calls))
+        # Touched but same contents, the entry is still good
+        os.utime(source, ns=(0, 0))
+        load_compiled(source, compile_source, version=1, cache_dir=self.cache_dir)
+        self.assertEqual(1, len(calls))
+        load_compiled(source, compile_source, version=2, cache_dir=self.cache_dir)
+        self.assertEqual(2, len(calls))
+        source.write_text('["Nowhere"]\nalpha-2 = "NW"\n', encoding='utf-8')
+        self.assertDictEqual(
+            {"Nowhere": {"alpha-2": "NW"}},
+            load_compiled(source, compile_source, version=2, cache_dir=self.cache_dir)
+        )
+        self.assertEqual(3, len(calls))
+        self.assertDictEqual(load_country_details(use_cache=False), load_country_details(cache_dir=self.cache_dir))
+
+    def test_race_store_cache(self):
+        """
+        A second store on the same cache directory maps the saved columns instead of parsing the results again
+        """
+        fresh = RaceStore(cache_dir=self.cache_dir, compact=True)
+        cached = RaceStore(cache_dir=self.cache_dir, compact=True)
+        assert_frame_equal(fresh.df, cached.df)
+        self.assertDictEqual(fresh.partitions, cached.partitions)
+        base = cached.df['age'].to_numpy()
+        while base is not None and not isinstance(base, np.memmap):
+            base = base.base
+        self.assertIsInstance(base, np.memmap)
+        # Regular and compact layouts are different entries, one does not evict the other
+        regular = RaceStore(cache_dir=self.cache_dir)
+        self.assertEqual(2, len(list(self.cache_dir.glob("store-*"))))
+        self.assertEqual(fresh.df.shape, regular.df.shape)
+
+    def test_server_warm_up(self):
+        """
+        Sessions started by the server find the store and the snapshots already on the shared cache
+        """
+        store = warm_up(self.cache_dir)
+        self.assertEqual(len(store.years), len(list(self.cache_dir.joinpath(SNAPSHOT_DIR_NAME).glob("*.json"))))
+        cmd = shlex.split(session_command("esru_numbers", self.cache_dir, year=2024))
+        self.assertEqual("esru_numbers", cmd[0])
+        self.assertIn("--compact", cmd)
+        self.assertEqual(str(self.cache_dir.resolve()), cmd[cmd.index("--cache-dir") + 1])
+        self.assertIn("--snapshot-dir", cmd)
+        self.assertEqual("2024", cmd[-1])
+        self.assertNotIn("--snapshot-dir", session_command("esru_browser", self.cache_dir))
+        spaced_dir = self.cache_dir.joinpath("with spaces")
+        cmd = shlex.split(session_command("esru_browser", spaced_dir))
+        self.assertEqual(str(spaced_dir.resolve()), cmd[cmd.index("--cache-dir") + 1])
+        # External results files are followed by the sessions, instead of showing a race year
+        results_file = spaced_dir.joinpath("results.jsonl")
+        cmd = shlex.split(session_command("esru_outlier", self.cache_dir, year=2024, results_file=results_file))
+        self.assertEqual(str(results_file.resolve()), cmd[cmd.index("--follow") + 1])
+        self.assertNotIn("2024", cmd)
+
+
+if __name__ == '__main__':
+    unittest.main()
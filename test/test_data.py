@@ -1,9 +1,13 @@
 """
 Unit tests for data loading
 """
+import shutil
+import tempfile
 import unittest
 import warnings
+from pathlib import Path
 
+import pandas
 from pandas import Series
 
 from empirestaterunup.analyze import FastestFilters, find_fastest
@@ -11,16 +15,29 @@ from empirestaterunup.data import (
     LOCATION_DETAILS,
     RACE_RESULTS_JSON_FULL_LEVEL,
     CountryColumns,
+    EventFields,
     RaceFields,
+    RaceStore,
+    ResultsTail,
+    SplitFields,
+    as_duration,
     df_to_list_of_tuples,
+    fill_missing_age,
+    flatten_split_data,
+    format_duration,
     get_categories,
     get_positions,
     get_times,
+    iter_json_data,
+    iter_rows,
     load_country_details,
+    load_country_index,
     load_json_data,
+    load_json_files,
     load_location_lookup,
     location_lookup,
     lookup_country_by_code,
+    merge_results,
     series_to_list_of_tuples,
 )
 
@@ -30,13 +47,19 @@ class DataTestCase(unittest.TestCase):
     Uni tests for data loading
     """
 
+    def setUp(self) -> None:
+        self.cache_dir = Path(tempfile.mkdtemp())
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
     def test_load_json_data(self):
         """
         Load data in JSON format from https://github.com/josevnz/athlinks-races/
         """
         for year in RACE_RESULTS_JSON_FULL_LEVEL:
             warnings.warn(UserWarning(f"Loading {year}={RACE_RESULTS_JSON_FULL_LEVEL[year]}"), stacklevel=2)
-            data = load_json_data(RACE_RESULTS_JSON_FULL_LEVEL[year])
+            data = load_json_data(RACE_RESULTS_JSON_FULL_LEVEL[year], cache_dir=self.cache_dir)
             self.assertIsNotNone(data)
             for row in data:
                 self.assertIsNotNone(row)
@@ -45,16 +68,159 @@ class DataTestCase(unittest.TestCase):
         """
         Load data in CSV format, using defaults
         """
-        data = load_json_data()
+        data = load_json_data(cache_dir=self.cache_dir)
         self.assertIsNotNone(data)
         for row in data:
             self.assertIsNotNone(row)
 
+    def test_load_json_files(self):
+        """
+        Parallel load returns the same results as loading each file alone, in the same order
+        """
+        data_files = list(RACE_RESULTS_JSON_FULL_LEVEL.values())
+        for use_cache in [False, True]:
+            frames = load_json_files(data_files=data_files, max_workers=2, use_cache=use_cache, cache_dir=self.cache_dir)
+            self.assertEqual(len(data_files), len(frames))
+            for data_file, data in zip(data_files, frames, strict=True):
+                pandas.testing.assert_frame_equal(load_json_data(data_file=data_file, use_cache=False), data)
+
+    def test_compact_results(self):
+        """
+        Compact layout takes less memory and keeps the same information
+        """
+        data = load_json_data(data_file=RACE_RESULTS_JSON_FULL_LEVEL[2024], use_cache=False)
+        compact = load_json_data(data_file=RACE_RESULTS_JSON_FULL_LEVEL[2024], use_cache=False, compact=True)
+        self.assertLess(compact.memory_usage(deep=True).sum() * 2, data.memory_usage(deep=True).sum())
+        pretty = load_json_data(data_file=RACE_RESULTS_JSON_FULL_LEVEL[2024], use_cache=False, use_pretty=True)
+        self.assertLess(compact.memory_usage(deep=True).sum() * 2, pretty.memory_usage(deep=True).sum())
+        self.assertEqual('category', compact[RaceFields.COUNTRY.value].dtype.name)
+        self.assertEqual('int8', compact[RaceFields.AGE.value].dtype.name)
+        self.assertEqual('int32', compact[RaceFields.TIME.value].dtype.name)
+        pandas.testing.assert_series_equal(data[RaceFields.TIME.value], as_duration(compact[RaceFields.TIME.value]))
+        bib = data.index[0]
+        self.assertEqual(
+            str(pretty.at[bib, RaceFields.TIME.value]),
+            format_duration(compact.at[bib, RaceFields.TIME.value])
+        )
+        self.assertEqual(
+            format_duration(data.at[bib, RaceFields.TIME.value]),
+            format_duration(compact.at[bib, RaceFields.TIME.value])
+        )
+
+    def test_race_store(self):
+        """
+        All the years on one DataFrame, each year is the same as loading its file alone
+        """
+        store = RaceStore(cache_dir=self.cache_dir)
+        self.assertListEqual(sorted(RACE_RESULTS_JSON_FULL_LEVEL.keys()), store.years)
+        total = 0
+        for year, data_file in RACE_RESULTS_JSON_FULL_LEVEL.items():
+            data = load_json_data(data_file=data_file, cache_dir=self.cache_dir)
+            year_df = store.year(year)
+            total += year_df.shape[0]
+            pandas.testing.assert_frame_equal(data, year_df.drop(columns=[EventFields.YEAR.value, EventFields.EVENT_ID.value]))
+            self.assertTrue((year_df[EventFields.YEAR.value] == year).all())
+            self.assertEqual(1, year_df[EventFields.EVENT_ID.value].nunique())
+        self.assertEqual(total, store.df.shape[0])
+        self.assertEqual(1124263, store.events.loc[2025, EventFields.EVENT_ID.value])
+        self.assertEqual(2023, store.next_year(2025))
+        self.assertIsInstance(store.df[EventFields.YEAR.value].dtype, pandas.CategoricalDtype)
+        with self.assertRaises(KeyError):
+            store.year(1931)
+
+    def test_iter_json_data(self):
+        """
+        Streamed chunks add up to the same results as a full load
+        """
+        data = load_json_data(data_file=RACE_RESULTS_JSON_FULL_LEVEL[2024], use_cache=False)
+        chunks = list(iter_json_data(
+            data_file=RACE_RESULTS_JSON_FULL_LEVEL[2024],
+            chunk_size=100,
+            median_age=data[RaceFields.AGE.value].median()
+        ))
+        self.assertEqual(6, len(chunks))
+        self.assertTrue(all(chunk.shape[0] <= 100 for chunk in chunks))
+        pandas.testing.assert_frame_equal(data, pandas.concat(chunks))
+
+        # Missing ages get the median of the whole file, not the one of their chunk
+        raw = pandas.read_json(RACE_RESULTS_JSON_FULL_LEVEL[2024], lines=True)
+        raw.loc[:9, RaceFields.AGE.value] = None
+        raw.loc[10:19, RaceFields.AGE.value] = 0
+        with tempfile.TemporaryDirectory() as work_dir:
+            data_file = Path(work_dir).joinpath("results.jsonl")
+            raw.to_json(data_file, orient='records', lines=True)
+            data = load_json_data(data_file=data_file, use_cache=False)
+            chunked = pandas.concat(iter_json_data(data_file=data_file, chunk_size=100, fill_age=False))
+        chunked[RaceFields.AGE.value] = fill_missing_age(chunked[RaceFields.AGE.value])
+        pandas.testing.assert_frame_equal(data, chunked)
+        median_age = int(raw.loc[raw.racer_has_finished, RaceFields.AGE.value].median())
+        self.assertTrue((data[RaceFields.AGE.value].iloc[:20] == median_age).all())
+
+    def test_results_tail(self):
+        """
+        Only complete appended records are read, and they can be merged by BIB
+        """
+        lines = RACE_RESULTS_JSON_FULL_LEVEL[2024].read_text(encoding='utf-8').splitlines(keepends=True)
+        with tempfile.TemporaryDirectory() as work_dir:
+            live_file = Path(work_dir).joinpath("live.jsonl")
+            tail = ResultsTail(live_file)
+            self.assertIsNone(tail.read())
+            live_file.write_text(''.join(lines[:100]) + lines[100][:20], encoding='utf-8')
+            df = tail.read()
+            complete_file = Path(work_dir).joinpath("complete.jsonl")
+            complete_file.write_text(''.join(lines[:100]), encoding='utf-8')
+            self.assertEqual(load_json_data(data_file=complete_file, use_cache=False).shape[0], df.shape[0])
+            self.assertIsNone(tail.read())
+            with open(live_file, 'a', encoding='utf-8') as f:
+                f.write(lines[100][20:] + ''.join(lines[101:]))
+            batch = tail.read()
+            df, replaced = merge_results(df, batch)
+            self.assertTrue(replaced.empty)
+            self.assertEqual(load_json_data(data_file=RACE_RESULTS_JSON_FULL_LEVEL[2024], cache_dir=self.cache_dir).shape[0], df.shape[0])
+            self.assertTrue(df.index.is_unique)
+
+            live_file.write_text(''.join(lines[:10]), encoding='utf-8')
+            batch = tail.read()
+            df, replaced = merge_results(df, batch)
+            self.assertEqual(batch.shape[0], replaced.shape[0])
+            self.assertTrue(df.index.is_unique)
+
+            # Appended records are parsed in chunks of at most chunk_size runners
+            chunked_tail = ResultsTail(live_file, chunk_size=3)
+            chunks = list(chunked_tail.iter_read())
+            self.assertEqual(4, len(chunks))
+            self.assertTrue(all(chunk.shape[0] <= 3 for chunk in chunks))
+            pandas.testing.assert_frame_equal(batch, pandas.concat(chunks))
+            self.assertListEqual([], list(chunked_tail.iter_read()))
+
+    def test_flatten_split_data(self):
+        """
+        Splits are aligned by name, even if they are partial or out of order
+        """
+        raw = pandas.read_json(RACE_RESULTS_JSON_FULL_LEVEL[2023], lines=True)
+        raw.at[0, 'split_data'] = raw.at[0, 'split_data'][1:][::-1]
+        raw.at[1, 'split_data'] = []
+        splits = flatten_split_data(raw['split_data'], split_fields=(SplitFields.DISTANCE, SplitFields.GUN_TIME))
+        self.assertEqual(raw.shape[0], splits.shape[0])
+        self.assertListEqual(
+            [RaceFields.TIME.value, RaceFields.TWENTY_FLOOR_TIME.value, RaceFields.SIXTY_FIVE_FLOOR_TIME.value],
+            splits.columns[:3].tolist()
+        )
+        self.assertTrue(pandas.isna(splits.at[0, RaceFields.TIME.value]))
+        self.assertEqual(157000, splits.at[0, RaceFields.TWENTY_FLOOR_TIME.value])
+        self.assertEqual(229, splits.at[0, f"{RaceFields.SIXTY_FIVE_FLOOR_TIME.value} {SplitFields.DISTANCE.value}"])
+        self.assertTrue(splits.loc[1].isna().all())
+        self.assertEqual(688000, splits.at[2, f"{RaceFields.TIME.value} {SplitFields.GUN_TIME.value}"])
+
+        data = load_json_data(RACE_RESULTS_JSON_FULL_LEVEL[2023], use_cache=False, split_fields=tuple(SplitFields))
+        self.assertEqual(376, data.shape[0])
+        self.assertEqual(320, data[f"{RaceFields.TIME.value} {SplitFields.DISTANCE.value}"].max())
+
     def test_to_list_of_tuples(self):
         """
         Conversion
         """
-        data = load_json_data(data_file=RACE_RESULTS_JSON_FULL_LEVEL[2023])
+        data = load_json_data(data_file=RACE_RESULTS_JSON_FULL_LEVEL[2023], cache_dir=self.cache_dir)
         self.assertIsNotNone(data)
 
         header, rows = df_to_list_of_tuples(data)
@@ -72,12 +238,30 @@ class DataTestCase(unittest.TestCase):
         self.assertIsNotNone(rows)
         self.assertEqual(0, len(rows))
 
+    def test_iter_rows(self):
+        """
+        Streamed rows, filtered by BIB, keep the DataFrame order
+        """
+        data = load_json_data(data_file=RACE_RESULTS_JSON_FULL_LEVEL[2023], cache_dir=self.cache_dir)
+        header, rows = df_to_list_of_tuples(data)
+        self.assertListEqual(rows, list(iter_rows(data)))
+        bib_idx = header.index(RaceFields.BIB.value)
+        bibs = [rows[10][bib_idx], rows[2][bib_idx], rows[2][bib_idx], 99999]
+        filtered = list(iter_rows(data, bibs=bibs))
+        self.assertListEqual([rows[2], rows[10]], filtered)
+        self.assertListEqual(
+            [(rows[2][bib_idx], rows[2][header.index(RaceFields.NAME.value)])],
+            list(iter_rows(data, bibs=bibs[1:2], fields=[RaceFields.BIB.value, RaceFields.NAME.value]))
+        )
+        store = RaceStore(cache_dir=self.cache_dir)
+        self.assertEqual(2, len(list(iter_rows(store.df, bibs=[19]))))
+
     def test_series_to_list_of_tuples(self):
         """
         Conversion
         """
         for data_file in RACE_RESULTS_JSON_FULL_LEVEL.values():
-            data = load_json_data(data_file=data_file)
+            data = load_json_data(data_file=data_file, cache_dir=self.cache_dir)
             self.assertIsNotNone(data)
             countries: Series = data[RaceFields.COUNTRY.value]
             rows = series_to_list_of_tuples(countries)
@@ -115,11 +299,31 @@ class DataTestCase(unittest.TestCase):
         except ValueError:
             pass
 
+    def test_country_index(self):
+        """
+        Indexed country lookups must agree with the full document scan
+        """
+        country_data = load_country_details()
+        country_index = load_country_index()
+        self.assertEqual(len(country_data), len(country_index))
+        self.assertIs(country_index, load_country_index())
+        for country_code in ["US", "USA", "VE", "VEN", "IT"]:
+            name, _ = lookup_country_by_code(country_data=country_data, letter_code=country_code)
+            record = country_index.lookup(country_code)
+            self.assertEqual(name, record.name)
+        self.assertEqual("USA", country_index.lookup("840").alpha_3)
+        for country_code in ["XX", "XXX", "999"]:
+            self.assertIsNone(country_index.lookup(country_code))
+        with self.assertRaises(ValueError):
+            country_index.lookup("XXXX")
+        normalized = country_index.normalize(Series(["US", "VEN", "XX"]))
+        self.assertListEqual(["United States of America", "Venezuela (Bolivarian Republic of)", "XX"], normalized.tolist())
+
     def test_get_times(self):
         """
         Get times from the data
         """
-        run_data = load_json_data(data_file=RACE_RESULTS_JSON_FULL_LEVEL[2023])
+        run_data = load_json_data(data_file=RACE_RESULTS_JSON_FULL_LEVEL[2023], cache_dir=self.cache_dir)
         self.assertIsNotNone(run_data)
         df = get_times(run_data)
         self.assertIsNotNone(df)
@@ -129,7 +333,7 @@ class DataTestCase(unittest.TestCase):
         """
         Get positions from the data
         """
-        run_data = load_json_data(data_file=RACE_RESULTS_JSON_FULL_LEVEL[2023])
+        run_data = load_json_data(data_file=RACE_RESULTS_JSON_FULL_LEVEL[2023], cache_dir=self.cache_dir)
         self.assertIsNotNone(run_data)
         df = get_positions(run_data)
         self.assertIsNotNone(df)
@@ -139,7 +343,7 @@ class DataTestCase(unittest.TestCase):
         """
         Get categories from the data
         """
-        run_data = load_json_data(data_file=RACE_RESULTS_JSON_FULL_LEVEL[2023])
+        run_data = load_json_data(data_file=RACE_RESULTS_JSON_FULL_LEVEL[2023], cache_dir=self.cache_dir)
         self.assertIsNotNone(run_data)
         df = get_categories(run_data)
         self.assertIsNotNone(df)
@@ -149,7 +353,7 @@ class DataTestCase(unittest.TestCase):
         """
         Get the fastest runners on the dataset
         """
-        run_data = load_json_data(data_file=RACE_RESULTS_JSON_FULL_LEVEL[2023])
+        run_data = load_json_data(data_file=RACE_RESULTS_JSON_FULL_LEVEL[2023], cache_dir=self.cache_dir)
         self.assertIsNotNone(run_data)
 
         fastest = find_fastest(run_data, FastestFilters.GENDER)
@@ -1,8 +1,24 @@
+import json
+import os
+import shutil
+import stat
+import tempfile
 import unittest
 from pathlib import Path
 
+from pandas import DataFrame, Series
+
 from empirestaterunup.data import LOCATION_DETAILS, RaceFields
-from empirestaterunup.devtools import enrich_race_results
+from empirestaterunup.devtools import (
+    LocalityMatcher,
+    LocationTable,
+    RaceResultsEnricher,
+    RecordCache,
+    enrich_files,
+    enrich_race_results,
+    lookup_version,
+    record_digest,
+)
 
 TEST_RACE_FILE = Path(__file__).parent.joinpath("results-raw-2025.jsonl")
 
@@ -14,6 +30,223 @@ class DevtoolsTestCase(unittest.TestCase):
         for rs in rr:
             self.assertNotEqual('', rs[RaceFields.COUNTRY.value])
 
+    def test_enrich_chunk_types(self):
+        """
+        Records are written the same way whatever chunk they are enriched with
+        """
+        work_dir = Path(tempfile.mkdtemp())
+        try:
+            # A missing age makes pandas guess floats for the whole chunk
+            raw_lines = TEST_RACE_FILE.read_text(encoding='utf-8').splitlines(keepends=True)
+            missing_age = json.loads(raw_lines[0])
+            missing_age[RaceFields.AGE.value] = None
+            raw_file = work_dir.joinpath("raw.jsonl")
+            raw_file.write_text(json.dumps(missing_age) + '\n' + ''.join(raw_lines[1:]), encoding='utf-8')
+            outputs = []
+            for chunk_size in (1, 40, 1000):
+                destination = work_dir.joinpath(f"enriched-{chunk_size}.jsonl")
+                enrich_files(
+                    race_results_files=[raw_file],
+                    location_lookup_file=LOCATION_DETAILS,
+                    enriched_race_results_file=destination,
+                    chunk_size=chunk_size,
+                    max_workers=1
+                )
+                outputs.append(destination.read_text(encoding='utf-8'))
+            self.assertEqual(outputs[0], outputs[1])
+            self.assertEqual(outputs[0], outputs[2])
+            first, second = [json.loads(line) for line in outputs[0].splitlines()[:2]]
+            self.assertIsNone(first[RaceFields.AGE.value])
+            self.assertIsInstance(second[RaceFields.BIB.value], int)
+            self.assertIsInstance(second[RaceFields.AGE.value], int)
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    def test_location_table(self):
+        table_data = {
+            "london": {"alpha-2": "GB", "ontario": {"alpha-2": "CA"}},
+            "merida": {"alpha-2": ""},
+            "atlantis": {"alpha-2": "XX"}
+        }
+        df = DataFrame({
+            RaceFields.COUNTRY.value: ['', '', '', 'VE', '', '', ''],
+            RaceFields.CITY.value: [' London', 'london', 'Merida', 'Merida', 'Atlantis', 'Springfield', 'Springfield'],
+            RaceFields.STATE.value: ['', 'Ontario ', '', '', '', '', '']
+        })
+        # Blank and unknown codes of the lookup file are kept as they are, and reported
+        with self.assertLogs(level='WARNING') as logs:
+            enricher = RaceResultsEnricher(location_table=LocationTable(table_data), default_country="US")
+        self.assertIn("atlantis='XX'", logs.output[0])
+        self.assertIn("merida=''", logs.output[0])
+        enricher.enrich(df)
+        self.assertListEqual(['GB', 'CA', '', 'VE', 'XX', 'US', 'US'], df[RaceFields.COUNTRY.value].tolist())
+        self.assertDictEqual({'Springfield': 2}, dict(enricher.unresolved))
+
+    def test_locality_matcher(self):
+        matcher = LocalityMatcher(["brooklyn", "astoria", "albuquerque", "mérida"], threshold=0.6)
+        self.assertEqual(("brooklyn", 1.0), matcher.match("Brooklyn, NY"))
+        self.assertEqual("astoria", matcher.match("Astoria Queens")[0])
+        self.assertEqual("mérida", matcher.match("MERIDA")[0])
+        self.assertEqual("albuquerque", matcher.match("Albuqerque")[0])
+        self.assertIsNone(matcher.match("Springfield"))
+        self.assertIsNone(matcher.match(""))
+        self.assertDictEqual({"Springfield": None, "Brooklyn, NY": ("brooklyn", 1.0)},
+                             matcher.match_many(["Springfield", "Brooklyn, NY", "Springfield"]))
+        self.assertIsNone(LocalityMatcher(["albuquerque"], threshold=0.95).match("Albuqerque"))
+
+        table = LocationTable({"brooklyn": {"alpha-2": "US"}})
+        self.assertListEqual(
+            ["US", "US"], table.resolve(Series(["Brooklyn, NY", "Brooklynn"]), Series(["", ""])).tolist()
+        )
+        self.assertTrue(LocationTable({"brooklyn": {"alpha-2": "US"}}, fuzzy=False).resolve(
+            Series(["Brooklyn, NY"]), Series([""])).isna().all())
+
+    def test_enrich_files_no_trailing_newline(self):
+        """
+        The last record of a file without a trailing new line is not glued to the next file
+        """
+        work_dir = Path(tempfile.mkdtemp())
+        try:
+            rr = enrich_race_results(race_results_file=TEST_RACE_FILE, location_lookup_file=LOCATION_DETAILS)
+            raw_file = work_dir.joinpath("raw.jsonl")
+            raw_file.write_text(TEST_RACE_FILE.read_text(encoding='utf-8').rstrip('\n'), encoding='utf-8')
+            destination = work_dir.joinpath("enriched.jsonl")
+            for chunk_size in (40, 1000):
+                records = enrich_files(
+                    race_results_files=[raw_file, raw_file],
+                    location_lookup_file=LOCATION_DETAILS,
+                    enriched_race_results_file=destination,
+                    chunk_size=chunk_size,
+                    max_workers=1
+                ).records
+                self.assertEqual(2 * len(rr), records)
+                self.assertListEqual(rr + rr, [json.loads(line) for line in destination.read_text(encoding='utf-8').splitlines()])
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    def test_enrich_files(self):
+        work_dir = Path(tempfile.mkdtemp())
+        try:
+            rr = enrich_race_results(race_results_file=TEST_RACE_FILE, location_lookup_file=LOCATION_DETAILS)
+            destination = work_dir.joinpath("enriched.jsonl")
+            for workers in (1, 3):
+                records, cached, unresolved, invalid = enrich_files(
+                    race_results_files=[TEST_RACE_FILE, TEST_RACE_FILE],
+                    location_lookup_file=LOCATION_DETAILS,
+                    enriched_race_results_file=destination,
+                    chunk_size=40,
+                    max_workers=workers
+                )
+                self.assertEqual(2 * len(rr), records)
+                self.assertEqual(0, cached)
+                self.assertListEqual(rr + rr, [json.loads(line) for line in destination.read_text(encoding='utf-8').splitlines()])
+                self.assertEqual(6, sum(unresolved.values()))
+                self.assertListEqual([], invalid)
+            # New output follows the umask, replaced output keeps its permissions
+            umask = os.umask(0)
+            os.umask(umask)
+            self.assertEqual(0o666 & ~umask, stat.S_IMODE(destination.stat().st_mode))
+            destination.chmod(0o640)
+            enrich_files(
+                race_results_files=[TEST_RACE_FILE],
+                location_lookup_file=LOCATION_DETAILS,
+                enriched_race_results_file=destination,
+                max_workers=1
+            )
+            self.assertEqual(0o640, stat.S_IMODE(destination.stat().st_mode))
+            enrich_files(
+                race_results_files=[TEST_RACE_FILE, TEST_RACE_FILE],
+                location_lookup_file=LOCATION_DETAILS,
+                enriched_race_results_file=destination,
+                max_workers=1
+            )
+            # A failed run leaves the previous output alone, and no temporary files behind
+            with self.assertRaises(FileNotFoundError):
+                enrich_files(
+                    race_results_files=[TEST_RACE_FILE, work_dir.joinpath("missing.jsonl")],
+                    location_lookup_file=LOCATION_DETAILS,
+                    enriched_race_results_file=destination,
+                    max_workers=2
+                )
+            self.assertEqual(2 * len(rr), len(destination.read_text(encoding='utf-8').splitlines()))
+            self.assertListEqual([destination], list(work_dir.iterdir()))
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    def test_enrich_files_invalid_bib(self):
+        """
+        Records with a BIB that is not a number are written with a null BIB and reported, the run goes on
+        """
+        work_dir = Path(tempfile.mkdtemp())
+        try:
+            raw_lines = TEST_RACE_FILE.read_text(encoding='utf-8').splitlines(keepends=True)
+            records = [json.loads(line) for line in raw_lines[:3]]
+            records[0][RaceFields.BIB.value] = "A12"
+            del records[1][RaceFields.BIB.value]
+            records[2][RaceFields.AGE.value] = "unknown"
+            raw_file = work_dir.joinpath("raw.jsonl")
+            raw_file.write_text(''.join(json.dumps(record) + '\n' for record in records) + ''.join(raw_lines[3:]), encoding='utf-8')
+            destination = work_dir.joinpath("enriched.jsonl")
+            summary = enrich_files(
+                race_results_files=[raw_file],
+                location_lookup_file=LOCATION_DETAILS,
+                enriched_race_results_file=destination,
+                max_workers=1
+            )
+            self.assertEqual(len(raw_lines), summary.records)
+            self.assertListEqual([
+                f"{records[0][RaceFields.NAME.value]} (bib='A12')",
+                f"{records[1][RaceFields.NAME.value]} (bib missing)",
+                f"{records[2][RaceFields.NAME.value]} (age='unknown')"
+            ], summary.invalid)
+            enriched = [json.loads(line) for line in destination.read_text(encoding='utf-8').splitlines()]
+            self.assertIsNone(enriched[0][RaceFields.BIB.value])
+            self.assertIsNone(enriched[1][RaceFields.BIB.value])
+            self.assertIsNone(enriched[2][RaceFields.AGE.value])
+            self.assertEqual(int(json.loads(raw_lines[3])[RaceFields.BIB.value]), enriched[3][RaceFields.BIB.value])
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    def test_incremental_enrichment(self):
+        work_dir = Path(tempfile.mkdtemp())
+        try:
+            rr = enrich_race_results(race_results_file=TEST_RACE_FILE, location_lookup_file=LOCATION_DETAILS)
+            raw_lines = TEST_RACE_FILE.read_text(encoding='utf-8').splitlines(keepends=True)
+            raw_file = work_dir.joinpath("raw.jsonl")
+            destination = work_dir.joinpath("enriched.jsonl")
+            record_cache = work_dir.joinpath("records.sqlite")
+            options = {
+                'race_results_files': [raw_file],
+                'location_lookup_file': LOCATION_DETAILS,
+                'enriched_race_results_file': destination,
+                'chunk_size': 64,
+                'max_workers': 2,
+                'record_cache': record_cache
+            }
+            raw_file.write_text(''.join(raw_lines[:100]), encoding='utf-8')
+            self.assertEqual((100, 0), enrich_files(**options)[:2])
+            # New and changed records are the only ones enriched again
+            changed = json.loads(raw_lines[0])
+            changed[RaceFields.AGE.value] += 1
+            raw_file.write_text(json.dumps(changed) + '\n' + ''.join(raw_lines[1:]), encoding='utf-8')
+            summary = enrich_files(**options)
+            self.assertEqual((len(rr), 99), summary[:2])
+            enriched = [json.loads(line) for line in destination.read_text(encoding='utf-8').splitlines()]
+            self.assertEqual(rr[0][RaceFields.AGE.value] + 1, enriched[0][RaceFields.AGE.value])
+            self.assertListEqual(rr[1:], enriched[1:])
+            self.assertEqual(len(rr), enrich_files(**options).cached)
+
+            # Records enriched with other lookup tables are not reused
+            version = lookup_version(LOCATION_DETAILS)
+            self.assertNotEqual(version, lookup_version(LOCATION_DETAILS, default_country="VE"))
+            with RecordCache(record_cache, version=lookup_version(LOCATION_DETAILS, default_country="VE")) as cache:
+                self.assertDictEqual({}, cache.get_many([record_digest(line) for line in raw_lines]))
+                cache.put_many([("digest", "{}")])
+                self.assertEqual(len(rr) + 1, cache.prune())
+                self.assertDictEqual({"digest": "{}"}, cache.get_many(["digest", "other"]))
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,63 @@
+"""
+Unit tests for the command palette search index
+"""
+import unittest
+
+from empirestaterunup.data import (
+    RACE_RESULTS_JSON_FULL_LEVEL,
+    RaceFields,
+    load_json_data,
+)
+from empirestaterunup.providers import MAX_HITS, RunnerSearchIndex
+
+
+class SearchIndexTestCase(unittest.TestCase):
+    """
+    Unit tests for the runner search index
+    """
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.df = load_json_data(data_file=RACE_RESULTS_JSON_FULL_LEVEL[2023], use_cache=False)
+        cls.index = RunnerSearchIndex(cls.df)
+
+    def test_search_bib(self):
+        """
+        Exact BIB first, then BIB prefixes
+        """
+        bib = int(self.df.index[0])
+        hits = self.index.search(str(bib))
+        self.assertEqual(bib, hits[0].bib)
+        self.assertEqual(RaceFields.BIB, hits[0].field)
+        self.assertEqual(1.0, hits[0].score)
+        for hit in hits[1:]:
+            if hit.field == RaceFields.BIB:
+                self.assertTrue(str(hit.bib).startswith(str(bib)))
+
+    def test_search_name(self):
+        """
+        Name tokens in any order, with accents or typos
+        """
+        name = self.df[RaceFields.NAME.value].iloc[0]
+        first, *_, last = name.split()
+        bib = int(self.df.index[0])
+        for query in [name, f"{last} {first}", name.upper(), f"{first[:3]} {last}"]:
+            self.assertIn(bib, [hit.bib for hit in self.index.search(query)], query)
+        typo = last[:-1] + ('x' if last[-1] != 'x' else 'y')
+        self.assertIn(bib, [hit.bib for hit in self.index.search(f"{first} {typo}")])
+        self.assertListEqual([], self.index.search("qqqqzzzz"))
+        self.assertListEqual([], self.index.search("  "))
+
+    def test_search_country(self):
+        """
+        Country prefix, capped and ranked by BIB
+        """
+        hits = self.index.search("united")
+        self.assertEqual(MAX_HITS, len(hits))
+        self.assertTrue(all(hit.field == RaceFields.COUNTRY for hit in hits))
+        self.assertListEqual(sorted(hit.bib for hit in hits), [hit.bib for hit in hits])
+        self.assertEqual(5, len(self.index.search("mexico", limit=5)))
+
+
+if __name__ == '__main__':
+    unittest.main()
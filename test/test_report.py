@@ -0,0 +1,67 @@
+"""
+Unit tests for the batch report
+"""
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+
+from empirestaterunup.data import RaceStore
+from empirestaterunup.report import (
+    INDEX_FILE,
+    MANIFEST_FILE,
+    ReportItem,
+    generate_report,
+    output_files,
+)
+
+
+class ReportTestCase(unittest.TestCase):
+    """
+    Unit tests for the batch report
+    """
+
+    def setUp(self) -> None:
+        self.output_dir = Path(tempfile.mkdtemp())
+        self.cache_dir = Path(tempfile.mkdtemp())
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.output_dir, ignore_errors=True)
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+    def test_generate_report(self):
+        """
+        All the files are written once, items with the same data are skipped on the next run
+        """
+        store = RaceStore(cache_dir=self.cache_dir)
+        written, skipped = generate_report(
+            output_dir=self.output_dir, store=store, years=[2025], max_workers=2, snapshot_dir=self.cache_dir
+        )
+        self.assertListEqual([], skipped)
+        expected = [output_file for item in ReportItem for output_file in output_files(item, 2025, self.output_dir)]
+        self.assertListEqual(sorted(expected), sorted(written))
+        for output_file in expected:
+            self.assertGreater(output_file.stat().st_size, 0)
+        self.assertIn("Summary", self.output_dir.joinpath("2025-five-numbers.html").read_text(encoding='utf-8'))
+        self.assertTrue(self.output_dir.joinpath(MANIFEST_FILE).exists())
+
+        written, skipped = generate_report(output_dir=self.output_dir, store=store, years=[2025], snapshot_dir=self.cache_dir)
+        self.assertListEqual([], written)
+        self.assertListEqual(sorted(expected), sorted(skipped))
+
+        # Missing files and forced runs are rendered again
+        gender = output_files(ReportItem.GENDER, 2025, self.output_dir, ('png',))
+        gender[0].unlink()
+        written, _ = generate_report(
+            output_dir=self.output_dir, store=store, years=[2025], items=[ReportItem.GENDER], formats=('png',)
+        )
+        self.assertListEqual(gender, written)
+        written, _ = generate_report(
+            output_dir=self.output_dir, store=store, years=[2025], items=[ReportItem.OUTLIERS], force=True
+        )
+        self.assertListEqual(output_files(ReportItem.OUTLIERS, 2025, self.output_dir), written)
+        self.assertIn("2025-country.svg", self.output_dir.joinpath(INDEX_FILE).read_text(encoding='utf-8'))
+
+
+if __name__ == '__main__':
+    unittest.main()